@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import argparse
+from contextlib import redirect_stdout
+import io
+import os
+from pathlib import Path
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Tuple
+
+from benchmarks.bench_pipeline import METADATA
+from benchmarks.stubs import REPO_ROOT, install_stub_tools
+from benchmarks.synthetic import SyntheticSpec, write_synthetic_docx
+from processing.batch import TEMPLATE_DIR
+from processing.pandoc_intermediate import IR_BACKENDS
+from processing.pipeline import run_pipeline, write_output_zip
+
+
+# what a 200-page, 100-figure thesis may peak at.
+LIMIT_MB = 256.0
+
+
+def _rss_mb(maxrss: int) -> float:
+    # kilobytes on linux, bytes on macos.
+    return maxrss / (1024 * 1024) if sys.platform == "darwin" else maxrss / 1024
+
+
+def _convert(args) -> int:
+    """the measured process: one conversion of args.docx, through to the output zip."""
+    work_dir = Path(args.work_dir)
+    with redirect_stdout(io.StringIO()):
+        result = run_pipeline(
+            args.docx,
+            METADATA,
+            work_dir=work_dir,
+            ir_backend=args.ir_backend,
+            figure_dpi=args.figure_dpi,
+            memory_budget_mb=args.memory_budget_mb,
+        )
+    write_output_zip(result, TEMPLATE_DIR, work_dir / "output.zip")
+    return 0
+
+
+def measure_peak_rss(
+    spec: SyntheticSpec,
+    *,
+    ir_backend: str = "native",
+    figure_dpi: int = 300,
+    memory_budget_mb: int = 128,
+    verbose: bool = False,
+) -> Tuple[float, float]:
+    """peak rss in MB and seconds of one conversion of a synthetic docx for spec, with stub tools."""
+    with tempfile.TemporaryDirectory(prefix="msurj-bench-") as tmp:
+        env = install_stub_tools(Path(tmp) / "bin")
+        docx_path = write_synthetic_docx(spec, Path(tmp) / "thesis.docx")
+        if verbose:
+            print(f"{docx_path.stat().st_size / 1e6:.0f} MB docx: {spec}")
+        # a fresh process, so the peak is the conversion's alone.
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [
+                sys.executable, "-m", "benchmarks.bench_memory",
+                "--convert", str(docx_path),
+                "--work-dir", str(Path(tmp) / "work"),
+                "--ir-backend", ir_backend,
+                "--figure-dpi", str(figure_dpi),
+                "--memory-budget-mb", str(memory_budget_mb),
+            ],
+            cwd=REPO_ROOT,
+            env=dict(env, PYTHONPATH=os.pathsep.join(filter(None, [str(REPO_ROOT), env.get("PYTHONPATH")]))),
+        )
+        # the child's own rusage; RUSAGE_CHILDREN would also count every earlier child.
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        seconds = time.perf_counter() - started
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, process.args)
+    return _rss_mb(usage.ru_maxrss), seconds
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.bench_memory",
+        description="peak rss of converting a large synthetic thesis; fails above --limit-mb.",
+    )
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--figures", type=int, default=100)
+    parser.add_argument("--figure-px", type=int, default=2400)
+    parser.add_argument("--figure-format", choices=("png", "jpeg"), default="png")
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--references", type=int, default=300)
+    parser.add_argument("--figure-dpi", type=int, default=300)
+    parser.add_argument("--memory-budget-mb", type=int, default=128)
+    parser.add_argument("--limit-mb", type=float, default=LIMIT_MB)
+    parser.add_argument("--ir-backend", choices=IR_BACKENDS, default="native")
+    parser.add_argument("--convert", metavar="DOCX", dest="docx", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.docx:
+        return _convert(args)
+
+    spec = SyntheticSpec(
+        pages=args.pages,
+        figures=args.figures,
+        tables=args.tables,
+        references=args.references,
+        figure_px=args.figure_px,
+        figure_format=args.figure_format,
+    )
+    peak_mb, seconds = measure_peak_rss(
+        spec,
+        ir_backend=args.ir_backend,
+        figure_dpi=args.figure_dpi,
+        memory_budget_mb=args.memory_budget_mb,
+        verbose=True,
+    )
+    print(f"peak rss {peak_mb:.0f} MB (limit {args.limit_mb:.0f} MB) in {seconds:.1f}s")
+    if peak_mb > args.limit_mb:
+        print("FAILED: peak rss is over the limit.", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
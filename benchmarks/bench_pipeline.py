@@ -0,0 +1,198 @@
+from __future__ import annotations
+
+import argparse
+from contextlib import redirect_stdout
+from dataclasses import asdict
+from datetime import datetime, timezone
+import io
+import json
+import os
+from pathlib import Path
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.stubs import REPO_ROOT, install_stub_tools
+from benchmarks.synthetic import SyntheticSpec, write_synthetic_docx
+from processing.batch import TEMPLATE_DIR
+from processing.citations import locate_references_section, replace_superscript_citations
+from processing.figure_index import FigureIndex
+from processing.get_msurj_conversion import convert_to_msurj, standardize_figs
+from processing.pandoc_intermediate import create_tex_ir
+from processing.pipeline import PipelineResult, iter_output_entries, run_pipeline
+from processing.standardize_tables import standardize_tables
+from processing.table_layout import layout_table
+from processing.zip_stream import stream_zip
+
+
+METADATA = {
+    "authors": "A. Author, B. Author",
+    "title": "A Synthetic Manuscript",
+    "submitted_date": "2026-01-01",
+    "article_type": "Research Article",
+    "affiliations": "Department of Benchmarks",
+    "keywords": "synthetic, benchmark",
+    "email": "author@example.org",
+}
+# a stage is flagged when its best time grows by more than this fraction.
+DEFAULT_THRESHOLD = 0.10
+
+
+def time_stage(fn: Callable[[], object], repeat: int) -> Dict[str, float]:
+    """best and median wall time of repeat calls, in seconds."""
+    times = []
+    for _ in range(repeat):
+        layout_table.cache_clear()  # time the work, not cache hits from the previous run
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return {"min": min(times), "median": statistics.median(times), "runs": repeat}
+
+
+def run_benchmarks(spec: SyntheticSpec, *, work_dir, repeat: int) -> Dict[str, Dict[str, float]]:
+    """time each conversion stage on one synthetic manuscript; pandoc and anystyle must be stubbed."""
+    work_dir = Path(work_dir)
+    docx_path = write_synthetic_docx(spec, work_dir / "synthetic.docx")
+    quiet = io.StringIO()
+    with redirect_stdout(quiet):
+        ir_dir = create_tex_ir(docx_path, ir_tex_dir=work_dir / "ir", backend="native")
+    tex_path = ir_dir / "synthetic.tex"
+    ir_text = tex_path.read_text()
+    figure_index = FigureIndex.build(ir_dir / "Figures")
+    body = ir_text[: locate_references_section(ir_text)[0]]
+    key_map = {n: f"ref{n}" for n in range(1, spec.references + 1)}
+
+    def docx_reader() -> None:
+        with redirect_stdout(quiet):
+            create_tex_ir(docx_path, ir_tex_dir=work_dir / "reader", backend="native")
+
+    converted = {}
+
+    def convert() -> None:
+        converted["tex"], converted["bib"] = convert_to_msurj(
+            tex_path, METADATA, return_bibtex=True, anystyle_cmd="anystyle"
+        )
+
+    results = {
+        "docx_reader": time_stage(docx_reader, repeat),
+        "standardize_tables": time_stage(lambda: standardize_tables(ir_text), repeat),
+        "standardize_figs": time_stage(
+            lambda: standardize_figs(ir_text, figure_index=figure_index), repeat
+        ),
+        "replace_superscript_citations": time_stage(
+            lambda: replace_superscript_citations(body, key_map, strict=False), repeat
+        ),
+        "convert_to_msurj": time_stage(convert, repeat),
+    }
+
+    result = PipelineResult("synthetic", converted["tex"], converted["bib"], ir_dir / "Figures")
+
+    def zip_output() -> None:
+        for _ in stream_zip(iter_output_entries(result, TEMPLATE_DIR)):
+            pass
+
+    results["zip"] = time_stage(zip_output, repeat)
+
+    runs = iter(range(repeat))
+
+    def pipeline() -> None:
+        with redirect_stdout(quiet):
+            run_pipeline(docx_path, METADATA, work_dir=work_dir / f"pipeline{next(runs)}")
+
+    results["pipeline"] = time_stage(pipeline, repeat)
+    return results
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def compare(current: dict, baseline: dict, *, threshold: float) -> List[str]:
+    """one line per stage whose best time grew by more than threshold over baseline."""
+    regressions = []
+    for name, stats in current["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if not before or before["min"] <= 0:
+            continue
+        ratio = stats["min"] / before["min"]
+        if ratio > 1 + threshold:
+            regressions.append(
+                f"{name}: {before['min'] * 1000:.1f}ms -> {stats['min'] * 1000:.1f}ms ({ratio - 1:+.0%})"
+            )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_pipeline")
+    parser.add_argument("--pages", type=int, default=SyntheticSpec.pages)
+    parser.add_argument("--figures", type=int, default=SyntheticSpec.figures)
+    parser.add_argument("--tables", type=int, default=SyntheticSpec.tables)
+    parser.add_argument("--references", type=int, default=SyntheticSpec.references)
+    parser.add_argument(
+        "--citation-density", type=float, default=SyntheticSpec.citation_density,
+        help="superscript citations per paragraph.",
+    )
+    parser.add_argument(
+        "--figure-px", type=int, default=SyntheticSpec.figure_px, help="figure width in pixels."
+    )
+    parser.add_argument("--seed", type=int, default=SyntheticSpec.seed)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this json file.")
+    parser.add_argument("--compare", help="results json of an earlier run to check against.")
+    parser.add_argument(
+        "--threshold", type=float, default=DEFAULT_THRESHOLD,
+        help="slowdown (as a fraction) that counts as a regression (default: 0.10).",
+    )
+    args = parser.parse_args(argv)
+
+    spec = SyntheticSpec(
+        pages=args.pages,
+        figures=args.figures,
+        tables=args.tables,
+        references=args.references,
+        citation_density=args.citation_density,
+        figure_px=args.figure_px,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory(prefix="msurj-bench-") as tmp:
+        os.environ.update(install_stub_tools(Path(tmp) / "bin"))
+        stages = run_benchmarks(spec, work_dir=Path(tmp) / "work", repeat=args.repeat)
+
+    report = {
+        "spec": asdict(spec),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "stages": stages,
+    }
+    print(f"{'stage':<30} {'min':>10} {'median':>10}")
+    for name, stats in stages.items():
+        print(f"{name:<30} {stats['min'] * 1000:>8.1f}ms {stats['median'] * 1000:>8.1f}ms")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        if baseline.get("spec") != report["spec"]:
+            print("warning: the baseline was run on a different manuscript spec.", file=sys.stderr)
+        regressions = compare(report, baseline, threshold=args.threshold)
+        for line in regressions:
+            print(f"regression: {line}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import argparse
+import random
+import time
+from typing import Callable, List
+
+from processing.latex_rewrite import RewriteOptions, rewrite_latex
+from processing.latex_scan import scan_environments
+from processing.standardize_tables import standardize_tables
+from processing.table_layout import layout_table
+
+
+PARAGRAPH = (
+    "Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua.\n\n"
+)
+
+
+def _cell(rng: random.Random, row: int, col: int) -> str:
+    if rng.random() < 0.1:
+        # pandoc wraps multi-paragraph cells in minipages.
+        return (
+            "\\begin{minipage}[t]{\\linewidth}\\raggedright\n"
+            f"Cell {row}.{col} {{with [brackets]}}\n\\end{{minipage}}"
+        )
+    return f"{row}.{col} \\% done"
+
+
+def synthetic_table(rng: random.Random, index: int, *, nested: bool) -> str:
+    """a pandoc-style longtable: caption, repeated header, some minipage cells."""
+    cols = rng.randint(2, 8)
+    colspec = "@{}" + "".join(rng.choice("lcr") for _ in range(cols)) + "@{}"
+    header = " & ".join(f"H{c}" for c in range(cols)) + " \\\\\n"
+    rows = "".join(
+        " & ".join(_cell(rng, r, c) for c in range(cols)) + " \\\\\n"
+        for r in range(rng.randint(3, 30))
+    )
+    if nested:
+        inner = (
+            "\\begin{minipage}[t]{\\linewidth}\n"
+            "\\begin{longtable}[]{@{}ll@{}}\n\\caption{Inner}\\tabularnewline\n"
+            "a & b \\\\\n\\endhead\n1 & 2 \\\\\n\\end{longtable}\n\\end{minipage}"
+        )
+        rows += inner + " & " * (cols - 1) + " \\\\\n"
+    return (
+        f"\\begin{{longtable}}[]{{{colspec}}}\n"
+        f"\\caption{{Table {index} [synthetic].}}\\tabularnewline\n"
+        f"\\toprule\\noalign{{}}\n{header}\\midrule\\noalign{{}}\n\\endfirsthead\n"
+        f"\\toprule\\noalign{{}}\n{header}\\midrule\\noalign{{}}\n\\endhead\n"
+        f"\\bottomrule\\noalign{{}}\n\\endlastfoot\n{rows}\\end{{longtable}}\n\n"
+    )
+
+
+def synthetic_paper(tables: int, *, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    parts: List[str] = []
+    for i in range(tables):
+        if i % 10 == 0:
+            parts.append(f"\\section{{Section {i // 10}}}\n\n")
+        parts.append(PARAGRAPH * rng.randint(1, 4))
+        parts.append(synthetic_table(rng, i, nested=i % 25 == 0))
+    return "".join(parts)
+
+
+def best_of(fn: Callable[[], object], repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        layout_table.cache_clear()  # time the layout pass, not cache hits
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return min(times)
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_tables")
+    parser.add_argument("--tables", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    options = RewriteOptions(tables=True)
+    print(f"{'tables':>7} {'chars':>10} {'scan':>9} {'standardize_tables':>19} {'rewrite_latex':>14}")
+    for count in args.tables:
+        paper = synthetic_paper(count)
+        scan_s = best_of(lambda: scan_environments(paper), args.repeat)
+        tables_s = best_of(lambda: standardize_tables(paper), args.repeat)
+        rewrite_s = best_of(lambda: rewrite_latex(paper, options), args.repeat)
+        print(
+            f"{count:>7} {len(paper):>10} {scan_s * 1000:>7.1f}ms"
+            f" {tables_s * 1000:>17.1f}ms {rewrite_s * 1000:>12.1f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
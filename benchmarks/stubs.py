@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import sys
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# answers the one pandoc invocation processing.pandoc_intermediate makes,
+# using the native reader, which writes the latex pandoc would.
+PANDOC_STUB = """\
+import argparse
+import sys
+
+sys.path.insert(0, {root!r})
+from processing.docx_reader import read_docx_to_tex
+
+parser = argparse.ArgumentParser()
+parser.add_argument("input")
+parser.add_argument("--output", required=True)
+parser.add_argument("--extract-media", required=True)
+args, _ = parser.parse_known_args()
+media = f"{{args.extract_media}}/media"
+read_docx_to_tex(args.input, args.output, media, media_prefix=media)
+"""
+
+# `anystyle --stdout -f bib parse <file>`: one @article per reference line.
+ANYSTYLE_STUB = """\
+import sys
+
+lines = [line for line in open(sys.argv[-1]).read().splitlines() if line.strip()]
+for i, line in enumerate(lines):
+    title = line.replace("{{", "").replace("}}", "")
+    print(f"@article{{{{stub{{i}},\\n  title = {{{{{{title}}}}}}\\n}}}}")
+"""
+
+
+def _write_script(path: Path, source: str) -> Path:
+    path.write_text(f"#!{sys.executable}\n{source}")
+    path.chmod(0o755)
+    return path
+
+
+def install_stub_tools(directory) -> dict:
+    """
+    write offline pandoc and anystyle stand-ins into directory and return an
+    environment with it first on PATH and the warm anystyle daemon off.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    _write_script(directory / "pandoc", PANDOC_STUB.format(root=str(REPO_ROOT)))
+    _write_script(directory / "anystyle", ANYSTYLE_STUB.format())
+    env = dict(os.environ)
+    env["PATH"] = f"{directory}{os.pathsep}{env.get('PATH', '')}"
+    env["MSURJ_ANYSTYLE_WORKERS"] = "0"
+    env["MSURJ_REFERENCE_CACHE_ENTRIES"] = "0"
+    return env
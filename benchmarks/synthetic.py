@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import random
+import struct
+from typing import Iterable, List, Tuple, Union
+from xml.sax.saxutils import escape, quoteattr
+import zipfile
+import zlib
+
+from processing.docx_reader import EMU_PER_INCH, read_docx_to_tex
+
+
+WORDS_PER_PARAGRAPH = 110
+PARAGRAPHS_PER_PAGE = 5
+PARAGRAPHS_PER_SECTION = 8
+FIGURE_PX = 800  # width; figures are 4:3
+FIGURE_WIDTH_IN = 3.0
+SECTION_TITLES = ["Introduction", "Methods", "Results", "Discussion", "Limitations", "Conclusion"]
+VOCABULARY = (
+    "cell protein expression patients cohort signal model data analysis significant "
+    "increase decrease response treatment control group samples measured observed "
+    "associated with between during after before the of and in a to was were is "
+    "these results suggest that further studies mechanism pathway clinical outcome"
+).split()
+
+_NS = (
+    'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"'
+)
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Default Extension="png" ContentType="image/png"/>'
+    '<Default Extension="jpeg" ContentType="image/jpeg"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '<Override PartName="/word/numbering.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"/>'
+    "</Types>"
+)
+_PACKAGE_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+    "</Relationships>"
+)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f"<w:styles {_NS}>"
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Caption"><w:name w:val="caption"/></w:style>'
+    "</w:styles>"
+)
+_NUMBERING = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    f"<w:numbering {_NS}>"
+    '<w:abstractNum w:abstractNumId="0"><w:lvl w:ilvl="0"><w:start w:val="1"/>'
+    '<w:numFmt w:val="decimal"/><w:lvlText w:val="%1."/></w:lvl></w:abstractNum>'
+    '<w:num w:numId="1"><w:abstractNumId w:val="0"/></w:num>'
+    "</w:numbering>"
+)
+
+# a paragraph is a list of plain text and ("cite", numbers) superscripts.
+Inline = Union[str, Tuple[str, str]]
+
+
+@dataclass(frozen=True)
+class SyntheticSpec:
+    """the shape of a generated manuscript; citation_density is citations per paragraph."""
+
+    pages: int = 10
+    figures: int = 4
+    tables: int = 3
+    references: int = 40
+    citation_density: float = 1.0
+    figure_px: int = FIGURE_PX
+    # "png", or "jpeg" for camera-style figures (needs pillow to generate).
+    figure_format: str = "png"
+    seed: int = 0
+
+
+@dataclass
+class _Manuscript:
+    abstract: List[List[Inline]]
+    # ("heading", title), ("paragraph", inlines), ("figure", n) or ("table", n, rows)
+    blocks: List[tuple]
+    references: List[str]
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    text = " ".join(rng.choice(VOCABULARY) for _ in range(words))
+    return text[0].upper() + text[1:] + "."
+
+
+def _citation(rng: random.Random, references: int) -> str:
+    first = rng.randint(1, references)
+    roll = rng.random()
+    if roll < 0.2 and first + 2 <= references:
+        return f"{first}-{rng.randint(first + 2, min(references, first + 6))}"
+    if roll < 0.4:
+        return ",".join(str(n) for n in sorted(rng.sample(range(1, references + 1), min(2, references))))
+    return str(first)
+
+
+def _paragraph(rng: random.Random, spec: SyntheticSpec) -> List[Inline]:
+    citations = int(spec.citation_density)
+    if rng.random() < spec.citation_density - citations:
+        citations += 1
+    sentences = max(1, WORDS_PER_PARAGRAPH // 14)
+    cited = set(rng.sample(range(sentences), min(citations, sentences))) if spec.references else set()
+    inlines: List[Inline] = []
+    for i in range(sentences):
+        inlines.append(_sentence(rng, rng.randint(8, 20)))
+        if i in cited:
+            inlines.append(("cite", _citation(rng, spec.references)))
+        inlines.append(" ")
+    inlines[-1] = ""
+    return inlines
+
+
+def _reference(rng: random.Random, n: int) -> str:
+    authors = ", ".join(
+        f"{rng.choice('BCDFGHKLMNPRST')}{rng.choice('aeiou')}ller {rng.choice('ABCDE')}"
+        for _ in range(rng.randint(1, 4))
+    )
+    title = _sentence(rng, rng.randint(6, 14))
+    return f"{authors}. {title} J Synth Res. {2000 + n % 25};{n}({rng.randint(1, 12)}):{n * 3}-{n * 3 + 9}."
+
+
+def _table_rows(rng: random.Random) -> List[List[str]]:
+    cols = rng.randint(2, 6)
+    rows = [[f"Column {c + 1}" for c in range(cols)]]
+    for _ in range(rng.randint(4, 20)):
+        label = " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(1, 6)))
+        rows.append([label] + [f"{rng.random() * 100:.2f}" for _ in range(cols - 1)])
+    return rows
+
+
+def _plan(spec: SyntheticSpec) -> _Manuscript:
+    rng = random.Random(spec.seed)
+    paragraphs = max(1, spec.pages * PARAGRAPHS_PER_PAGE)
+    abstract = [_paragraph(rng, spec)]
+    # figures and tables are spread evenly through the body.
+    floats = {}
+    for n in range(spec.figures):
+        floats.setdefault((n * paragraphs) // max(1, spec.figures), []).append(("figure", n + 1))
+    for n in range(spec.tables):
+        floats.setdefault((n * paragraphs) // max(1, spec.tables), []).append(
+            ("table", n + 1, _table_rows(rng))
+        )
+
+    blocks: List[tuple] = []
+    for i in range(paragraphs):
+        if i % PARAGRAPHS_PER_SECTION == 0:
+            title = SECTION_TITLES[(i // PARAGRAPHS_PER_SECTION) % len(SECTION_TITLES)]
+            blocks.append(("heading", f"{title} {i // PARAGRAPHS_PER_SECTION + 1}"))
+        blocks.append(("paragraph", _paragraph(rng, spec)))
+        blocks.extend(floats.get(i, ()))
+    references = [_reference(rng, n + 1) for n in range(spec.references)]
+    return _Manuscript(abstract, blocks, references)
+
+
+def synthetic_png(rng: random.Random, width: int, height: int) -> bytes:
+    """an 8-bit grayscale png of noise, so it compresses about as badly as a photograph."""
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    raw = b"".join(b"\0" + rng.randbytes(width) for _ in range(height))
+    return (
+        b"\x89PNG\r\n\x1a\n"
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(raw, 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def synthetic_jpeg(rng: random.Random, width: int, height: int) -> bytes:
+    """the noise of synthetic_png as an rgb jpeg, the way phone photos arrive."""
+    import io
+
+    from PIL import Image
+
+    image = Image.frombytes("L", (width, height), rng.randbytes(width * height)).convert("RGB")
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=92)
+    return out.getvalue()
+
+
+def _run(text: str, *, superscript: bool = False) -> str:
+    rpr = '<w:rPr><w:vertAlign w:val="superscript"/></w:rPr>' if superscript else ""
+    return f'<w:r>{rpr}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>'
+
+
+def _p(inlines: List[Inline], *, style: str = "", numbered: bool = False) -> str:
+    ppr = ""
+    if style or numbered:
+        ppr = "<w:pPr>"
+        if style:
+            ppr += f'<w:pStyle w:val="{style}"/>'
+        if numbered:
+            ppr += '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>'
+        ppr += "</w:pPr>"
+    runs = "".join(
+        _run(i[1], superscript=True) if isinstance(i, tuple) else _run(i) for i in inlines if i
+    )
+    return f"<w:p>{ppr}{runs}</w:p>"
+
+
+def _figure(n: int) -> str:
+    cx = int(FIGURE_WIDTH_IN * EMU_PER_INCH)
+    cy = cx * 3 // 4
+    return (
+        f'<w:p><w:r><w:drawing><wp:inline><wp:extent cx="{cx}" cy="{cy}"/>'
+        f'<wp:docPr id="{n}" name="Picture {n}"/>'
+        '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f'<pic:pic><pic:blipFill><a:blip r:embed="rIdImage{n}"/></pic:blipFill></pic:pic>'
+        "</a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>"
+        + _p([f"Figure {n}. Synthetic figure & caption."], style="Caption")
+    )
+
+
+def _table(n: int, rows: List[List[str]]) -> str:
+    grid = "".join('<w:gridCol w:w="1800"/>' for _ in rows[0])
+    body = []
+    for r, row in enumerate(rows):
+        trpr = "<w:trPr><w:tblHeader/></w:trPr>" if r == 0 else ""
+        cells = "".join(f"<w:tc>{_p([cell])}</w:tc>" for cell in row)
+        body.append(f"<w:tr>{trpr}{cells}</w:tr>")
+    return (
+        _p([f"Table {n}. Synthetic table with {len(rows) - 1} rows."], style="Caption")
+        + f"<w:tbl><w:tblPr/><w:tblGrid>{grid}</w:tblGrid>{''.join(body)}</w:tbl>"
+    )
+
+
+def write_synthetic_docx(spec: SyntheticSpec, path) -> Path:
+    """
+    a manuscript the way msurj receives them: abstract, numbered references and
+    superscript citations, with spec.figures noise images and spec.tables tables.
+    """
+    path = Path(path)
+    if spec.figure_format not in ("png", "jpeg"):
+        raise ValueError(f"unknown figure format: {spec.figure_format}")
+    manuscript = _plan(spec)
+    rng = random.Random(spec.seed + 1)
+
+    body = [_p(["Abstract"], style="Heading1")]
+    body += [_p(paragraph) for paragraph in manuscript.abstract]
+    for block in manuscript.blocks:
+        kind = block[0]
+        if kind == "heading":
+            body.append(_p([block[1]], style="Heading1"))
+        elif kind == "paragraph":
+            body.append(_p(block[1]))
+        elif kind == "figure":
+            body.append(_figure(block[1]))
+        else:
+            body.append(_table(block[1], block[2]))
+    body.append(_p(["References"], style="Heading1"))
+    body += [_p([reference], numbered=True) for reference in manuscript.references]
+
+    rels = [
+        f'<Relationship Id="rIdImage{n}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" Target={quoteattr(f"media/image{n}.{spec.figure_format}")}/>'
+        for n in range(1, spec.figures + 1)
+    ]
+    make = synthetic_jpeg if spec.figure_format == "jpeg" else synthetic_png
+    media = (
+        (f"image{n}.{spec.figure_format}", make(rng, spec.figure_px, spec.figure_px * 3 // 4))
+        for n in range(1, spec.figures + 1)
+    )
+    return write_docx(path, "".join(body), rels=rels, media=media)
+
+
+def write_docx(path, body: str, *, rels: Iterable[str] = (), media: Iterable[Tuple[str, bytes]] = ()) -> Path:
+    """
+    a minimal docx around body, the xml inside <w:body>, with the Heading1,
+    Heading2 and Caption styles and the decimal list (numId 1) the synthetic manuscripts use.
+    rels are extra <Relationship/> elements of word/document.xml; media are
+    (name, data) pairs written to word/media/, one at a time.
+    """
+    path = Path(path)
+    rels = [
+        '<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>',
+        '<Relationship Id="rIdNumbering" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/numbering" Target="numbering.xml"/>',
+        *rels,
+    ]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        docx.writestr("_rels/.rels", _PACKAGE_RELS)
+        docx.writestr(
+            "word/_rels/document.xml.rels",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            + "".join(rels) + "</Relationships>",
+        )
+        docx.writestr("word/styles.xml", _STYLES)
+        docx.writestr("word/numbering.xml", _NUMBERING)
+        docx.writestr(
+            "word/document.xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            f"<w:document {_NS}><w:body>{body}</w:body></w:document>",
+        )
+        for name, data in media:
+            # already compressed; storing it keeps generation cheap.
+            docx.writestr(f"word/media/{name}", data, zipfile.ZIP_STORED)
+    return path
+
+
+def write_synthetic_ir(spec: SyntheticSpec, work_dir, *, name: str = "synthetic") -> Path:
+    """
+    the pandoc latex and Figures/ dir for spec under work_dir/name, read from
+    the generated docx with the native reader, which writes what pandoc would.
+    """
+    work_dir = Path(work_dir) / name
+    docx_path = write_synthetic_docx(spec, work_dir / f"{name}.docx")
+    return read_docx_to_tex(docx_path, work_dir / f"{name}.tex", work_dir / "Figures", media_prefix="media")
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import argparse
+import os
+from pathlib import Path
+import sys
+import time
+
+from processing.asset_store import STORE_DIR, AssetStore
+from processing.batch import (
+    TEMPLATE_DIR,
+    discover_manuscripts,
+    find_sidecar,
+    format_summary,
+    load_metadata,
+    run_batch,
+)
+from processing.pandoc_intermediate import IR_BACKENDS
+
+
+def _batch(args) -> int:
+    input_dir = Path(args.input_dir)
+    if not input_dir.is_dir():
+        print(f"{input_dir} is not a directory.", file=sys.stderr)
+        return 2
+
+    sidecar = Path(args.metadata) if args.metadata else find_sidecar(input_dir)
+    metadata = load_metadata(sidecar) if sidecar else {}
+    for docx_path in discover_manuscripts(input_dir):
+        if docx_path.stem not in metadata:
+            print(f"warning: no metadata for {docx_path.name}; header fields left blank.", file=sys.stderr)
+
+    def report(result) -> None:
+        status = f"ok -> {result.output}" if result.ok else f"FAILED: {result.error}"
+        print(f"{result.paper_num}: {status}", flush=True)
+        for warning in result.warnings:
+            print(f"{result.paper_num}: warning: {warning}", flush=True)
+
+    started = time.perf_counter()
+    results = run_batch(
+        input_dir,
+        args.output_dir or input_dir / "output",
+        metadata=metadata,
+        jobs=args.jobs,
+        template_dir=args.template_dir,
+        as_zip=not args.folders,
+        anystyle_cmd=args.anystyle_cmd,
+        cache_dir=args.cache_dir,
+        use_cache=not args.no_cache,
+        ir_backend=args.ir_backend,
+        figure_dpi=args.figure_dpi,
+        memory_budget_mb=args.memory_budget_mb,
+        preview=args.preview,
+        on_result=report,
+    )
+    print(format_summary(results, wall_seconds=time.perf_counter() - started))
+    return 0 if all(r.ok for r in results) else 1
+
+
+def _gc(args) -> int:
+    output_dir = Path(args.output_dir)
+    if not (output_dir / STORE_DIR).is_dir():
+        print(f"{output_dir} has no {STORE_DIR} store.", file=sys.stderr)
+        return 2
+    removed, freed = AssetStore(output_dir).gc(dry_run=args.dry_run)
+    verb = "would remove" if args.dry_run else "removed"
+    print(f"{verb} {removed} unused files ({freed / 1e6:.1f} MB).")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m processing")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="convert every .docx in a directory.")
+    batch.add_argument("input_dir")
+    batch.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="manuscripts converted at the same time (default: cpu count).",
+    )
+    batch.add_argument(
+        "--metadata",
+        help="csv or json with one row per paper (default: metadata.csv/.json in input_dir).",
+    )
+    batch.add_argument("--output-dir", help="where zips or folders go (default: input_dir/output).")
+    batch.add_argument("--folders", action="store_true", help="write folders instead of zips.")
+    batch.add_argument("--template-dir", default=TEMPLATE_DIR)
+    batch.add_argument("--anystyle-cmd", default="anystyle")
+    batch.add_argument("--ir-backend", choices=IR_BACKENDS, default="pandoc")
+    batch.add_argument(
+        "--figure-dpi", type=int,
+        help="downscale and recompress png/jpeg figures to this dpi (needs pillow).",
+    )
+    batch.add_argument(
+        "--memory-budget-mb", type=int,
+        help="per manuscript: cap pandoc's memory and the figures decoded at once.",
+    )
+    batch.add_argument(
+        "--preview", action="store_true",
+        help="experimental: also compile each paper with xelatex into preview.pdf and preview-errors.txt.",
+    )
+    batch.add_argument("--cache-dir", help="pipeline cache root (default: MSURJ_CACHE_DIR).")
+    batch.add_argument("--no-cache", action="store_true")
+    batch.set_defaults(func=_batch)
+
+    gc = commands.add_parser(
+        "gc", help="delete stored fonts and figures no paper folder in an output dir uses anymore."
+    )
+    gc.add_argument("output_dir")
+    gc.add_argument("--dry-run", action="store_true", help="only report what would be deleted.")
+    gc.set_defaults(func=_gc)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
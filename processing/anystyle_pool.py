@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import atexit
+import json
+import os
+from pathlib import Path
+import queue
+import selectors
+import shutil
+import subprocess
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+
+WORKER_SCRIPT = Path(__file__).with_name("anystyle_worker.rb")
+
+
+class AnyStyleWorkerError(RuntimeError):
+    pass
+
+
+def ruby_for_anystyle(anystyle_cmd: str = "anystyle") -> str:
+    """
+    find the ruby interpreter that owns the anystyle gem.
+    the gem binstub's shebang names it; plain `ruby` is the fallback.
+    """
+    path = shutil.which(anystyle_cmd)
+    if path:
+        try:
+            with open(path, "rb") as fh:
+                first_line = fh.readline(512).decode("utf-8", "replace").strip()
+        except OSError:
+            first_line = ""
+        if first_line.startswith("#!") and "ruby" in first_line:
+            parts = first_line[2:].split()
+            if parts and Path(parts[0]).name == "env" and len(parts) > 1:
+                return parts[1]
+            if parts:
+                return parts[0]
+    return "ruby"
+
+
+class AnyStyleWorker:
+    """one ruby process running anystyle_worker.rb, spoken to over stdin/stdout."""
+
+    def __init__(self, *, ruby_cmd: str = "ruby", startup_timeout: float = 60.0):
+        self.ruby_cmd = ruby_cmd
+        self.startup_timeout = startup_timeout
+        self._proc: Optional[subprocess.Popen] = None
+        self._buffer = b""
+        # time.monotonic() of the last answer, so an idle worker can be pinged before use.
+        self.last_answer = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self) -> None:
+        self.close()
+        try:
+            self._proc = subprocess.Popen(
+                [self.ruby_cmd, str(WORKER_SCRIPT)],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        except OSError as exc:
+            raise AnyStyleWorkerError(f"could not start AnyStyle worker: {exc}") from exc
+        self._buffer = b""
+        # the first ping only returns once the parser model has loaded.
+        self.ping(timeout=self.startup_timeout)
+
+    def ping(self, *, timeout: float = 5.0) -> bool:
+        return bool(self.request({"op": "ping"}, timeout=timeout).get("ok"))
+
+    def parse(self, references: List[str], *, timeout: float = 120.0) -> str:
+        response = self.request({"op": "parse", "references": references}, timeout=timeout)
+        if not response.get("ok"):
+            raise AnyStyleWorkerError(f"AnyStyle worker failed: {response.get('error')}")
+        return response.get("bibtex", "")
+
+    def request(self, payload: dict, *, timeout: float) -> dict:
+        if not self.alive:
+            raise AnyStyleWorkerError("AnyStyle worker is not running.")
+        try:
+            self._proc.stdin.write(json.dumps(payload).encode("utf-8") + b"\n")
+            self._proc.stdin.flush()
+        except OSError as exc:
+            self.close()
+            raise AnyStyleWorkerError("AnyStyle worker pipe closed.") from exc
+
+        line = self._read_line(timeout)
+        try:
+            response = json.loads(line)
+        except ValueError as exc:
+            self.close()
+            raise AnyStyleWorkerError("AnyStyle worker sent an invalid response.") from exc
+        self.last_answer = time.monotonic()
+        return response
+
+    def _read_line(self, timeout: float) -> bytes:
+        deadline = time.monotonic() + timeout
+        fd = self._proc.stdout.fileno()
+        with selectors.DefaultSelector() as sel:
+            sel.register(fd, selectors.EVENT_READ)
+            while b"\n" not in self._buffer:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not sel.select(remaining):
+                    self.close()
+                    raise AnyStyleWorkerError("AnyStyle worker timed out.")
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    self.close()
+                    raise AnyStyleWorkerError("AnyStyle worker exited unexpectedly.")
+                self._buffer += chunk
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return line
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        for stream in (proc.stdin, proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+class AnyStylePool:
+    """
+    a fixed set of warm AnyStyle workers.
+    dead workers are restarted when they are next checked out, and one idle
+    for ping_after seconds is pinged first, so a hung worker costs
+    ping_timeout rather than a whole parse timeout. if workers cannot be
+    started at all the pool backs off and callers use the cli.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        *,
+        ruby_cmd: str = "ruby",
+        timeout: float = 120.0,
+        startup_timeout: float = 60.0,
+        retry_after: float = 300.0,
+        ping_after: float = 30.0,
+        ping_timeout: float = 5.0,
+    ):
+        self.size = size
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.ping_after = ping_after
+        self.ping_timeout = ping_timeout
+        self._idle: "queue.Queue[AnyStyleWorker]" = queue.Queue()
+        for _ in range(size):
+            self._idle.put(AnyStyleWorker(ruby_cmd=ruby_cmd, startup_timeout=startup_timeout))
+        self._unavailable_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.size > 0 and time.monotonic() >= self._unavailable_until
+
+    def parse(self, references: Iterable[str]) -> str:
+        if not self.available:
+            raise AnyStyleWorkerError("AnyStyle worker pool is unavailable.")
+
+        refs = list(references)
+        worker = self._idle.get()
+        try:
+            for attempt in range(2):
+                try:
+                    self._check_out(worker)
+                    return worker.parse(refs, timeout=self.timeout)
+                except AnyStyleWorkerError:
+                    if attempt or worker.alive:
+                        raise
+                    # the worker crashed; restart it once before giving up.
+        except AnyStyleWorkerError:
+            if not worker.alive:
+                self._unavailable_until = time.monotonic() + self.retry_after
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def _check_out(self, worker: AnyStyleWorker) -> None:
+        """make worker ready for a parse: started, and answering if it sat idle."""
+        if worker.alive:
+            if time.monotonic() - worker.last_answer < self.ping_after:
+                return
+            try:
+                if worker.ping(timeout=self.ping_timeout):
+                    return
+            except AnyStyleWorkerError:
+                pass  # hung or died while idle; the failed request closed it
+        worker.start()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_POOLS: Dict[str, AnyStylePool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_anystyle_pool(anystyle_cmd: str = "anystyle") -> Optional[AnyStylePool]:
+    """
+    process-wide pool for the ruby that owns anystyle_cmd.
+    MSURJ_ANYSTYLE_WORKERS sets the pool size; 0 turns the daemon off.
+    """
+    size = int(os.environ.get("MSURJ_ANYSTYLE_WORKERS", "1"))
+    if size <= 0:
+        return None
+
+    ruby_cmd = ruby_for_anystyle(anystyle_cmd)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(ruby_cmd)
+        if pool is None:
+            pool = AnyStylePool(size, ruby_cmd=ruby_cmd)
+            _POOLS[ruby_cmd] = pool
+        return pool
+
+
+@atexit.register
+def _close_pools() -> None:
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
@@ -0,0 +1,29 @@
+# Long-lived AnyStyle worker used by processing/anystyle_pool.py.
+# Reads one JSON request per line on stdin and writes one JSON response per line.
+#   {"op": "ping"}                          -> {"ok": true}
+#   {"op": "parse", "references": [...]}   -> {"ok": true, "bibtex": "..."}
+
+require 'json'
+require 'anystyle'
+
+parser = AnyStyle.parser
+$stdout.sync = true
+
+STDIN.each_line do |line|
+  response =
+    begin
+      request = JSON.parse(line)
+      case request['op']
+      when 'ping'
+        { 'ok' => true }
+      when 'parse'
+        text = Array(request['references']).join("\n")
+        { 'ok' => true, 'bibtex' => parser.parse(text, format: 'bibtex').to_s }
+      else
+        { 'ok' => false, 'error' => "unknown op: #{request['op']}" }
+      end
+    rescue StandardError => e
+      { 'ok' => false, 'error' => "#{e.class}: #{e.message}" }
+    end
+  puts JSON.generate(response)
+end
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import shutil
+import stat
+import tempfile
+from typing import Dict, Tuple
+
+from processing.cache import sha256_file, sha256_hex, write_atomic
+
+
+STORE_DIR = ".blobs"
+# linux ioctl that makes dst share src's extents (btrfs, xfs); other systems copy.
+FICLONE = 0x40049409
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    import fcntl  # posix only
+
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except OSError:
+            d.close()
+            dst.unlink()
+            raise
+
+
+class AssetStore:
+    """
+    files kept once by content under <root>/.blobs/<aa>/<sha256>. output
+    trees are assembled from hardlinks to them, or reflinks and then copies
+    where the file system cannot hardlink, and each tree's manifest records
+    the blobs it uses so gc can drop the ones no tree refers to anymore.
+    blobs are read-only: a linked file is shared by every tree using it.
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.blob_root = self.root / STORE_DIR
+        self.manifest_root = self.blob_root / "manifests"
+
+    def blob_path(self, digest: str) -> Path:
+        return self.blob_root / digest[:2] / digest
+
+    def put(self, src) -> str:
+        """store src by content and return its sha256."""
+        src = Path(src)
+        digest = sha256_file(src)
+        blob = self.blob_path(digest)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=blob.parent, prefix=".tmp-")
+            os.close(fd)
+            shutil.copyfile(src, tmp)
+            os.chmod(tmp, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tmp, blob)  # same content either way if two writers race
+        return digest
+
+    def link(self, digest: str, dest) -> str:
+        """place the blob at dest; returns how: "hardlink", "reflink" or "copy"."""
+        blob = self.blob_path(digest)
+        dest = Path(dest)
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        if dest.exists() or dest.is_symlink():
+            dest.unlink()
+        try:
+            os.link(blob, dest)
+            return "hardlink"
+        except OSError:
+            pass  # another device, or no hardlinks on this file system
+        try:
+            _reflink(blob, dest)
+            return "reflink"
+        except (ImportError, OSError):
+            pass
+        shutil.copyfile(blob, dest)
+        return "copy"
+
+    def add_tree(self, src_dir, dest_dir) -> Dict[str, str]:
+        """store every file below src_dir and link it to the same place below dest_dir; {relpath: sha256}."""
+        src_dir = Path(src_dir)
+        dest_dir = Path(dest_dir)
+        files = {}
+        for path in sorted(src_dir.rglob("*")):
+            relpath = path.relative_to(src_dir).as_posix()
+            if path.is_dir():
+                (dest_dir / relpath).mkdir(parents=True, exist_ok=True)
+                continue
+            digest = self.put(path)
+            self.link(digest, dest_dir / relpath)
+            files[relpath] = digest
+        return files
+
+    def _manifest_path(self, tree: str) -> Path:
+        return self.manifest_root / f"{sha256_hex(tree)[:32]}.json"
+
+    def write_manifest(self, tree_dir, files: Dict[str, str]) -> None:
+        """record that tree_dir (below root) uses files, replacing its earlier manifest."""
+        tree = Path(tree_dir).resolve().relative_to(self.root.resolve()).as_posix()
+        self.manifest_root.mkdir(parents=True, exist_ok=True)
+        write_atomic(self._manifest_path(tree), json.dumps({"tree": tree, "files": files}, sort_keys=True))
+
+    def referenced(self, *, prune: bool = False) -> set:
+        """digests used by a file that is still in its tree; prune deletes the manifests of removed trees."""
+        digests = set()
+        if not self.manifest_root.exists():
+            return digests
+        for manifest in self.manifest_root.glob("*.json"):
+            try:
+                data = json.loads(manifest.read_text())
+            except (OSError, ValueError):
+                continue
+            tree = self.root / data["tree"]
+            if not tree.is_dir():
+                if prune:
+                    manifest.unlink(missing_ok=True)
+                continue
+            for relpath, digest in data["files"].items():
+                if (tree / relpath).exists():
+                    digests.add(digest)
+        return digests
+
+    def gc(self, *, dry_run: bool = False) -> Tuple[int, int]:
+        """remove blobs no tree refers to; (blobs removed, bytes freed)."""
+        keep = self.referenced(prune=not dry_run)
+        removed = freed = 0
+        for shard in self.blob_root.glob("??"):
+            for blob in shard.iterdir():
+                if blob.name in keep or blob.name.startswith(".tmp-"):
+                    continue
+                # a hardlink made by a tree whose manifest was lost still counts.
+                st = blob.stat()
+                if st.st_nlink > 1:
+                    continue
+                removed += 1
+                freed += st.st_size
+                if not dry_run:
+                    blob.unlink()
+        return removed, freed
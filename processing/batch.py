@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+import csv
+from dataclasses import dataclass, field
+import functools
+import json
+import multiprocessing
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Tuple
+
+from processing.asset_store import AssetStore
+from processing.get_msurj_conversion import create_output_directory
+from processing.metrics import stage
+from processing.pipeline import run_pipeline, write_output_zip
+from processing.pipeline_cache import PipelineCache
+
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+TEMPLATE_DIR = PROJECT_ROOT / "output" / "template_dir"
+
+METADATA_FIELDS = (
+    "authors",
+    "title",
+    "submitted_date",
+    "article_type",
+    "affiliations",
+    "keywords",
+    "email",
+)
+# column or key naming the manuscript a metadata row belongs to (docx stem or filename).
+PAPER_FIELDS = ("paper", "file", "filename")
+SIDECAR_NAMES = ("metadata.csv", "metadata.json")
+
+CRASHED = "the conversion process crashed, possibly out of memory."
+
+STAGES = ("ir", "convert", "references", "rewrite", "figures", "render", "preview", "package")
+
+
+@dataclass
+class PaperResult:
+    paper_num: str
+    output: Optional[Path] = None
+    error: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    warnings: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+def discover_manuscripts(input_dir) -> List[Path]:
+    """every .docx directly inside input_dir, skipping word's ~$ lock files."""
+    return sorted(
+        path
+        for path in Path(input_dir).iterdir()
+        if path.suffix.lower() == ".docx" and not path.name.startswith("~$")
+    )
+
+
+def _paper_name(row: dict) -> str:
+    for key in PAPER_FIELDS:
+        value = (row.get(key) or "").strip()
+        if value:
+            return Path(value).stem
+    raise ValueError(f"metadata row has none of the columns {', '.join(PAPER_FIELDS)}: {row}")
+
+
+def _metadata_row(row: dict) -> Dict[str, str]:
+    return {name: str(row.get(name) or "").strip() for name in METADATA_FIELDS}
+
+
+def load_metadata(path) -> Dict[str, Dict[str, str]]:
+    """
+    per-paper metadata from a csv with a header row, a json list of objects,
+    or a json object keyed by paper; keyed by docx stem.
+    """
+    path = Path(path)
+    if path.suffix.lower() == ".csv":
+        with open(path, newline="", encoding="utf-8-sig") as fh:
+            rows = list(csv.DictReader(fh))
+        return {_paper_name(row): _metadata_row(row) for row in rows}
+
+    if path.suffix.lower() == ".json":
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if isinstance(data, dict):
+            return {Path(paper).stem: _metadata_row(row) for paper, row in data.items()}
+        if isinstance(data, list):
+            return {_paper_name(row): _metadata_row(row) for row in data}
+        raise ValueError(f"{path}: expected a json object or list.")
+
+    raise ValueError(f"{path}: metadata must be a .csv or .json file.")
+
+
+def find_sidecar(input_dir) -> Optional[Path]:
+    for name in SIDECAR_NAMES:
+        path = Path(input_dir) / name
+        if path.exists():
+            return path
+    return None
+
+
+def convert_paper(
+    docx_path,
+    metadata,
+    *,
+    output_root,
+    work_root,
+    template_dir,
+    as_zip=True,
+    anystyle_cmd="anystyle",
+    cache_dir=None,
+    use_cache=True,
+    ir_backend="pandoc",
+    figure_dpi=None,
+    memory_budget_mb=None,
+    preview=False,
+) -> PaperResult:
+    """
+    convert one manuscript in a work dir of its own below work_root and write
+    <paper>.zip (or a <paper>/ folder) to output_root. errors are returned, not raised.
+    """
+    docx_path = Path(docx_path)
+    paper_num = docx_path.stem
+    work_dir = Path(work_root) / paper_num
+    result = PaperResult(paper_num=paper_num)
+    try:
+        work_dir.mkdir(parents=True)
+        pipeline_result = run_pipeline(
+            docx_path,
+            metadata,
+            work_dir=work_dir,
+            anystyle_cmd=anystyle_cmd,
+            cache=PipelineCache(cache_dir) if use_cache else None,
+            ir_backend=ir_backend,
+            figure_dpi=figure_dpi,
+            memory_budget_mb=memory_budget_mb,
+            preview_template_dir=template_dir if preview else None,
+        )
+        result.timings.update(pipeline_result.timings)
+        result.warnings = pipeline_result.warnings
+
+        output_root = Path(output_root)
+        with stage("package", result.timings):
+            if as_zip:
+                result.output = write_output_zip(
+                    pipeline_result, template_dir, output_root / f"{paper_num}.zip"
+                )
+            else:
+                create_output_directory(
+                    None,
+                    pipeline_result.final_tex,
+                    pipeline_result.bibtex,
+                    output_root=output_root,
+                    template_dir=template_dir,
+                    figures_dir=pipeline_result.figures_dir,
+                    paper_num=paper_num,
+                    asset_store=AssetStore(output_root),
+                )
+                if pipeline_result.preview is not None:
+                    pipeline_result.preview.write_to(output_root / paper_num)
+                result.output = output_root / paper_num
+    except Exception as exc:
+        result.error = f"{exc.__class__.__name__}: {exc}"
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return result
+
+
+def _convert_manuscript(docx_path, *, metadata, **options) -> PaperResult:
+    return convert_paper(docx_path, metadata.get(docx_path.stem, _metadata_row({})), **options)
+
+
+def _convert_until_broken(papers, convert, *, workers: int, report) -> Tuple[List[Path], List[Path]]:
+    """
+    convert papers with at most workers in flight, reporting each PaperResult.
+    a worker process that dies breaks the pool; then the rest in flight settle and
+    this returns (papers lost with the pool, papers never started).
+    """
+    waiting = list(papers)
+    broken = []
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        running = {}
+        while waiting or running:
+            while waiting and len(running) < workers and not broken:
+                docx_path = waiting.pop(0)
+                try:
+                    running[executor.submit(convert, docx_path)] = docx_path
+                except BrokenProcessPool:
+                    waiting.insert(0, docx_path)
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                docx_path = running.pop(future)
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(docx_path)
+                    continue
+                except Exception as exc:
+                    result = PaperResult(
+                        paper_num=docx_path.stem,
+                        error=f"{exc.__class__.__name__}: {exc}",
+                    )
+                report(result)
+    return broken, waiting
+
+
+def _convert_isolating_crashes(papers, convert, *, jobs: int, report) -> None:
+    """
+    convert(docx_path) -> PaperResult for every paper across a pool of jobs processes.
+    a paper that kills its worker, e.g. out of memory, fails on its own: the papers in
+    flight with it are retried one at a time and the rest go on in a fresh pool.
+    """
+    waiting = list(papers)
+    while waiting:
+        broken, waiting = _convert_until_broken(waiting, convert, workers=max(1, jobs), report=report)
+        for docx_path in broken:
+            if len(broken) > 1:
+                # any of them may have taken the pool down; alone, only the culprit breaks it again.
+                if not _convert_until_broken([docx_path], convert, workers=1, report=report)[0]:
+                    continue
+            report(PaperResult(paper_num=docx_path.stem, error=CRASHED))
+
+
+def run_batch(
+    input_dir,
+    output_root,
+    *,
+    metadata: Dict[str, Dict[str, str]],
+    jobs: int = 1,
+    template_dir=TEMPLATE_DIR,
+    as_zip: bool = True,
+    anystyle_cmd: str = "anystyle",
+    cache_dir=None,
+    use_cache: bool = True,
+    ir_backend: str = "pandoc",
+    figure_dpi: Optional[int] = None,
+    memory_budget_mb: Optional[int] = None,
+    preview: bool = False,
+    on_result=None,
+) -> List[PaperResult]:
+    """
+    convert every manuscript in input_dir across a pool of jobs processes.
+    a failed paper is reported in its PaperResult and the rest carry on.
+    on_result, if given, is called with each PaperResult as it finishes.
+    """
+    manuscripts = discover_manuscripts(input_dir)
+    output_root = Path(output_root)
+    output_root.mkdir(parents=True, exist_ok=True)
+    template_dir = Path(template_dir)
+    if not template_dir.exists():
+        raise RuntimeError(f"template_dir not found at {template_dir}.")
+
+    convert = functools.partial(
+        _convert_manuscript,
+        metadata=metadata,
+        output_root=output_root,
+        template_dir=template_dir,
+        as_zip=as_zip,
+        anystyle_cmd=anystyle_cmd,
+        cache_dir=cache_dir,
+        use_cache=use_cache,
+        ir_backend=ir_backend,
+        figure_dpi=figure_dpi,
+        memory_budget_mb=memory_budget_mb,
+        preview=preview,
+    )
+    results = []
+
+    def report(result: PaperResult):
+        results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    with tempfile.TemporaryDirectory(prefix="msurj-batch-") as work_root:
+        _convert_isolating_crashes(
+            manuscripts, functools.partial(convert, work_root=work_root), jobs=jobs, report=report
+        )
+
+    return sorted(results, key=lambda r: r.paper_num)
+
+
+def format_summary(results: List[PaperResult], *, wall_seconds: float) -> str:
+    lines = []
+    done = [r for r in results if r.ok]
+    lines.append(
+        f"{len(done)}/{len(results)} manuscripts converted in {wall_seconds:.1f}s"
+    )
+
+    if done:
+        lines.append(f"{'stage':<10}{'total':>10}{'mean':>10}{'max':>10}")
+        for stage_name in STAGES:
+            values = [r.timings[stage_name] for r in done if stage_name in r.timings]
+            if not values:
+                continue
+            lines.append(
+                f"{stage_name:<10}{sum(values):>9.2f}s{sum(values) / len(values):>9.2f}s"
+                f"{max(values):>9.2f}s"
+            )
+
+    failed = [r for r in results if not r.ok]
+    if failed:
+        lines.append("failed:")
+        lines.extend(f"  {r.paper_num}: {r.error}" for r in failed)
+    return "\n".join(lines)
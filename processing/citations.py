@@ -1,19 +1,33 @@
 from __future__ import annotations
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
+import os
 from pathlib import Path
 import re
 import subprocess
 import tempfile
-from typing import Dict, Iterable, List, Tuple
+from typing import Dict, Iterable, List, Optional, Tuple
 
+from processing.anystyle_pool import AnyStylePool, AnyStyleWorkerError
+from processing.cache import sha256_hex
+from processing.latex_scan import Heading, find_heading, scan_headings
+from processing.latex_text import escape_latex_text
+from processing.reference_cache import ReferenceCache
 
-REFERENCE_SECTION_RE = re.compile(
-    r"\\section\{References\}.*?(?:\n|$)", re.IGNORECASE
-)
 
 ITEM_MARKER = "@@ITEM@@"
 
+BIBTEX_ENTRY_HEADER_RE = re.compile(r"@([a-zA-Z]+)\s*\{\s*([^,]+),")
+
+# references per anystyle call; longer lists are split and the shards parsed
+# on as many pool workers (or cli processes) as there are.
+ANYSTYLE_SHARD_SIZE = 50
+
+
+class AnyStyleNoOutputError(RuntimeError):
+    """anystyle ran but returned no bibtex, e.g. for a reference it cannot parse."""
+
 
 @dataclass
 class CitationResult:
@@ -22,13 +36,26 @@ class CitationResult:
     key_map: Dict[int, str]
 
 
-def extract_references_section(tex: str) -> Tuple[str, str]:
-    match = REFERENCE_SECTION_RE.search(tex)
-    if not match:
+def locate_references_section(
+    tex: str, *, headings: Optional[List[Heading]] = None, start: int = 0
+) -> Tuple[int, int]:
+    """
+    start and end offsets of the \\section{References} heading line at or after start.
+    headings: scan_headings(tex), when the caller has it already.
+    """
+    if headings is None:
+        headings = scan_headings(tex)
+    heading = find_heading(headings, "References", start=start)
+    if heading is None:
         raise ValueError("No References section found (expected \\section{References}).")
+    return heading.start, heading.line_end
+
 
-    before = tex[:match.start()].rstrip()
-    after = tex[match.end():].strip()
+def extract_references_section(tex: str) -> Tuple[str, str]:
+    start, end = locate_references_section(tex)
+
+    before = tex[:start].rstrip()
+    after = tex[end:].strip()
 
     if not after:
         raise ValueError("References section found but it is empty.")
@@ -89,7 +116,21 @@ def build_bibtex_with_anystyle(
     *,
     anystyle_cmd: str = "anystyle",
     output_format: str = "bib",
+    pool: Optional[AnyStylePool] = None,
 ) -> str:
+    references = list(references)
+
+    if pool is not None and output_format == "bib" and pool.available:
+        try:
+            bibtex = pool.parse(references).strip()
+        except AnyStyleWorkerError:
+            pass  # the daemon is unhealthy: fall through to the one-shot cli.
+        else:
+            # the warm parser answered; the cli would give the same nothing.
+            if not bibtex:
+                raise AnyStyleNoOutputError("AnyStyle produced no BibTeX output.")
+            return bibtex
+
     refs_text = "\n".join(references).strip() + "\n"
 
     with tempfile.NamedTemporaryFile(mode="w", suffix=".txt", delete=True) as tmp:
@@ -114,60 +155,247 @@ def build_bibtex_with_anystyle(
 
     bibtex = result.stdout.strip()
     if not bibtex:
-        raise RuntimeError("AnyStyle produced no BibTeX output.")
+        raise AnyStyleNoOutputError("AnyStyle produced no BibTeX output.")
 
     return bibtex
 
 
-def rewrite_bibtex_keys(bibtex: str, key_map: Dict[int, str]) -> str:
-    entry_header = re.compile(r"@([a-zA-Z]+)\s*\{\s*([^,]+),")
-    idx = 1
+def split_bibtex_entries(bibtex: str) -> List[str]:
+    headers = list(BIBTEX_ENTRY_HEADER_RE.finditer(bibtex))
+    entries = []
+    for i, match in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(bibtex)
+        entries.append(bibtex[match.start():end].strip())
+    return entries
 
-    def repl(match: re.Match) -> str:
-        nonlocal idx
-        if idx not in key_map:
-            return match.group(0)
-        new_key = key_map[idx]
-        idx += 1
-        return f"@{match.group(1)}{{{new_key},"
 
-    updated = entry_header.sub(repl, bibtex)
+def rewrite_bibtex_key(entry: str, key: str) -> str:
+    return BIBTEX_ENTRY_HEADER_RE.sub(
+        lambda m: f"@{m.group(1)}{{{key},", entry, count=1
+    )
 
-    if idx - 1 != len(key_map):
+
+def rewrite_bibtex_keys(bibtex: str | List[str], key_map: Dict[int, str]) -> str:
+    entries = split_bibtex_entries(bibtex) if isinstance(bibtex, str) else list(bibtex)
+
+    if len(entries) != len(key_map):
         raise RuntimeError(
             "BibTeX entry count does not match reference count. "
             "Check the references section or AnyStyle output."
         )
 
-    return updated
+    return "\n\n".join(
+        rewrite_bibtex_key(entry, key_map[n])
+        for entry, n in zip(entries, sorted(key_map))
+    )
+
 
+def _fallback_entry(reference: str) -> str:
+    """a @misc entry keeping the reference text, for one anystyle cannot parse on its own."""
+    # the text is plain (see latex_to_text): & % _ and friends must be escaped
+    # again, and stray braces would unbalance the entry.
+    note = escape_latex_text(reference.replace("{", "").replace("}", ""))
+    return f"@misc{{ref,\n  note = {{{note}}}\n}}"
 
-def parse_citation_numbers(text: str) -> List[int]:
-    normalized = text.replace("–", "-").replace("—", "-")
-    tokens = re.findall(r"\d+(?:\s*-\s*\d+)?", normalized)
 
-    nums: List[int] = []
-    for token in tokens:
-        if "-" in token:
-            start_s, end_s = [t.strip() for t in token.split("-", 1)]
-            if not start_s.isdigit() or not end_s.isdigit():
-                continue
-            start, end = int(start_s), int(end_s)
-            if end < start:
-                start, end = end, start
-            nums.extend(range(start, end + 1))
+def _parse_shard(
+    references: List[str],
+    *,
+    anystyle_cmd: str,
+    anystyle_pool: Optional[AnyStylePool],
+) -> List[Optional[str]]:
+    try:
+        entries = split_bibtex_entries(
+            build_bibtex_with_anystyle(references, anystyle_cmd=anystyle_cmd, pool=anystyle_pool)
+        )
+    except AnyStyleNoOutputError:
+        # nothing for a single reference is a misparse like any other; a
+        # missing or failing anystyle is not, and fails the conversion.
+        if len(references) > 1:
+            raise
+        entries = []
+    if len(entries) == len(references):
+        return entries
+    if len(references) == 1:
+        return [None]
+
+    # anystyle merged or split a reference somewhere in this shard. halving it
+    # narrows that down to single references without re-parsing the rest one
+    # at a time, and keeps the rest of the list aligned.
+    middle = len(references) // 2
+    return [
+        *_parse_shard(references[:middle], anystyle_cmd=anystyle_cmd, anystyle_pool=anystyle_pool),
+        *_parse_shard(references[middle:], anystyle_cmd=anystyle_cmd, anystyle_pool=anystyle_pool),
+    ]
+
+
+def parse_references(
+    references: List[str],
+    *,
+    anystyle_cmd: str = "anystyle",
+    anystyle_pool: Optional[AnyStylePool] = None,
+    shard_size: int = ANYSTYLE_SHARD_SIZE,
+    max_workers: Optional[int] = None,
+) -> List[Optional[str]]:
+    """
+    one BibTeX entry per reference, in order; None where anystyle could not
+    parse that reference on its own. lists longer than shard_size are split
+    and the shards parsed concurrently: on every worker of anystyle_pool (one
+    at a time with a single worker), or one cli process per cpu without it.
+    """
+    shards = [references[i : i + shard_size] for i in range(0, len(references), shard_size)]
+    if len(shards) <= 1:
+        return _parse_shard(references, anystyle_cmd=anystyle_cmd, anystyle_pool=anystyle_pool)
+
+    if max_workers is None:
+        if anystyle_pool is not None and anystyle_pool.available:
+            max_workers = anystyle_pool.size
         else:
-            nums.append(int(token))
+            max_workers = os.cpu_count() or 1
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as executor:
+        parsed = executor.map(
+            lambda shard: _parse_shard(shard, anystyle_cmd=anystyle_cmd, anystyle_pool=anystyle_pool),
+            shards,
+        )
+        return [entry for shard in parsed for entry in shard]
+
+
+def resolve_reference_entries(
+    refs_plain: List[str],
+    *,
+    anystyle_cmd: str = "anystyle",
+    anystyle_pool: Optional[AnyStylePool] = None,
+    reference_cache: Optional[ReferenceCache] = None,
+) -> List[str]:
+    """
+    one BibTeX entry per reference; only cache misses are sent to AnyStyle.
+    a reference AnyStyle cannot parse becomes a @misc entry holding its text.
+    """
+    if reference_cache is None:
+        cached: List[Optional[str]] = [None] * len(refs_plain)
+    else:
+        cached = reference_cache.get_many(refs_plain)
+
+    missing = [i for i, entry in enumerate(cached) if entry is None]
+    if missing:
+        missing_refs = [refs_plain[i] for i in missing]
+        parsed = parse_references(
+            missing_refs, anystyle_cmd=anystyle_cmd, anystyle_pool=anystyle_pool
+        )
+        if reference_cache is not None:
+            # fallbacks are not cached, so a later anystyle gets another try.
+            reference_cache.put_many(
+                [ref for ref, entry in zip(missing_refs, parsed) if entry is not None],
+                [entry for entry in parsed if entry is not None],
+            )
+        for i, ref, entry in zip(missing, missing_refs, parsed):
+            cached[i] = entry if entry is not None else _fallback_entry(ref)
+
+    return cached
 
-    seen = set()
-    ordered = []
-    for n in nums:
-        if n in seen:
-            continue
-        seen.add(n)
-        ordered.append(n)
 
-    return ordered
+SUPERSCRIPT_RE = re.compile(r"\\textsuperscript\{([^}]*)\}")
+
+# a superscript is a citation only when it is nothing but numbers and ranges,
+# so exponents like -1 or 2+ stay as they are (a bare m\textsuperscript{2}
+# still reads as citation 2).
+_CITATION_ITEM = r"(\d+)(?:\s*(?:-{1,3}|–|—|\\textendash\s*)\s*(\d+))?"
+_CITATION_ITEM_RE = re.compile(_CITATION_ITEM)
+MAX_CITATION_RANGE = 500
+CITATION_RE = re.compile(
+    rf"\s*((?:{_CITATION_ITEM})(?:\s*[,;]\s*(?:{_CITATION_ITEM}))*)\s*[,;]?\s*"
+)
+
+
+def _format_numbers(numbers: List[int]) -> str:
+    """sorted numbers with runs collapsed, e.g. 1, 3-5."""
+    runs: List[List[int]] = []
+    for n in numbers:
+        if runs and n == runs[-1][1] + 1:
+            runs[-1][1] = n
+        else:
+            runs.append([n, n])
+    return ", ".join(str(a) if a == b else f"{a}-{b}" for a, b in runs)
+
+
+@dataclass
+class CitationDiagnostics:
+    """citation numbers with no reference, and references never cited."""
+
+    unmatched: List[int]
+    unused: List[int]
+
+    @property
+    def ok(self) -> bool:
+        return not self.unmatched and not self.unused
+
+    def messages(self) -> List[str]:
+        messages = []
+        if self.unmatched:
+            messages.append(f"citations with no matching reference: {_format_numbers(self.unmatched)}.")
+        if self.unused:
+            messages.append(f"references never cited: {_format_numbers(self.unused)}.")
+        return messages
+
+
+class CitationIndex:
+    """
+    reference number -> bibtex key for one document. each distinct superscript
+    is parsed once, so the abstract, body, captions and table cells share the
+    work. unmatched numbers are left out of the \\cite and reported by
+    diagnose() instead of failing the conversion.
+    """
+
+    def __init__(self, key_map: Dict[int, str]):
+        self.key_map = dict(key_map)
+        self._numbers: Dict[str, Tuple[int, ...]] = {}
+
+    def numbers(self, content: str) -> Tuple[int, ...]:
+        """the citation numbers in a superscript, ranges expanded; () when it is not a citation."""
+        numbers = self._numbers.get(content)
+        if numbers is None:
+            numbers = ()
+            match = CITATION_RE.fullmatch(content)
+            if match is not None:
+                seen: Dict[int, None] = {}
+                for item in _CITATION_ITEM_RE.finditer(match.group(1)):
+                    start = int(item.group(1))
+                    end = int(item.group(2)) if item.group(2) else start
+                    if end < start:
+                        start, end = end, start
+                    if end - start > MAX_CITATION_RANGE:
+                        seen = {}  # a span of years or a page range, not references
+                        break
+                    seen.update(dict.fromkeys(range(start, end + 1)))
+                numbers = tuple(seen)
+            self._numbers[content] = numbers
+        return numbers
+
+    def cite(self, content: str, *, wrap_in_superscript: bool = True) -> Optional[str]:
+        """the \\cite replacing \\textsuperscript{content}; None leaves the superscript alone."""
+        keys = [self.key_map[n] for n in self.numbers(content) if n in self.key_map]
+        if not keys:
+            return None
+        cite = "\\cite{" + ",".join(keys) + "}"
+        return f"\\textsuperscript{{{cite}}}" if wrap_in_superscript else cite
+
+    def diagnose(self, *texts: str) -> CitationDiagnostics:
+        return self.diagnose_superscripts(
+            match.group(1) for text in texts for match in SUPERSCRIPT_RE.finditer(text)
+        )
+
+    def diagnose_superscripts(self, contents: Iterable[str]) -> CitationDiagnostics:
+        """diagnose() for superscripts already found, e.g. in pandoc's json ast."""
+        cited = set()
+        for content in contents:
+            cited.update(self.numbers(content))
+        return CitationDiagnostics(
+            unmatched=sorted(n for n in cited if n not in self.key_map),
+            unused=sorted(n for n in self.key_map if n not in cited),
+        )
+
+    def fingerprint(self) -> str:
+        return sha256_hex(repr(sorted(self.key_map.items())))
 
 
 def replace_superscript_citations(
@@ -177,52 +405,81 @@ def replace_superscript_citations(
     wrap_in_superscript: bool = True,
     strict: bool = True,
 ) -> str:
-    pattern = re.compile(r"\\textsuperscript\{([^}]*)\}")
-
-    def repl(match: re.Match) -> str:
-        numbers = parse_citation_numbers(match.group(1))
-        if not numbers:
-            return match.group(0)
-
-        keys: List[str] = []
-        missing: List[int] = []
-        for n in numbers:
-            key = key_map.get(n)
-            if not key:
-                missing.append(n)
-            else:
-                keys.append(key)
-
-        if missing and strict:
+    index = CitationIndex(key_map)
+    if strict:
+        missing = index.diagnose(text).unmatched
+        if missing:
             raise ValueError(
                 f"Missing BibTeX keys for citations: {', '.join(map(str, missing))}"
             )
 
-        cite = "\\cite{" + ",".join(keys) + "}"
-        return f"\\textsuperscript{{{cite}}}" if wrap_in_superscript else cite
+    def repl(match: re.Match) -> str:
+        cite = index.cite(match.group(1), wrap_in_superscript=wrap_in_superscript)
+        return match.group(0) if cite is None else cite
 
-    return pattern.sub(repl, text)
+    return SUPERSCRIPT_RE.sub(repl, text)
 
 
-def apply_citation_pipeline(
-    body_text: str,
+def parse_reference_section(
+    ref_section: str,
     *,
     anystyle_cmd: str = "anystyle",
+    anystyle_pool: Optional[AnyStylePool] = None,
+    reference_cache: Optional[ReferenceCache] = None,
     bib_key_prefix: str = "ref",
-    wrap_in_superscript: bool = True,
-) -> CitationResult:
-    cleaned_body, ref_section = extract_references_section(body_text)
+) -> Tuple[str, Dict[int, str]]:
+    """bibtex for the numbered reference list and the number -> key map used by \\cite."""
     raw_items = split_reference_items(ref_section)
 
     if not raw_items:
         raise ValueError("No reference items found in References section.")
 
-    refs_plain = [latex_to_text(item) for item in raw_items]
+    return parse_reference_texts(
+        [latex_to_text(item) for item in raw_items],
+        anystyle_cmd=anystyle_cmd,
+        anystyle_pool=anystyle_pool,
+        reference_cache=reference_cache,
+        bib_key_prefix=bib_key_prefix,
+    )
+
+
+def parse_reference_texts(
+    refs_plain: List[str],
+    *,
+    anystyle_cmd: str = "anystyle",
+    anystyle_pool: Optional[AnyStylePool] = None,
+    reference_cache: Optional[ReferenceCache] = None,
+    bib_key_prefix: str = "ref",
+) -> Tuple[str, Dict[int, str]]:
+    """parse_reference_section for references that are plain text already, one per item."""
+    entries = resolve_reference_entries(
+        refs_plain,
+        anystyle_cmd=anystyle_cmd,
+        anystyle_pool=anystyle_pool,
+        reference_cache=reference_cache,
+    )
+
+    key_map = {i + 1: f"{bib_key_prefix}{i + 1}" for i in range(len(refs_plain))}
+    return rewrite_bibtex_keys(entries, key_map), key_map
 
-    bibtex_raw = build_bibtex_with_anystyle(refs_plain, anystyle_cmd=anystyle_cmd)
 
-    key_map = {i + 1: f"{bib_key_prefix}{i + 1}" for i in range(len(raw_items))}
-    bibtex = rewrite_bibtex_keys(bibtex_raw, key_map)
+def apply_citation_pipeline(
+    body_text: str,
+    *,
+    anystyle_cmd: str = "anystyle",
+    anystyle_pool: Optional[AnyStylePool] = None,
+    reference_cache: Optional[ReferenceCache] = None,
+    bib_key_prefix: str = "ref",
+    wrap_in_superscript: bool = True,
+) -> CitationResult:
+    cleaned_body, ref_section = extract_references_section(body_text)
+    bibtex, key_map = parse_reference_section(
+        ref_section,
+        anystyle_cmd=anystyle_cmd,
+        anystyle_pool=anystyle_pool,
+        reference_cache=reference_cache,
+        bib_key_prefix=bib_key_prefix,
+    )
 
     body_with_cites = replace_superscript_citations(
         cleaned_body,
@@ -0,0 +1,888 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from pathlib import Path
+import re
+import shutil
+from typing import Dict, Iterator, List, Optional, Tuple
+import unicodedata
+import xml.etree.ElementTree as ET
+import zipfile
+
+from processing.latex_text import escape_latex_text
+
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+A_NS = "http://schemas.openxmlformats.org/drawingml/2006/main"
+M_NS = "http://schemas.openxmlformats.org/officeDocument/2006/math"
+MC_NS = "http://schemas.openxmlformats.org/markup-compatibility/2006"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+EMU_PER_INCH = 914400
+# letter paper with 1in margins, what pandoc assumes when the docx gives no page size.
+DEFAULT_PAGE_WIDTH_TWIPS = 12240
+DEFAULT_MARGIN_TWIPS = 1440
+HEADING_COMMANDS = ["section", "subsection", "subsubsection", "paragraph", "subparagraph"]
+ALIGN_COMMANDS = {"center": r"\centering", "right": r"\raggedleft", "end": r"\raggedleft"}
+CAPTION_STYLES = {"caption", "image caption", "table caption"}
+# paragraph styles pandoc turns into document metadata rather than body text.
+METADATA_STYLES = {"title", "subtitle", "author", "date", "abstract"}
+ENUM_COUNTERS = ["enumi", "enumii", "enumiii", "enumiv"]
+NUMBER_STYLES = {
+    "decimal": "arabic",
+    "lowerLetter": "alph",
+    "upperLetter": "Alph",
+    "lowerRoman": "roman",
+    "upperRoman": "Roman",
+}
+
+IR_PREAMBLE = r"""\documentclass{article}
+\usepackage{graphicx}
+\usepackage{longtable,booktabs,array}
+\usepackage{soul}
+\usepackage{hyperref}
+\setcounter{secnumdepth}{-\maxdimen} % remove section numbering
+\providecommand{\tightlist}{%
+  \setlength{\itemsep}{0pt}\setlength{\parskip}{0pt}}
+"""
+
+_IGNORED_PARAGRAPH_TAGS = {
+    "pPr", "bookmarkStart", "bookmarkEnd", "proofErr", "commentRangeStart",
+    "commentRangeEnd", "permStart", "permEnd", "del", "moveFrom",
+    "moveFromRangeStart", "moveFromRangeEnd", "moveToRangeStart", "moveToRangeEnd",
+}
+_TRANSPARENT_TAGS = {"ins", "moveTo", "smartTag", "customXml", "fldSimple", "sdtContent"}
+_IGNORED_RUN_TAGS = {
+    "rPr", "fldChar", "instrText", "delText", "delInstrText", "lastRenderedPageBreak",
+    "commentReference", "annotationRef", "softHyphen", "separator", "continuationSeparator",
+}
+_UNSUPPORTED_TAGS = {
+    (M_NS, "oMath"): "equations",
+    (M_NS, "oMathPara"): "equations",
+    (MC_NS, "AlternateContent"): "shapes or text boxes",
+    (W_NS, "footnoteReference"): "footnotes",
+    (W_NS, "endnoteReference"): "endnotes",
+    (W_NS, "pict"): "legacy drawings",
+    (W_NS, "object"): "embedded objects",
+    (W_NS, "sym"): "symbol-font characters",
+    (W_NS, "altChunk"): "embedded documents",
+    (W_NS, "subDoc"): "sub-documents",
+    (W_NS, "txbxContent"): "text boxes",
+}
+
+_FORMAT_COMMANDS = {
+    "italic": "emph",
+    "bold": "textbf",
+    "smallcaps": "textsc",
+    "strike": "st",
+    "superscript": "textsuperscript",
+    "subscript": "textsubscript",
+    "underline": "ul",
+}
+# outermost first within a run: bold italic is \emph{\textbf{..}}, as pandoc writes it.
+FORMAT_ORDER = list(_FORMAT_COMMANDS)
+
+
+class UnsupportedDocxError(ValueError):
+    """the docx uses a feature the native reader does not handle; run pandoc instead."""
+
+
+def _w(tag: str) -> str:
+    return f"{{{W_NS}}}{tag}"
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _attr(el: Optional[ET.Element], name: str, ns: str = W_NS) -> Optional[str]:
+    if el is None:
+        return None
+    return el.get(f"{{{ns}}}{name}")
+
+
+def _is_on(el: Optional[ET.Element]) -> bool:
+    if el is None:
+        return False
+    return _attr(el, "val") not in {"0", "false", "off", "none"}
+
+
+def heading_identifier(text: str) -> str:
+    """pandoc's auto_identifiers slug for a heading's plain text."""
+    text = unicodedata.normalize("NFC", text).lower()
+    text = "".join(ch for ch in text if ch.isalnum() or ch in "_-. " or ch.isspace())
+    text = re.sub(r"\s+", "-", text.strip())
+    while text and not text[0].isalpha():
+        text = text[1:]
+    return text or "section"
+
+
+@dataclass
+class _Inline:
+    kind: str  # "text", "break" or "raw"
+    value: str = ""
+    formats: Tuple[str, ...] = ()
+
+
+@dataclass
+class _Paragraph:
+    style: str
+    inlines: List[_Inline]
+    heading_level: int = 0
+    num_id: Optional[str] = None
+    ilvl: int = 0
+    align: Optional[str] = None
+    image: Optional[str] = None
+
+    @property
+    def is_caption(self) -> bool:
+        return self.style in CAPTION_STYLES
+
+    @property
+    def is_empty(self) -> bool:
+        return not any(i.kind != "text" or i.value.strip() for i in self.inlines)
+
+
+@dataclass
+class _Table:
+    widths: List[int]
+    header_rows: List[List[str]]
+    rows: List[List[str]]
+    aligns: List[Optional[str]]
+    caption: Optional[str]
+
+
+@dataclass
+class _ListItem:
+    content: str
+    compact: bool
+    children: List["_List"] = field(default_factory=list)
+
+
+@dataclass
+class _List:
+    num_id: str
+    ilvl: int
+    items: List[_ListItem] = field(default_factory=list)
+
+
+@dataclass
+class _NumberingLevel:
+    fmt: str
+    text: str
+    start: int
+
+
+class DocxReader:
+    """
+    converts the subset of word that msurj manuscripts use (headings, paragraphs,
+    run formatting, images, captions, simple tables and numbered lists) into the
+    same latex that `pandoc --from=docx --to=latex --wrap=none` would write.
+    anything outside that subset raises UnsupportedDocxError.
+    """
+
+    def __init__(self, docx_path, *, media_prefix: str = "media"):
+        self.docx_path = Path(docx_path)
+        self.media_prefix = media_prefix
+        self.media: Dict[str, str] = {}  # basename -> zip member, in order of first use
+        self._zip = zipfile.ZipFile(self.docx_path)
+        self._rels = self._read_rels()
+        self._read_styles()
+        self._numbering = self._read_numbering()
+        self._identifiers: Dict[str, int] = {}
+        self._list_counts: Dict[Tuple[str, int], int] = {}
+        self.text_width = DEFAULT_PAGE_WIDTH_TWIPS - 2 * DEFAULT_MARGIN_TWIPS
+
+    def close(self) -> None:
+        self._zip.close()
+
+    def __enter__(self) -> "DocxReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def has_member(self, name: str) -> bool:
+        try:
+            self._zip.getinfo(name)
+        except KeyError:
+            return False
+        return True
+
+    def open_document(self):
+        """word/document.xml as a binary stream, for iterparse."""
+        return self._zip.open("word/document.xml")
+
+    def _read_xml(self, name: str) -> Optional[ET.Element]:
+        try:
+            data = self._zip.read(name)
+        except KeyError:
+            return None
+        return ET.fromstring(data)
+
+    def _read_rels(self) -> Dict[str, Tuple[str, bool]]:
+        root = self._read_xml("word/_rels/document.xml.rels")
+        rels = {}
+        if root is None:
+            return rels
+        for rel in root.iter(f"{{{PKG_REL_NS}}}Relationship"):
+            external = rel.get("TargetMode") == "External"
+            rels[rel.get("Id")] = (rel.get("Target", ""), external)
+        return rels
+
+    def _read_styles(self) -> None:
+        """style names, the run formatting of character styles and the numbering of list styles."""
+        self._styles: Dict[str, str] = {}
+        self._char_formats: Dict[str, Tuple[str, ...]] = {}
+        self._style_numbering: Dict[str, Tuple[str, int]] = {}
+        root = self._read_xml("word/styles.xml")
+        if root is None:
+            return
+        based_on: Dict[str, str] = {}
+        own_formats: Dict[str, Tuple[str, ...]] = {}
+        own_numbering: Dict[str, Tuple[str, int]] = {}
+        for style in root.iter(_w("style")):
+            style_id = _attr(style, "styleId")
+            self._styles[style_id] = (_attr(style.find(_w("name")), "val") or style_id).lower()
+            parent = _attr(style.find(_w("basedOn")), "val")
+            if parent:
+                based_on[style_id] = parent
+            if _attr(style, "type") == "character":
+                own_formats[style_id] = self._formats(style.find(_w("rPr")))
+            num_pr = style.find(f"{_w('pPr')}/{_w('numPr')}")
+            if num_pr is not None:
+                num_id = _attr(num_pr.find(_w("numId")), "val")
+                own_numbering[style_id] = (num_id, int(_attr(num_pr.find(_w("ilvl")), "val") or 0))
+
+        def ancestry(style_id: str) -> Iterator[str]:
+            seen = set()
+            while style_id is not None and style_id not in seen:
+                seen.add(style_id)
+                yield style_id
+                style_id = based_on.get(style_id)
+
+        for style_id in own_formats:
+            formats = set()
+            for ancestor in ancestry(style_id):
+                formats.update(own_formats.get(ancestor, ()))
+            self._char_formats[style_id] = tuple(f for f in FORMAT_ORDER if f in formats)
+        for style_id in self._styles:
+            for ancestor in ancestry(style_id):
+                if ancestor in own_numbering:
+                    self._style_numbering[style_id] = own_numbering[ancestor]
+                    break
+
+    def _read_numbering(self) -> Dict[str, Dict[int, _NumberingLevel]]:
+        root = self._read_xml("word/numbering.xml")
+        if root is None:
+            return {}
+        abstract = {}
+        for absnum in root.iter(_w("abstractNum")):
+            levels = {}
+            for lvl in absnum.iter(_w("lvl")):
+                start = _attr(lvl.find(_w("start")), "val")
+                levels[int(_attr(lvl, "ilvl") or 0)] = _NumberingLevel(
+                    fmt=_attr(lvl.find(_w("numFmt")), "val") or "decimal",
+                    text=_attr(lvl.find(_w("lvlText")), "val") or "%1.",
+                    start=int(start) if start else 1,
+                )
+            abstract[_attr(absnum, "abstractNumId")] = levels
+        numbering = {}
+        for num in root.iter(_w("num")):
+            levels = dict(abstract.get(_attr(num.find(_w("abstractNumId")), "val"), {}))
+            for override in num.iter(_w("lvlOverride")):
+                ilvl = int(_attr(override, "ilvl") or 0)
+                start = _attr(override.find(_w("startOverride")), "val")
+                if start and ilvl in levels:
+                    levels[ilvl] = replace(levels[ilvl], start=int(start))
+            numbering[_attr(num, "numId")] = levels
+        return numbering
+
+    @staticmethod
+    def _formats(rpr: Optional[ET.Element]) -> Tuple[str, ...]:
+        if rpr is None:
+            return ()
+        formats = set()
+        if _is_on(rpr.find(_w("b"))):
+            formats.add("bold")
+        if _is_on(rpr.find(_w("i"))):
+            formats.add("italic")
+        if _is_on(rpr.find(_w("smallCaps"))):
+            formats.add("smallcaps")
+        if _is_on(rpr.find(_w("strike"))) or _is_on(rpr.find(_w("dstrike"))):
+            formats.add("strike")
+        if _attr(rpr.find(_w("u")), "val") == "single":
+            formats.add("underline")
+        valign = _attr(rpr.find(_w("vertAlign")), "val")
+        if valign == "superscript":
+            formats.add("superscript")
+        elif valign == "subscript":
+            formats.add("subscript")
+        return tuple(f for f in FORMAT_ORDER if f in formats)
+
+    def run_formats(self, run: ET.Element) -> Tuple[str, ...]:
+        """formats of a w:r from its own properties and its character style, in FORMAT_ORDER."""
+        return self._run_formats(run.find(_w("rPr")))
+
+    def _run_formats(self, rpr: Optional[ET.Element]) -> Tuple[str, ...]:
+        formats = set(self._formats(rpr))
+        if rpr is not None:
+            style_id = _attr(rpr.find(_w("rStyle")), "val")
+            if style_id and self._styles.get(style_id) != "hyperlink":
+                formats.update(self._char_formats.get(style_id, ()))
+        return tuple(f for f in FORMAT_ORDER if f in formats)
+
+    @staticmethod
+    def _check_supported(el: ET.Element) -> None:
+        feature = _UNSUPPORTED_TAGS.get(tuple(el.tag[1:].split("}", 1)))
+        if feature:
+            raise UnsupportedDocxError(f"docx contains {feature}.")
+
+    # inlines
+
+    def _paragraph_inlines(self, parent: ET.Element) -> List[_Inline]:
+        inlines: List[_Inline] = []
+        for child in parent:
+            self._check_supported(child)
+            tag = _local(child.tag)
+            if tag in _IGNORED_PARAGRAPH_TAGS:
+                continue
+            if tag == "r":
+                inlines.extend(self._run_inlines(child))
+            elif tag == "hyperlink":
+                inlines.append(self._hyperlink(child))
+            elif tag in _TRANSPARENT_TAGS:
+                inlines.extend(self._paragraph_inlines(child))
+            elif tag == "sdt":
+                content = child.find(_w("sdtContent"))
+                if content is not None:
+                    inlines.extend(self._paragraph_inlines(content))
+            else:
+                raise UnsupportedDocxError(f"unsupported element <{tag}> in a paragraph.")
+        return inlines
+
+    def _run_inlines(self, run: ET.Element) -> Iterator[_Inline]:
+        formats = self.run_formats(run)
+        for child in run:
+            self._check_supported(child)
+            tag = _local(child.tag)
+            if tag in _IGNORED_RUN_TAGS:
+                continue
+            if tag == "t":
+                yield _Inline("text", child.text or "", formats)
+            elif tag in {"tab", "ptab"}:
+                yield _Inline("text", " ", formats)
+            elif tag == "noBreakHyphen":
+                yield _Inline("text", "-", formats)
+            elif tag in {"br", "cr"}:
+                if _attr(child, "type") not in {"page", "column"}:
+                    yield _Inline("break")
+            elif tag == "drawing":
+                yield _Inline("raw", self._image(child), formats)
+            else:
+                raise UnsupportedDocxError(f"unsupported element <{tag}> in a run.")
+
+    def _hyperlink(self, link: ET.Element) -> _Inline:
+        rel_id = _attr(link, "id", R_NS)
+        if rel_id is None or rel_id not in self._rels:
+            raise UnsupportedDocxError("internal links are not supported.")
+        url = self._rels[rel_id][0]
+        text = _render_inlines(_normalize_space(self._paragraph_inlines(link)))
+        escaped_url = url.replace("\\", "/").replace("%", r"\%").replace("#", r"\#")
+        if text == escape_latex_text(url):
+            return _Inline("raw", rf"\url{{{escaped_url}}}")
+        return _Inline("raw", rf"\href{{{escaped_url}}}{{{text}}}")
+
+    def image_member(self, rel_id: Optional[str]) -> Optional[str]:
+        """the zip member of the image a relationship embeds; None if it is linked or unknown."""
+        if rel_id not in self._rels or self._rels[rel_id][1]:
+            return None
+        target = self._rels[rel_id][0]
+        return target.lstrip("/") if target.startswith("/") else f"word/{target}"
+
+    def _image(self, drawing: ET.Element) -> str:
+        frame = drawing.find(f"{{{WP_NS}}}inline")
+        if frame is None:
+            frame = drawing.find(f"{{{WP_NS}}}anchor")
+        blip = drawing.find(f".//{{{A_NS}}}blip")
+        rel_id = _attr(blip, "embed", R_NS)
+        member = self.image_member(rel_id)
+        if frame is None or member is None:
+            raise UnsupportedDocxError("docx contains a drawing that is not an embedded picture.")
+
+        name = Path(member).name
+        self.media.setdefault(name, member)
+
+        opts = []
+        extent = frame.find(f"{{{WP_NS}}}extent")
+        if extent is not None:
+            for key, attr in (("width", "cx"), ("height", "cy")):
+                inches = f"{int(extent.get(attr, '0')) / EMU_PER_INCH:.5f}".rstrip("0").rstrip(".")
+                opts.append(f"{key}={inches}in")
+        doc_pr = frame.find(f"{{{WP_NS}}}docPr")
+        descr = doc_pr.get("descr", "") if doc_pr is not None else ""
+        if descr:
+            opts.append(f"alt={{{escape_latex_text(descr)}}}")
+        return rf"\includegraphics[{','.join(opts)}]{{{self.media_prefix}/{name}}}"
+
+    # blocks
+
+    def paragraph_style(self, p: ET.Element) -> Tuple[str, int, Optional[str], int]:
+        """style name, heading level (0 if none), list numId (None outside lists) and list level of a w:p."""
+        ppr = p.find(_w("pPr"))
+        style_id = _attr(ppr.find(_w("pStyle")), "val") if ppr is not None else None
+        style = self._styles.get(style_id, (style_id or "").lower()) if style_id else ""
+        # like pandoc, only the style's name counts: an undefined "Heading2" is a paragraph.
+        heading = re.fullmatch(r"heading (\d)", style)
+        heading_level = int(heading.group(1)) if heading else 0
+        num_id, ilvl = self._style_numbering.get(style_id, (None, 0))
+        num_pr = ppr.find(_w("numPr")) if ppr is not None else None
+        if num_pr is not None:
+            num_id = _attr(num_pr.find(_w("numId")), "val") or num_id
+            ilvl = int(_attr(num_pr.find(_w("ilvl")), "val") or ilvl)
+        if not num_id or num_id == "0" or heading_level:
+            return style, heading_level, None, 0
+        return style, heading_level, num_id, ilvl
+
+    def _paragraph(self, p: ET.Element) -> _Paragraph:
+        style, heading_level, num_id, ilvl = self.paragraph_style(p)
+        if style in METADATA_STYLES:
+            raise UnsupportedDocxError(f"paragraph style {style!r} becomes pandoc metadata.")
+
+        para = _Paragraph(
+            style=style,
+            inlines=_normalize_space(self._paragraph_inlines(p)),
+            heading_level=heading_level,
+            num_id=num_id,
+            ilvl=ilvl,
+        )
+        ppr = p.find(_w("pPr"))
+        if ppr is not None:
+            para.align = _attr(ppr.find(_w("jc")), "val")
+
+        content = [i for i in para.inlines if i.kind != "text" or i.value.strip()]
+        if len(content) == 1 and content[0].value.startswith(r"\includegraphics"):
+            para.image = content[0].value
+        return para
+
+    def _table(self, tbl: ET.Element, caption: Optional[str]) -> _Table:
+        widths = [int(_attr(col, "w") or 0) for col in tbl.iter(_w("gridCol"))]
+        if not widths or not all(widths):
+            raise UnsupportedDocxError("table has no column grid.")
+        header_rows: List[List[str]] = []
+        rows: List[List[str]] = []
+        aligns: List[Optional[str]] = []
+        for tr in tbl.findall(_w("tr")):
+            cells = []
+            for tc in tr.findall(_w("tc")):
+                tcpr = tc.find(_w("tcPr"))
+                if tcpr is not None and (
+                    int(_attr(tcpr.find(_w("gridSpan")), "val") or 1) > 1
+                    or tcpr.find(_w("vMerge")) is not None
+                ):
+                    raise UnsupportedDocxError("tables with merged cells are not supported.")
+                paragraphs = []
+                for child in tc:
+                    tag = _local(child.tag)
+                    if tag == "tcPr":
+                        continue
+                    if tag != "p":
+                        raise UnsupportedDocxError(f"unsupported <{tag}> inside a table cell.")
+                    para = self._paragraph(child)
+                    if para.num_id or para.heading_level:
+                        raise UnsupportedDocxError("lists and headings inside tables are not supported.")
+                    paragraphs.append(para)
+                if not rows and not header_rows:
+                    aligns.append(paragraphs[0].align if paragraphs else None)
+                cells.append("\n\n".join(
+                    _render_inlines(p.inlines) for p in paragraphs if not p.is_empty
+                ))
+            if len(cells) > len(widths):
+                raise UnsupportedDocxError("table row is wider than its column grid.")
+            cells += [""] * (len(widths) - len(cells))
+            trpr = tr.find(_w("trPr"))
+            is_header = trpr is not None and _is_on(trpr.find(_w("tblHeader")))
+            (header_rows if is_header and not rows else rows).append(cells)
+
+        if not header_rows and len(rows) > 1 and _first_row_is_header(tbl):
+            header_rows.append(rows.pop(0))
+
+        if caption is None:
+            tbl_caption = _attr(tbl.find(f"{_w('tblPr')}/{_w('tblCaption')}"), "val")
+            if tbl_caption:
+                caption = escape_latex_text(tbl_caption)
+        return _Table(widths, header_rows, rows, aligns, caption)
+
+    def iter_body(self) -> Iterator[object]:
+        """paragraphs and tables of word/document.xml, parsed one top-level element at a time."""
+        depth = 0
+        with self.open_document() as fh:
+            for event, el in ET.iterparse(fh, events=("start", "end")):
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth != 2:
+                    continue
+                self._check_supported(el)
+                tag = _local(el.tag)
+                if tag == "p":
+                    yield self._paragraph(el)
+                elif tag == "tbl":
+                    yield el
+                elif tag == "sdt":
+                    content = el.find(_w("sdtContent"))
+                    for child in content if content is not None else ():
+                        if _local(child.tag) == "p":
+                            yield self._paragraph(child)
+                elif tag == "sectPr":
+                    self.text_width = _text_width(el)
+                elif tag not in {"bookmarkStart", "bookmarkEnd"}:
+                    raise UnsupportedDocxError(f"unsupported element <{tag}> in the body.")
+                if tag != "tbl":
+                    el.clear()
+
+    def blocks(self) -> Iterator[object]:
+        pending_list: List[_Paragraph] = []
+        items = iter(self.iter_body())
+        block = next(items, None)
+        while block is not None:
+            nxt = next(items, None)
+            if isinstance(block, _Paragraph) and block.num_id:
+                pending_list.append(block)
+                block = nxt
+                continue
+            if pending_list:
+                yield self._render_list(pending_list)
+                pending_list = []
+
+            if isinstance(block, ET.Element):
+                caption = None
+                if isinstance(nxt, _Paragraph) and nxt.is_caption:
+                    caption = _render_inlines(nxt.inlines)
+                    nxt = next(items, None)
+                yield self._table(block, caption)
+                block.clear()
+            elif block.is_caption and isinstance(nxt, ET.Element):
+                yield self._table(nxt, _render_inlines(block.inlines))
+                nxt.clear()
+                nxt = next(items, None)
+            elif block.image and isinstance(nxt, _Paragraph) and nxt.is_caption:
+                yield "\n".join([
+                    r"\begin{figure}",
+                    r"\centering",
+                    block.image,
+                    rf"\caption{{{_render_inlines(nxt.inlines)}}}",
+                    r"\end{figure}",
+                ])
+                nxt = next(items, None)
+            elif block.heading_level:
+                yield self._render_heading(block)
+            elif not block.is_empty:
+                yield _render_inlines(block.inlines)
+            block = nxt
+        if pending_list:
+            yield self._render_list(pending_list)
+
+    def _render_heading(self, para: _Paragraph) -> str:
+        if para.heading_level > len(HEADING_COMMANDS):
+            raise UnsupportedDocxError("headings deeper than level 5 are not supported.")
+        plain = "".join(i.value for i in para.inlines if i.kind == "text").strip()
+        identifier = heading_identifier(plain)
+        count = self._identifiers.get(identifier, 0)
+        self._identifiers[identifier] = count + 1
+        if count:
+            identifier = f"{identifier}-{count}"
+
+        title = _render_inlines(para.inlines)
+        if any(i.formats or i.kind != "text" for i in para.inlines):
+            title = rf"\texorpdfstring{{{title}}}{{{escape_latex_text(plain)}}}"
+        command = HEADING_COMMANDS[para.heading_level - 1]
+        return rf"\{command}{{{title}}}\label{{{identifier}}}"
+
+    def _render_list(self, paragraphs: List[_Paragraph]) -> str:
+        roots: List[_List] = []
+        stack: List[_List] = []
+        for para in paragraphs:
+            while stack and (
+                stack[-1].ilvl > para.ilvl
+                or (stack[-1].ilvl == para.ilvl and stack[-1].num_id != para.num_id)
+            ):
+                stack.pop()
+            if not stack or stack[-1].ilvl < para.ilvl:
+                new_list = _List(para.num_id, para.ilvl)
+                if stack and stack[-1].items:
+                    stack[-1].items[-1].children.append(new_list)
+                else:
+                    roots.append(new_list)
+                stack.append(new_list)
+            stack[-1].items.append(_ListItem(
+                content=_render_inlines(para.inlines),
+                compact=para.style == "compact",
+            ))
+        return "\n\n".join(self._render_list_env(lst, 0) for lst in roots)
+
+    def _render_list_env(self, lst: _List, enum_depth: int) -> str:
+        level = self._numbering.get(lst.num_id, {}).get(lst.ilvl)
+        ordered = level is not None and level.fmt not in {"bullet", "none"}
+        lines = []
+        if ordered:
+            if enum_depth >= len(ENUM_COUNTERS):
+                raise UnsupportedDocxError("numbered lists nested deeper than four levels.")
+            counter = ENUM_COUNTERS[enum_depth]
+            style = NUMBER_STYLES.get(level.fmt, "arabic")
+            marker = f"\\{style}{{{counter}}}"
+            if re.fullmatch(r"\(%\d\)", level.text):
+                label = f"({marker})"
+            elif re.fullmatch(r"%\d\)", level.text):
+                label = f"{marker})"
+            else:
+                label = f"{marker}."
+            key = (lst.num_id, lst.ilvl)
+            start = level.start + self._list_counts.get(key, 0)
+            self._list_counts[key] = self._list_counts.get(key, 0) + len(lst.items)
+            lines += [r"\begin{enumerate}", f"\\def\\label{counter}{{{label}}}"]
+            if start != 1:
+                lines.append(f"\\setcounter{{{counter}}}{{{start - 1}}}")
+            enum_depth += 1
+        else:
+            lines.append(r"\begin{itemize}")
+        if all(item.compact and not item.children for item in lst.items):
+            lines.append(r"\tightlist")
+        for item in lst.items:
+            lines.append(r"\item")
+            parts = [item.content] if item.content else []
+            parts += [self._render_list_env(child, enum_depth) for child in item.children]
+            if parts:
+                lines.append(_indent("\n\n".join(parts)))
+        lines.append(r"\end{enumerate}" if ordered else r"\end{itemize}")
+        return "\n".join(lines)
+
+    def extract_media(self, dest_dir) -> Path:
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        for name, member in self.media.items():
+            with self._zip.open(member) as src, open(dest_dir / name, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        return dest_dir
+
+    def to_latex(self) -> str:
+        # tables are rendered last: their widths depend on the page size in the trailing sectPr.
+        blocks = list(self.blocks())
+        body = "\n\n".join(
+            _render_table(b, self.text_width) if isinstance(b, _Table) else b for b in blocks
+        )
+        return f"{IR_PREAMBLE}\n\\begin{{document}}\n\n{body}\n\n\\end{{document}}\n"
+
+
+def _text_width(sect_pr: ET.Element) -> int:
+    page = sect_pr.find(_w("pgSz"))
+    margins = sect_pr.find(_w("pgMar"))
+    width = int(_attr(page, "w") or DEFAULT_PAGE_WIDTH_TWIPS)
+    left = int(_attr(margins, "left") or DEFAULT_MARGIN_TWIPS)
+    right = int(_attr(margins, "right") or DEFAULT_MARGIN_TWIPS)
+    return width - left - right
+
+
+def _first_row_is_header(tbl: ET.Element) -> bool:
+    look = tbl.find(f"{_w('tblPr')}/{_w('tblLook')}")
+    if look is None:
+        return False
+    first_row = _attr(look, "firstRow")
+    if first_row is not None:
+        return first_row in {"1", "true", "on"}
+    return bool(int(_attr(look, "val") or "0", 16) & 0x0020)
+
+
+def _indent(text: str) -> str:
+    return "\n".join(f"  {line}" if line else line for line in text.split("\n"))
+
+
+def _normalize_space(inlines: List[_Inline]) -> List[_Inline]:
+    """collapse whitespace like pandoc: single spaces, none at paragraph or line-break edges."""
+    out: List[_Inline] = []
+    after_space = True
+    for inline in inlines:
+        if inline.kind == "break":
+            if out and out[-1].kind == "text":
+                out[-1] = replace(out[-1], value=out[-1].value.rstrip(" "))
+            out.append(inline)
+            after_space = True
+            continue
+        if inline.kind == "raw":
+            out.append(inline)
+            after_space = False
+            continue
+        value = re.sub(r"[ \t\r\n]+", " ", inline.value)
+        if after_space:
+            value = value.lstrip(" ")
+        if not value:
+            continue
+        after_space = value.endswith(" ")
+        if out and out[-1].kind == "text" and out[-1].formats == inline.formats:
+            out[-1] = replace(out[-1], value=out[-1].value + value)
+        else:
+            out.append(replace(inline, value=value))
+    while out and out[-1].kind == "text" and not out[-1].value.strip(" "):
+        out.pop()
+    if out and out[-1].kind == "text":
+        out[-1] = replace(out[-1], value=out[-1].value.rstrip(" "))
+    return out
+
+
+# a span is (kind, value, children): ("text", str, None), ("break", "", None),
+# ("raw", latex, None) or ("fmt", format name, [spans]).
+_Span = Tuple[str, str, Optional[list]]
+
+
+def _stack(formats: List[str], spans: List[_Span]) -> List[_Span]:
+    if not spans:
+        return []
+    for name in reversed(formats):
+        spans = [("fmt", name, spans)]
+    return spans
+
+
+def _unstack(spans: List[_Span]) -> Tuple[List[str], List[_Span]]:
+    formats = []
+    while len(spans) == 1 and spans[0][0] == "fmt":
+        formats.append(spans[0][1])
+        spans = spans[0][2]
+    return formats, spans
+
+
+def _concat(*parts: List[_Span]) -> List[_Span]:
+    out: List[_Span] = []
+    for part in parts:
+        for span in part:
+            if span[0] == "text" and out and out[-1][0] == "text":
+                out[-1] = ("text", re.sub(" {2,}", " ", out[-1][1] + span[1]), None)
+            else:
+                out.append(span)
+    return out
+
+
+def _space_out(spans: List[_Span], *, left: bool) -> Tuple[List[_Span], List[_Span]]:
+    """move a leading (left) or trailing space out of the formatting around spans."""
+    formats, inner = _unstack(spans)
+    edge = 0 if left else -1
+    if not inner or inner[edge][0] != "text":
+        return [], spans
+    text = inner[edge][1]
+    stripped = text.lstrip(" ") if left else text.rstrip(" ")
+    if stripped == text:
+        return [], spans
+    rest = [("text", stripped, None)] if stripped else []
+    inner = rest + inner[1:] if left else inner[:-1] + rest
+    return [("text", " ", None)], _stack(formats, inner)
+
+
+def _combine(x: List[_Span], y: List[_Span]) -> List[_Span]:
+    """
+    join two inline lists the way pandoc's docx reader does: formatting shared
+    by the touching ends is factored out, so a bold run next to a bold italic
+    run becomes \\textbf{a \\emph{b}}.
+    """
+    if not x or not y:
+        return _concat(x, y)
+    xfs, xs = _unstack(x[-1:])
+    yfs, ys = _unstack(y[:1])
+    shared = [f for f in xfs if f in yfs]
+    if shared:
+        middle = _stack(shared, _combine(
+            _stack([f for f in xfs if f not in shared], xs),
+            _stack([f for f in yfs if f not in shared], ys),
+        ))
+    else:
+        x_space, x_last = _space_out(x[-1:], left=False)
+        y_space, y_first = _space_out(y[:1], left=True)
+        middle = _concat(x_last, x_space, y_space, y_first)
+    return _concat(x[:-1], middle, y[1:])
+
+
+def _render_spans(spans: List[_Span]) -> str:
+    out = []
+    for kind, value, children in spans:
+        if kind == "text":
+            out.append(escape_latex_text(value))
+        elif kind == "break":
+            out.append("\\\\\n")
+        elif kind == "raw":
+            out.append(value)
+        else:
+            out.append(f"\\{_FORMAT_COMMANDS[value]}{{{_render_spans(children)}}}")
+    return "".join(out)
+
+
+def _render_inlines(inlines: List[_Inline]) -> str:
+    spans: List[_Span] = []
+    for inline in inlines:
+        leaf = (inline.kind, inline.value, None)
+        spans = _combine(spans, _stack(list(inline.formats), [leaf]))
+    return _render_spans(spans)
+
+
+def _table_row(cells: List[str]) -> str:
+    # pandoc leaves no double space around an empty cell, but keeps the one before \\.
+    tokens = [cells[0]]
+    for cell in cells[1:]:
+        tokens += ["&", cell]
+    return " ".join(t for t in tokens if t) + r" \\"
+
+
+def _render_table(table: _Table, text_width: int) -> str:
+    n = len(table.widths)
+    # pandoc measures columns against the text width less 10 twips per column gap.
+    usable = text_width - 10 * (n - 1)
+    fractions = [w / usable for w in table.widths]
+    total = sum(fractions)
+    if total > 1:
+        fractions = [f / total for f in fractions]
+    aligns = [
+        ALIGN_COMMANDS.get(a or "", r"\raggedright")
+        for a in table.aligns + [None] * (n - len(table.aligns))
+    ]
+
+    colspecs = [
+        f"  >{{{align}\\arraybackslash}}p{{(\\linewidth - {2 * (n - 1)}\\tabcolsep) * \\real{{{f:.4f}}}}}"
+        for align, f in zip(aligns, fractions)
+    ]
+    lines = [r"\begin{longtable}[]{@{}", "\n".join(colspecs) + "@{}}"]
+    if table.caption is not None:
+        lines.append(rf"\caption{{{table.caption}}}\tabularnewline")
+
+    header = [
+        _table_row([
+            f"\\begin{{minipage}}[b]{{\\linewidth}}{align}\n{cell}\n\\end{{minipage}}"
+            for align, cell in zip(aligns, row)
+        ])
+        for row in table.header_rows
+    ]
+    if header and table.caption is not None:
+        lines += [r"\toprule\noalign{}", *header, r"\midrule\noalign{}", r"\endfirsthead"]
+        lines += [r"\toprule\noalign{}", *header, r"\midrule\noalign{}", r"\endhead"]
+    elif header:
+        lines += [r"\toprule\noalign{}", *header, r"\midrule\noalign{}", r"\endhead"]
+    elif table.caption is not None:
+        lines += [r"\toprule\noalign{}", r"\endfirsthead", r"\endhead"]
+    else:
+        lines += [r"\toprule\noalign{}", r"\endhead"]
+    lines += [r"\bottomrule\noalign{}", r"\endlastfoot"]
+    lines += [_table_row(row) for row in table.rows]
+    lines.append(r"\end{longtable}")
+
+    latex = "\n".join(lines)
+    if table.caption is None:
+        latex = "{\\def\\LTcaptype{none} % do not increment counter\n" + latex + "\n}"
+    return latex
+
+
+def read_docx_to_tex(input_docx, output_tex, figures_dir, *, media_prefix: str) -> Path:
+    """write the intermediate latex for input_docx and extract its images into figures_dir."""
+    with DocxReader(input_docx, media_prefix=media_prefix) as reader:
+        latex = reader.to_latex()
+        reader.extract_media(figures_dir)
+    Path(output_tex).write_text(latex)
+    return Path(output_tex)
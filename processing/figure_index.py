@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import struct
+from typing import Dict, Optional, Tuple
+
+from processing.cache import sha256_hex
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# word and pandoc assume 96 dpi for images that do not record a resolution.
+DEFAULT_DPI = 96.0
+# SOFn markers carrying the frame size; C4, C8 and CC are other segments.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+HEADER_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True)
+class ImageInfo:
+    width_px: int
+    height_px: int
+    dpi: Optional[Tuple[float, float]] = None
+
+    def size_in(self) -> Tuple[float, float]:
+        dpi_x, dpi_y = self.dpi or (DEFAULT_DPI, DEFAULT_DPI)
+        return self.width_px / dpi_x, self.height_px / dpi_y
+
+
+def _png_info(fh) -> Optional[ImageInfo]:
+    header = fh.read(24)
+    if len(header) < 24 or header[:8] != PNG_SIGNATURE or header[12:16] != b"IHDR":
+        return None
+    width, height = struct.unpack(">II", header[16:24])
+    fh.seek(8 + 8 + 13 + 4)  # signature, IHDR length/type, IHDR data, crc
+
+    dpi = None
+    while True:
+        chunk = fh.read(8)
+        if len(chunk) < 8:
+            break
+        length, kind = struct.unpack(">I4s", chunk)
+        if kind == b"pHYs" and length == 9:
+            ppu_x, ppu_y, unit = struct.unpack(">IIB", fh.read(9))
+            if unit == 1 and ppu_x and ppu_y:  # pixels per metre
+                dpi = (ppu_x * 0.0254, ppu_y * 0.0254)
+            break
+        if kind in (b"IDAT", b"IEND"):
+            break  # pHYs must come before the image data
+        fh.seek(length + 4, 1)
+    return ImageInfo(width, height, dpi)
+
+
+def _jpeg_info(data: bytes) -> Optional[ImageInfo]:
+    if data[:2] != b"\xff\xd8":
+        return None
+    dpi = None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        (length,) = struct.unpack(">H", data[i + 2 : i + 4])
+        segment = data[i + 4 : i + 2 + length]
+        if marker == 0xE0 and segment[:5] == b"JFIF\0" and len(segment) >= 12:
+            unit, density_x, density_y = struct.unpack(">BHH", segment[7:12])
+            if density_x and density_y:
+                if unit == 1:
+                    dpi = (float(density_x), float(density_y))
+                elif unit == 2:  # dots per cm
+                    dpi = (density_x * 2.54, density_y * 2.54)
+        elif marker in JPEG_SOF_MARKERS and len(segment) >= 5:
+            height, width = struct.unpack(">HH", segment[1:5])
+            return ImageInfo(width, height, dpi)
+        elif marker == 0xDA:
+            return None
+        i += 2 + length
+    return None
+
+
+def read_image_info(path) -> Optional[ImageInfo]:
+    """
+    pixel size and resolution from the png/jpeg header, without decoding the
+    image. the format is sniffed, since word keeps whatever extension it was given.
+    """
+    try:
+        with open(path, "rb") as fh:
+            magic = fh.read(8)
+            fh.seek(0)
+            if magic == PNG_SIGNATURE:
+                return _png_info(fh)
+            if magic[:2] == b"\xff\xd8":
+                return _jpeg_info(fh.read(HEADER_BYTES))
+    except (OSError, struct.error):
+        return None
+    return None
+
+
+@dataclass
+class FigureIndex:
+    """image headers of a Figures/ dir, looked up by file name."""
+
+    images: Dict[str, ImageInfo]
+
+    @classmethod
+    def build(cls, figures_dir) -> "FigureIndex":
+        figures_dir = Path(figures_dir)
+        images = {}
+        if figures_dir.exists():
+            for path in sorted(figures_dir.rglob("*")):
+                info = read_image_info(path) if path.is_file() else None
+                if info is not None:
+                    images[path.name] = info
+        return cls(images)
+
+    def get(self, tex_path: str) -> Optional[ImageInfo]:
+        """the image an \\includegraphics path points at; figures are flat, so the name decides."""
+        return self.images.get(tex_path.rsplit("/", 1)[-1])
+
+    def fingerprint(self) -> str:
+        return sha256_hex(repr(sorted(self.images.items())))
@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+from pathlib import Path
+import re
+import shutil
+import threading
+from typing import Dict, Optional
+
+from processing.cache import default_cache_root, sha256_file, write_atomic
+from processing.figure_index import read_image_info
+from processing.layout import COLUMN_WIDTH_IN, TEXT_WIDTH_IN
+
+try:
+    from PIL import Image
+except ImportError:  # pillow is optional; without it figures are copied as extracted.
+    Image = None
+
+# what pillow raises for a file it will not decode; the file then ships untouched.
+# DecompressionBombError (an image far over Image.MAX_IMAGE_PIXELS) is not an OSError.
+UNREADABLE_IMAGE_ERRORS = (OSError, ValueError) + ((Image.DecompressionBombError,) if Image is not None else ())
+
+
+# widths standardize_figs assigns, including the doubled-backslash form it
+# writes outside figure environments.
+WIDTH_INCHES = {
+    r"\textwidth": TEXT_WIDTH_IN,
+    r"\columnwidth": COLUMN_WIDTH_IN,
+    r"\\columnwidth": COLUMN_WIDTH_IN,
+}
+TARGET_DPI = 300
+JPEG_QUALITY = 90
+OPTIMIZABLE_SUFFIXES = {".png", ".jpg", ".jpeg"}
+# bump whenever optimize_image output changes so cached figures are not reused.
+OPTIMIZER_VERSION = "4"
+# bytes per pixel assumed when budgeting decodes: rgba, the widest mode figures use.
+DECODED_BYTES_PER_PIXEL = 4
+
+INCLUDE_WIDTH_RE = re.compile(r"\\includegraphics\[width=(\\\\?[a-z]+)\]\{Figures/([^}]+)\}")
+
+
+def figure_widths(tex: str) -> Dict[str, float]:
+    """printed width in inches of each Figures/ file, the widest use winning."""
+    widths: Dict[str, float] = {}
+    for match in INCLUDE_WIDTH_RE.finditer(tex):
+        inches = WIDTH_INCHES.get(match.group(1))
+        if inches is not None:
+            name = match.group(2)
+            widths[name] = max(widths.get(name, 0.0), inches)
+    return widths
+
+
+def optimize_image(data: bytes, *, max_width_px: int, dpi: int) -> bytes:
+    """
+    downscale to at most max_width_px wide and recompress: png losslessly,
+    jpeg at JPEG_QUALITY. the input is returned when the result is not smaller.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        # keep the format the file really is; word may have given a png a .jpg name.
+        image_format = image.format
+        if image_format == "JPEG" and image.width > max_width_px:
+            # let the jpeg decoder scale by 1/2, 1/4 or 1/8 while decoding, so
+            # a phone photo is never held at full size just to be shrunk. this
+            # only works before load().
+            image.draft(image.mode, (max_width_px, round(image.height * max_width_px / image.width)))
+        image.load()
+        if image.width > max_width_px:
+            if image.mode not in ("RGB", "RGBA", "L", "LA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+            height = max(1, round(image.height * max_width_px / image.width))
+            image = image.resize((max_width_px, height), Image.LANCZOS)
+
+        out = io.BytesIO()
+        if image_format == "PNG":
+            image.save(out, format="PNG", optimize=True, dpi=(dpi, dpi))
+        elif image_format == "JPEG":
+            if image.mode not in ("RGB", "L", "CMYK"):
+                image = image.convert("RGB")
+            image.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True, dpi=(dpi, dpi))
+        else:
+            return data
+
+    optimized = out.getvalue()
+    return optimized if len(optimized) < len(data) else data
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class FigureCache:
+    """optimized figures under <root>/<source hash>-<target>.<ext>; entries are never modified."""
+
+    def __init__(self, root=None, *, max_entries: int = 2000):
+        self.root = Path(root) if root is not None else default_cache_root() / "figures"
+        self.max_entries = max_entries
+
+    def path(self, src: Path, *, max_width_px: int, dpi: int) -> Path:
+        key = f"{sha256_file(src)}-{max_width_px}-{dpi}-{OPTIMIZER_VERSION}"
+        return self.root / f"{key}{src.suffix.lower()}"
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.root.iterdir():
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            try:
+                path.unlink()
+            except OSError:
+                pass
+
+
+class DecodeBudget:
+    """
+    caps the bytes of decoded images held at once across threads. an image
+    larger than the whole budget still runs, but only on its own.
+    """
+
+    def __init__(self, limit_bytes: int):
+        self.limit_bytes = limit_bytes
+        self._used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, nbytes: int) -> None:
+        with self._cond:
+            while self._used and self._used + nbytes > self.limit_bytes:
+                self._cond.wait()
+            self._used += nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._cond:
+            self._used -= nbytes
+            self._cond.notify_all()
+
+
+def _decoded_bytes(src: Path) -> int:
+    info = read_image_info(src)
+    if info is None:
+        return 0
+    return info.width_px * info.height_px * DECODED_BYTES_PER_PIXEL
+
+
+def _optimize_one(
+    src: Path,
+    dst: Path,
+    *,
+    width_in: Optional[float],
+    dpi: int,
+    cache: Optional[FigureCache],
+    budget: Optional[DecodeBudget] = None,
+) -> None:
+    if width_in is None or src.suffix.lower() not in OPTIMIZABLE_SUFFIXES:
+        _link_or_copy(src, dst)
+        return
+
+    max_width_px = round(width_in * dpi)
+    cached = cache.path(src, max_width_px=max_width_px, dpi=dpi) if cache is not None else None
+    if cached is not None and cached.exists():
+        os.utime(cached)
+        _link_or_copy(cached, dst)
+        return
+
+    nbytes = _decoded_bytes(src) if budget is not None else 0
+    if budget is not None:
+        budget.acquire(nbytes)
+    try:
+        data = src.read_bytes()
+        try:
+            optimized = optimize_image(data, max_width_px=max_width_px, dpi=dpi)
+        except UNREADABLE_IMAGE_ERRORS:
+            # not an image pillow can read (a truncated one, or a decompression bomb); ship it untouched.
+            optimized = data
+    finally:
+        if budget is not None:
+            budget.release(nbytes)
+
+    if cached is None:
+        dst.write_bytes(optimized)
+        return
+    write_atomic(cached, optimized)
+    _link_or_copy(cached, dst)
+
+
+def optimize_figures(
+    figures_dir,
+    output_dir,
+    *,
+    widths: Dict[str, float],
+    dpi: int = TARGET_DPI,
+    cache: Optional[FigureCache] = None,
+    max_workers: Optional[int] = None,
+    max_memory_mb: Optional[int] = None,
+) -> Path:
+    """
+    write figures_dir's files to output_dir, resampling every png/jpeg with a
+    known printed width to dpi. figures_dir is only read, so it may be a
+    cached ir entry. without pillow, figures_dir is returned unchanged.
+    max_memory_mb: bound on the decoded images the worker threads hold at
+    once, measured from the image headers; None leaves only max_workers.
+    """
+    figures_dir = Path(figures_dir)
+    if Image is None or not figures_dir.exists():
+        return figures_dir
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if cache is not None:
+        cache.root.mkdir(parents=True, exist_ok=True)
+
+    sources = sorted(path for path in figures_dir.rglob("*") if path.is_file())
+    for src in sources:
+        (output_dir / src.relative_to(figures_dir)).parent.mkdir(parents=True, exist_ok=True)
+
+    budget = DecodeBudget(max_memory_mb * 1024 * 1024) if max_memory_mb else None
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(
+                _optimize_one,
+                src,
+                output_dir / src.relative_to(figures_dir),
+                width_in=widths.get(src.relative_to(figures_dir).as_posix()),
+                dpi=dpi,
+                cache=cache,
+                budget=budget,
+            )
+            for src in sources
+        ]
+        for future in futures:
+            future.result()
+
+    if cache is not None:
+        cache.evict()
+    return output_dir
@@ -1,157 +1,143 @@
+from dataclasses import dataclass, replace
 from pathlib import Path
 import shutil
-import re
-
-from processing.citations import apply_citation_pipeline, replace_superscript_citations, CitationResult
-from processing.standardize_tables import standardize_tables
-
-
-def _dim_to_inches(value: str, unit: str) -> float | None:
-    try:
-        num = float(value)
-    except ValueError:
-        return None
-
-    unit = unit.lower()
-    if unit == "in":
-        return num
-    if unit == "cm":
-        return num / 2.54
-    if unit == "mm":
-        return num / 25.4
-    if unit == "pt":
-        return num / 72.27
-    if unit == "bp":
-        return num / 72.0
-    return None
-
-
-def _is_wide_figure(block: str, *, width_threshold_in: float, height_threshold_in: float) -> bool:
-    include_re = re.compile(r"\\includegraphics(?:\[(?P<opts>[^\]]*)\])?\{[^}]+\}")
-    width_re = re.compile(r"width\s*=\s*([0-9.]+)\s*(in|cm|mm|pt|bp)")
-    height_re = re.compile(r"height\s*=\s*([0-9.]+)\s*(in|cm|mm|pt|bp)")
-
-    for match in include_re.finditer(block):
-        opts = match.group("opts") or ""
-        width_match = width_re.search(opts)
-        if width_match:
-            w = _dim_to_inches(width_match.group(1), width_match.group(2))
-            if w is not None and w >= width_threshold_in:
-                return True
-
-        height_match = height_re.search(opts)
-        if height_match:
-            h = _dim_to_inches(height_match.group(1), height_match.group(2))
-            if h is not None and h >= height_threshold_in:
-                return True
-
-    return False
-
-
-def _set_includegraphics_width(text: str, width: str) -> str:
-    def repl_opts(_: re.Match) -> str:
-        return f"\\includegraphics[width={width}]"
-
-    def repl_no_opts(_: re.Match) -> str:
-        return f"\\includegraphics[width={width}]{{"
-
-    text = re.sub(
-        r"\\includegraphics\[[^\]]*\]",
-        repl_opts,
-        text,
-    )
-    text = re.sub(
-        r"\\includegraphics(?!\[)\{",
-        repl_no_opts,
-        text,
-    )
-    return text
 
+from processing.citations import (
+    CitationDiagnostics,
+    CitationIndex,
+    locate_references_section,
+    parse_reference_section,
+)
+from processing.figure_index import FigureIndex
+from processing.latex_scan import find_heading, scan_headings
+from processing.latex_rewrite import (
+    OUTSIDE_FIGURE_WIDTH,
+    RewriteOptions,
+    rewrite_latex,
+    rewrite_sections,
+)
+from processing.metrics import stage
 
-def standardize_figs(tex_string):
-    figure_re = re.compile(
-        r"(\\begin{figure\*?}(?:\[[^\]]*\])?)(.*?)(\\end{figure\*?})",
-        re.DOTALL,
-    )
 
-    out = []
-    last = 0
-    for match in figure_re.finditer(tex_string):
-        out.append(_set_includegraphics_width(tex_string[last:match.start()], r"\\columnwidth"))
+# bump whenever convert_body output changes so cached bodies are not reused.
+CONVERTER_VERSION = "8"
 
-        begin, body, end = match.groups()
-        is_star = begin.startswith(r"\begin{figure*}")
-        wide = is_star or _is_wide_figure(body, width_threshold_in=4.5, height_threshold_in=4.5)
 
-        if wide and not is_star:
-            begin = begin.replace(r"\begin{figure}", r"\begin{figure*}", 1)
-            end = end.replace(r"\end{figure}", r"\end{figure*}", 1)
+def standardize_figs(tex_string, *, figure_index=None):
+    """
+    figure_index: optional FigureIndex of the Figures/ dir, so images without
+    a size in the latex are measured from their headers.
+    """
+    return rewrite_latex(
+        tex_string,
+        RewriteOptions(
+            figures=True,
+            graphics_width=OUTSIDE_FIGURE_WIDTH,
+            figure_index=figure_index,
+        ),
+    )
 
-        target_width = r"\textwidth" if wide else r"\columnwidth"
-        if r"\captionsetup" not in body:
-            body = f"\\captionsetup{{width={target_width}}}\n" + body
-        body = _set_includegraphics_width(body, target_width)
-        out.append(f"{begin}{body}{end}")
-        last = match.end()
 
-    out.append(_set_includegraphics_width(tex_string[last:], r"\\columnwidth"))
-    return "".join(out)
+@dataclass
+class ConvertedBody:
+    abstract_text: str
+    body_text: str
+    bibtex: str | None = None
+    citations: CitationDiagnostics | None = None
 
 
-def convert_to_msurj(
-    pandoc_tex_path,
-    metadata,
+def convert_body(
+    text,
     *,
     enable_citations=True,
-    return_bibtex=False,
     anystyle_cmd="anystyle",
-):
+    anystyle_pool=None,
+    reference_cache=None,
+    timings=None,
+    figure_index=None,
+    chunk_cache=None,
+) -> ConvertedBody:
     """
-    convert a pandoc latex file into msurj-formatted latex.
-    metadata: dict with authors, title, submitted_date, article_type, affiliations, keywords, email
+    everything in the conversion that depends only on the pandoc latex:
+    abstract split, cleanup, tables, citations and figure widths. the rewrites
+    run as one scan per part, see processing.latex_rewrite. citation numbers
+    with no reference are left as they are and reported in .citations.
+    timings: optional dict that receives the "references" and "rewrite" stage times.
+    figure_index: optional FigureIndex used to size figures the latex gives no size.
+    chunk_cache: optional PipelineCache; unchanged sections of a revised
+    manuscript are taken from it instead of being rewritten.
     """
-    text = Path(pandoc_tex_path).read_text()
-
-    abstract_start = text.find(r'\section{Abstract}')
-    if abstract_start == -1:
+    # pandoc writes a standalone document; its \end{document} would otherwise
+    # end up in the last reference.
+    document_end = text.rfind("\\end{document}")
+    if document_end != -1:
+        text = text[:document_end]
+    # one scan finds every heading; the abstract and reference lists are cut by it.
+    headings = scan_headings(text)
+    abstract = find_heading(headings, "Abstract")
+    if abstract is None:
         raise ValueError("No Abstract section found in file.")
-    text_after_abstract = text[abstract_start + len(r'\section{Abstract}') :]
-
-    section_match = re.search(r'\\section\{', text_after_abstract)
-    if section_match:
-        abstract_text = text_after_abstract[:section_match.start()].strip()
-        body_text = text_after_abstract[section_match.start():].strip()
-    else:
-        abstract_text = text_after_abstract.strip()
-        body_text = ""
-
-    body_text = re.sub(r'\\tightlist', '', body_text)
-    body_text = re.sub(r'\\setlength\{\\parskip\}\{[^}]+\}', '', body_text)
-    body_text = re.sub(r'\\setlength\{\\parindent\}\{[^}]+\}', '', body_text)
-
-    body_text = re.sub(
-        r'\\includegraphics(\[.*?\])?\{.*?([^/]+?\.(png|jpg|jpeg|pdf))\}',
-        r'\\includegraphics\1{Figures/\2}', body_text
+    following = next((h for h in headings if h.start >= abstract.title_end), None)
+    body_start = following.start if following is not None else len(text)
+    abstract_text = text[abstract.title_end : body_start].strip()
+    body_text = text[body_start:].strip()
+
+    options = RewriteOptions(
+        cleanup=True,
+        figure_paths=True,
+        graphics_width=OUTSIDE_FIGURE_WIDTH,
+        figures=True,
+        tables=True,
+        figure_index=figure_index,
     )
 
-    body_text = standardize_tables(body_text)
-
     bibtex_content = None
+    diagnostics = None
+    abstract_options = RewriteOptions(
+        figures=True,
+        graphics_width=OUTSIDE_FIGURE_WIDTH,
+        figure_index=figure_index,
+    )
     if enable_citations:
-        try:
-            citation_result: CitationResult = apply_citation_pipeline(
-                body_text, anystyle_cmd=anystyle_cmd
-            )
-            body_text = citation_result.body_text
-            abstract_text = replace_superscript_citations(
-                abstract_text,
-                citation_result.key_map,
-                wrap_in_superscript=True,
+        # the reference list only needs the cleanup and table passes before
+        # anystyle sees it; the key map it yields drives the main scan.
+        with stage("references", timings):
+            ref_start, ref_end = locate_references_section(text, headings=headings, start=body_start)
+            ref_section = rewrite_latex(
+                text[ref_end:],
+                RewriteOptions(cleanup=True, figure_paths=True, tables=True),
+            ).strip()
+            if not ref_section:
+                raise ValueError("References section found but it is empty.")
+            bibtex_content, key_map = parse_reference_section(
+                ref_section,
+                anystyle_cmd=anystyle_cmd,
+                anystyle_pool=anystyle_pool,
+                reference_cache=reference_cache,
             )
-            bibtex_content = citation_result.bibtex
-        except Exception:
-            raise
+        # one index for the whole document, so abstract and body share its parses.
+        citations = CitationIndex(key_map)
+        options = replace(options, citations=citations)
+        abstract_options = replace(abstract_options, citations=citations)
+        body_text = text[body_start:ref_start]
+        diagnostics = citations.diagnose(abstract_text, body_text)
+
+    with stage("rewrite", timings):
+        body_text = rewrite_sections(body_text, options, cache=chunk_cache)
+        if enable_citations:
+            body_text = body_text.rstrip()
+        abstract_text = rewrite_latex(abstract_text, abstract_options)
+
+    return ConvertedBody(
+        abstract_text=abstract_text,
+        body_text=body_text,
+        bibtex=bibtex_content,
+        citations=diagnostics,
+    )
 
+
+def render_msurj(converted: ConvertedBody, metadata) -> str:
+    """wrap a converted body in the msurj header; cheap enough to redo for every metadata change."""
     header = f"""
         \\documentclass{{msurj}}
         \\usepackage{{multirow}}
@@ -166,15 +152,46 @@ def convert_to_msurj(
         {{{metadata['affiliations']}}}
         {{{metadata['keywords']}}}
         {{{metadata['email']}}}
-        {{{abstract_text}}}
+        {{{converted.abstract_text}}}
         \\end{{@twocolumnfalse}}]
         """
 
-    final_tex = f"{header}\n\n{body_text}\n\n\\printbibliography\n\\end{{document}}"
-    final_tex = standardize_figs(final_tex)
+    return f"{header}\n\n{converted.body_text}\n\n\\printbibliography\n\\end{{document}}"
+
+
+def convert_to_msurj(
+    pandoc_tex_path,
+    metadata,
+    *,
+    enable_citations=True,
+    return_bibtex=False,
+    anystyle_cmd="anystyle",
+    anystyle_pool=None,
+    reference_cache=None,
+):
+    """
+    convert a pandoc latex file into msurj-formatted latex.
+    metadata: dict with authors, title, submitted_date, article_type, affiliations, keywords, email
+    anystyle_pool: optional AnyStylePool of warm workers; the cli is used when it is None or unhealthy.
+    reference_cache: optional ReferenceCache; only references missing from it are parsed.
+    """
+    text = Path(pandoc_tex_path).read_text()
+    figure_index = FigureIndex.build(Path(pandoc_tex_path).parent / "Figures")
+
+    with stage("convert"):
+        converted = convert_body(
+            text,
+            enable_citations=enable_citations,
+            anystyle_cmd=anystyle_cmd,
+            anystyle_pool=anystyle_pool,
+            reference_cache=reference_cache,
+            figure_index=figure_index,
+        )
+    with stage("render"):
+        final_tex = render_msurj(converted, metadata)
 
     if return_bibtex:
-        return final_tex, bibtex_content
+        return final_tex, converted.bibtex
     return final_tex
 
 def create_output_directory(
@@ -185,9 +202,16 @@ def create_output_directory(
     output_root=None,
     template_dir=None,
     figures_dir=None,
+    paper_num=None,
+    asset_store=None,
 ):
+    """
+    asset_store: optional AssetStore under output_root; the fonts, class and
+    figures are then hardlinked from it instead of copied into every paper.
+    """
     project_root = Path.cwd()
-    paper_num = Path(pandoc_tex_path).stem
+    if paper_num is None:
+        paper_num = Path(pandoc_tex_path).stem
 
     if output_root is None:
         output_root = project_root / "output"
@@ -204,25 +228,37 @@ def create_output_directory(
         template_dir = project_root / "output" / "template_dir"
     else:
         template_dir = Path(template_dir)
-    shutil.copytree(
-        template_dir,
-        output_dir,
-        dirs_exist_ok=True
-    )
-
     if figures_dir is None:
         figures_dir = project_root / "data" / "ir_tex" / paper_num / "Figures"
     else:
         figures_dir = Path(figures_dir)
 
-    if figures_dir.exists():
-        shutil.copytree(
-            figures_dir,
-            output_dir / "Figures",
-            dirs_exist_ok=True
-        )
-    else:
+    if asset_store is not None:
+        with stage("template_copy"):
+            files = asset_store.add_tree(template_dir, output_dir)
+        if figures_dir.exists():
+            files.update(
+                (f"Figures/{relpath}", digest)
+                for relpath, digest in asset_store.add_tree(figures_dir, output_dir / "Figures").items()
+            )
         (output_dir / "Figures").mkdir(parents=True, exist_ok=True)
+        asset_store.write_manifest(output_dir, files)
+    else:
+        with stage("template_copy"):
+            shutil.copytree(
+                template_dir,
+                output_dir,
+                dirs_exist_ok=True
+            )
+
+        if figures_dir.exists():
+            shutil.copytree(
+                figures_dir,
+                output_dir / "Figures",
+                dirs_exist_ok=True
+            )
+        else:
+            (output_dir / "Figures").mkdir(parents=True, exist_ok=True)
 
     if bibtex_content:
         bib_path = output_dir / "bib.bib"
@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, replace
+from functools import lru_cache
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+from processing.cache import sha256_hex
+
+from processing.citations import SUPERSCRIPT_RE, CitationIndex
+from processing.figure_index import FigureIndex
+from processing.latex_scan import Environment, scan_environments
+from processing.standardize_tables import convert_longtable, match_longtable
+
+
+# width given to \includegraphics outside figure environments. the doubled
+# backslash is what the regex rewrite this replaces has always emitted.
+OUTSIDE_FIGURE_WIDTH = r"\\columnwidth"
+
+WIDE_FIGURE_THRESHOLD_IN = 4.5
+
+FIGURE_RE = re.compile(
+    r"(\\begin{figure\*?}(?:\[[^\]]*\])?)(.*?)(\\end{figure\*?})",
+    re.DOTALL,
+)
+FIGURE_PATH_RE = re.compile(r"\\includegraphics(\[.*?\])?\{.*?([^/]+?\.(png|jpg|jpeg|pdf))\}")
+GRAPHICS_OPTS_RE = re.compile(r"\\includegraphics\[[^\]]*\]")
+GRAPHICS_NO_OPTS_RE = re.compile(r"\\includegraphics(?!\[)\{")
+INCLUDE_RE = re.compile(r"\\includegraphics(?:\[(?P<opts>[^\]]*)\])?\{(?P<path>[^}]+)\}")
+WIDTH_OPT_RE = re.compile(r"width\s*=\s*([0-9.]+)\s*(in|cm|mm|pt|bp)")
+HEIGHT_OPT_RE = re.compile(r"height\s*=\s*([0-9.]+)\s*(in|cm|mm|pt|bp)")
+SECTION_START_RE = re.compile(r"^\\section\{", re.MULTILINE)
+
+
+@dataclass(frozen=True)
+class RewriteOptions:
+    """
+    which rewrites a pass applies.
+    cleanup: drop \\tightlist and pandoc's \\setlength{\\parskip}/{\\parindent}.
+    figure_paths: point \\includegraphics at Figures/<basename>.
+    graphics_width: width forced on \\includegraphics outside figures; None leaves them alone.
+    figures: standardize figure environments (figure*, captionsetup, image widths).
+    tables: convert longtables to table+tabularx.
+    citations: CitationIndex turning numeric superscripts into \\cite; None leaves them alone.
+    figure_index: image sizes for figures whose \\includegraphics gives none.
+    """
+
+    cleanup: bool = False
+    figure_paths: bool = False
+    graphics_width: Optional[str] = None
+    figures: bool = False
+    tables: bool = False
+    citations: Optional[CitationIndex] = None
+    wrap_in_superscript: bool = True
+    figure_index: Optional[FigureIndex] = None
+
+
+# a handler gets the text and the trigger match and returns (replacement, end),
+# or None to keep the trigger as it is.
+Handler = Callable[[str, re.Match, RewriteOptions], Optional[Tuple[str, int]]]
+
+
+@dataclass(frozen=True)
+class RewriteRule:
+    name: str
+    trigger: str
+    handler: Handler
+    enabled: Callable[[RewriteOptions], bool]
+
+
+def _dim_to_inches(value: str, unit: str) -> float | None:
+    try:
+        num = float(value)
+    except ValueError:
+        return None
+
+    unit = unit.lower()
+    if unit == "in":
+        return num
+    if unit == "cm":
+        return num / 2.54
+    if unit == "mm":
+        return num / 25.4
+    if unit == "pt":
+        return num / 72.27
+    if unit == "bp":
+        return num / 72.0
+    return None
+
+
+def _is_wide_figure(
+    block: str,
+    *,
+    width_threshold_in: float,
+    height_threshold_in: float,
+    figure_index: Optional[FigureIndex] = None,
+) -> bool:
+    for match in INCLUDE_RE.finditer(block):
+        opts = match.group("opts") or ""
+        width_match = WIDTH_OPT_RE.search(opts)
+        if width_match:
+            w = _dim_to_inches(width_match.group(1), width_match.group(2))
+            if w is not None and w >= width_threshold_in:
+                return True
+
+        height_match = HEIGHT_OPT_RE.search(opts)
+        if height_match:
+            h = _dim_to_inches(height_match.group(1), height_match.group(2))
+            if h is not None and h >= height_threshold_in:
+                return True
+
+        if width_match or height_match or figure_index is None:
+            continue
+        # no size in the latex: the image is set at its natural size.
+        info = figure_index.get(match.group("path"))
+        if info is not None:
+            w, h = info.size_in()
+            if w >= width_threshold_in or h >= height_threshold_in:
+                return True
+
+    return False
+
+
+def figure_is_wide(block: str, *, figure_index: Optional[FigureIndex] = None) -> bool:
+    """whether the \\includegraphics in a figure's latex need both columns."""
+    return _is_wide_figure(
+        block,
+        width_threshold_in=WIDE_FIGURE_THRESHOLD_IN,
+        height_threshold_in=WIDE_FIGURE_THRESHOLD_IN,
+        figure_index=figure_index,
+    )
+
+
+def set_includegraphics_width(text: str, width: str) -> str:
+    def repl_opts(_: re.Match) -> str:
+        return f"\\includegraphics[width={width}]"
+
+    def repl_no_opts(_: re.Match) -> str:
+        return f"\\includegraphics[width={width}]{{"
+
+    text = GRAPHICS_OPTS_RE.sub(repl_opts, text)
+    text = GRAPHICS_NO_OPTS_RE.sub(repl_no_opts, text)
+    return text
+
+
+def standardize_figure(
+    begin: str,
+    body: str,
+    end: str,
+    *,
+    figure_index: Optional[FigureIndex] = None,
+) -> str:
+    """
+    one figure environment, promoted to figure* when its images are wide.
+    figure_index supplies the natural size of images included without one.
+    """
+    is_star = begin.startswith(r"\begin{figure*}")
+    wide = is_star or figure_is_wide(body, figure_index=figure_index)
+
+    if wide and not is_star:
+        begin = begin.replace(r"\begin{figure}", r"\begin{figure*}", 1)
+        end = end.replace(r"\end{figure}", r"\end{figure*}", 1)
+
+    target_width = r"\textwidth" if wide else r"\columnwidth"
+    if r"\captionsetup" not in body:
+        body = f"\\captionsetup{{width={target_width}}}\n" + body
+    body = set_includegraphics_width(body, target_width)
+    return f"{begin}{body}{end}"
+
+
+def _drop(text: str, match: re.Match, options: RewriteOptions) -> Tuple[str, int]:
+    return "", match.end()
+
+
+def _includegraphics(text: str, match: re.Match, options: RewriteOptions) -> Tuple[str, int]:
+    start = match.start()
+    path = FIGURE_PATH_RE.match(text, start) if options.figure_paths else None
+    if path is not None:
+        span, end = path.expand(r"\\includegraphics\1{Figures/\2}"), path.end()
+    else:
+        opts = GRAPHICS_OPTS_RE.match(text, start) or GRAPHICS_NO_OPTS_RE.match(text, start)
+        end = opts.end() if opts else match.end()
+        span = text[start:end]
+
+    if options.graphics_width is not None:
+        span = set_includegraphics_width(span, options.graphics_width)
+    return span, end
+
+
+def _figure(text: str, match: re.Match, options: RewriteOptions) -> Optional[Tuple[str, int]]:
+    figure = FIGURE_RE.match(text, match.start())
+    if figure is None:
+        return None
+    begin, body, end = figure.groups()
+    body = rewrite_latex(body, replace(options, figures=False, graphics_width=None))
+    return standardize_figure(begin, body, end, figure_index=options.figure_index), figure.end()
+
+
+@lru_cache(maxsize=4)
+def _longtables(text: str) -> Dict[int, Environment]:
+    """the closed longtables of text outside comments, by where their \\begin sits; one scan per text."""
+    return {env.start: env for env in scan_environments(text) if env.name == "longtable"}
+
+
+def _longtable(text: str, match: re.Match, options: RewriteOptions) -> Optional[Tuple[str, int]]:
+    env = _longtables(text).get(match.start())
+    if env is None:  # commented out, escaped or never closed
+        return None
+    inner = replace(options, tables=False)
+    colspec, content_start, end = match_longtable(text, env.start, env=env)
+    if colspec is None:
+        return rewrite_latex(text[env.start:end], inner), end
+
+    content = rewrite_latex(text[content_start : env.body_end], inner)
+    return convert_longtable(colspec, content), end
+
+
+def _superscript(text: str, match: re.Match, options: RewriteOptions) -> Optional[Tuple[str, int]]:
+    superscript = SUPERSCRIPT_RE.match(text, match.start())
+    if superscript is None:
+        return None
+    cite = options.citations.cite(
+        superscript.group(1), wrap_in_superscript=options.wrap_in_superscript
+    )
+    if cite is None:
+        return None
+    return cite, superscript.end()
+
+
+RULES = (
+    RewriteRule("tightlist", r"\\tightlist", _drop, lambda o: o.cleanup),
+    RewriteRule(
+        "setlength",
+        r"\\setlength\{\\(?:parskip|parindent)\}\{[^}]+\}",
+        _drop,
+        lambda o: o.cleanup,
+    ),
+    RewriteRule(
+        "includegraphics",
+        r"\\includegraphics",
+        _includegraphics,
+        lambda o: o.figure_paths or o.graphics_width is not None,
+    ),
+    RewriteRule("figure", r"\\begin\{figure\*?\}", _figure, lambda o: o.figures),
+    RewriteRule("longtable", r"\\begin\{longtable\}", _longtable, lambda o: o.tables),
+    RewriteRule(
+        "superscript",
+        r"\\textsuperscript\{",
+        _superscript,
+        lambda o: o.citations is not None,
+    ),
+)
+
+_HANDLERS = {rule.name: rule.handler for rule in RULES}
+
+
+@lru_cache(maxsize=None)
+def _trigger_pattern(names: Tuple[str, ...]) -> re.Pattern:
+    return re.compile("|".join(
+        f"(?P<{rule.name}>{rule.trigger})" for rule in RULES if rule.name in names
+    ))
+
+
+def rewrite_latex(text: str, options: RewriteOptions) -> str:
+    """
+    apply every enabled rule in one left-to-right scan. text between triggers is
+    copied as is; figure and table handlers rewrite their own contents first.
+    """
+    names = tuple(rule.name for rule in RULES if rule.enabled(options))
+    if not names:
+        return text
+    pattern = _trigger_pattern(names)
+
+    out = []
+    pos = 0
+    while True:
+        match = pattern.search(text, pos)
+        if match is None:
+            break
+        result = _HANDLERS[match.lastgroup](text, match, options)
+        if result is None:
+            out.append(text[pos:match.end()])
+            pos = match.end()
+            continue
+        replacement, end = result
+        out.append(text[pos:match.start()])
+        out.append(replacement)
+        pos = end
+
+    out.append(text[pos:])
+    return "".join(out)
+
+
+def options_fingerprint(options: RewriteOptions) -> str:
+    """identifies everything besides the text that a rewrite's output depends on."""
+    citations = options.citations.fingerprint() if options.citations is not None else None
+    figures = options.figure_index.fingerprint() if options.figure_index is not None else None
+    return sha256_hex(repr((
+        options.cleanup,
+        options.figure_paths,
+        options.graphics_width,
+        options.figures,
+        options.tables,
+        citations,
+        options.wrap_in_superscript,
+        figures,
+    )))
+
+
+def split_sections(text: str) -> List[str]:
+    """text cut before every \\section{ that starts a line; joining the parts gives it back."""
+    starts = [match.start() for match in SECTION_START_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+
+
+def _chunk_key_text(chunk: str, options: RewriteOptions) -> str:
+    """
+    the text a chunk is cached by. with figure_paths the output keeps only each
+    figure's file name, so the per-job directory pandoc extracted it to is left
+    out and a revised manuscript still hits on the sections holding figures.
+    """
+    if not options.figure_paths:
+        return chunk
+    return FIGURE_PATH_RE.sub(r"\\includegraphics\1{Figures/\2}", chunk)
+
+
+def rewrite_sections(text: str, options: RewriteOptions, *, cache=None) -> str:
+    """
+    rewrite_latex section by section, reusing each section's output from cache
+    (get_chunk/put_chunk, see PipelineCache) when its text and options were seen before.
+    no rule reaches across a section heading, so the result is the same as one scan.
+    """
+    if cache is None:
+        return rewrite_latex(text, options)
+
+    fingerprint = options_fingerprint(options)
+    out = []
+    for chunk in split_sections(text):
+        key = cache.chunk_key(fingerprint, _chunk_key_text(chunk, options))
+        rewritten = cache.get_chunk(key)
+        if rewritten is None:
+            rewritten = rewrite_latex(chunk, options)
+            cache.put_chunk(key, rewritten)
+        out.append(rewritten)
+    return "".join(out)
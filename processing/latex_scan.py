@@ -0,0 +1,234 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+import re
+from typing import Iterator, List, Optional, Tuple
+
+
+# only \begin, \end and comment signs are searched for, so the \\ ending each
+# row and every \% cost nothing; whether a backslash is itself escaped is
+# checked afterwards.
+_ENV_TOKEN_RE = re.compile(r"\\(?:(begin|end)\{([^{}]*)\}|\\%)|%(?<!\\%)")
+# control symbols first so \{, \}, \% and \\ never count as delimiters.
+_BRACE_TOKEN_RE = re.compile(r"\\[\\%{}\[\]]|[{}]|%[^\n]*")
+_BRACKET_TOKEN_RE = re.compile(r"\\[\\%{}\[\]]|[{}\[\]]|%[^\n]*")
+# only \section{, not \section*{: a starred heading stays part of the text
+# around it, so it does not end the abstract.
+_SECTION_TOKEN_RE = re.compile(r"\\section\{|%")
+_TITLE_MARKUP_RE = re.compile(r"\\[A-Za-z]+\*?|[{}]")
+
+
+@dataclass(frozen=True)
+class Environment:
+    """one \\begin{name}...\\end{name} pair; depth 0 is outermost."""
+
+    name: str
+    start: int
+    body_start: int
+    body_end: int
+    end: int
+    depth: int
+
+    def contains(self, pos: int) -> bool:
+        return self.start <= pos < self.end
+
+
+@dataclass(frozen=True)
+class Heading:
+    """one \\section{...}: its plain title, where it starts, where the title's brace closes and where its line ends."""
+
+    title: str
+    start: int
+    title_end: int
+    line_end: int
+
+
+def _escaped(text: str, pos: int) -> bool:
+    """true when an odd run of backslashes ends just before pos."""
+    run = 0
+    while pos - run > 0 and text[pos - run - 1] == "\\":
+        run += 1
+    return run % 2 == 1
+
+
+def _environment_tokens(text: str, start: int, stop: int) -> Iterator[Tuple[str, str, int, int]]:
+    """(kind, name, start, end) of each \\begin/\\end outside comments."""
+    pos = start
+    while True:
+        match = _ENV_TOKEN_RE.search(text, pos, stop)
+        if match is None:
+            return
+        pos = match.end()
+        kind = match.group(1)
+        escaped = match.group() != "%" and _escaped(text, match.start())
+        if kind is not None:
+            if escaped:
+                pos = match.start() + 1
+            else:
+                yield kind, match.group(2), match.start(), pos
+        elif not escaped:  # % or \\%: a comment runs to the end of the line
+            pos = text.find("\n", pos, stop)
+            if pos == -1:
+                return
+
+
+def scan_environments(text: str, start: int = 0, stop: Optional[int] = None) -> List[Environment]:
+    """
+    every matched environment in text[start:stop], in order of \\begin, found in
+    one pass. comments and escaped characters are skipped; a stray \\end is
+    ignored and an environment that is never closed is left out.
+    """
+    stop = len(text) if stop is None else stop
+    found: List[Environment] = []
+    stack: List[Tuple[str, int, int]] = []
+    for kind, name, token_start, token_end in _environment_tokens(text, start, stop):
+        if kind == "begin":
+            stack.append((name, token_start, token_end))
+            continue
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth][0] == name:
+                _, begin_start, body_start = stack[depth]
+                del stack[depth:]
+                found.append(Environment(name, begin_start, body_start, token_start, token_end, depth))
+                break
+    found.sort(key=lambda env: env.start)
+    return found
+
+
+def match_environment(text: str, start: int) -> Optional[Environment]:
+    """the environment whose \\begin sits at start, with its matching \\end; None if unclosed."""
+    stack: List[str] = []
+    body_start = None
+    for kind, name, token_start, token_end in _environment_tokens(text, start, len(text)):
+        if kind == "begin":
+            if body_start is None:
+                if token_start != start:
+                    return None
+                body_start = token_end
+            stack.append(name)
+            continue
+        if name not in stack:
+            continue
+        del stack[len(stack) - 1 - stack[::-1].index(name):]
+        if not stack:
+            return Environment(
+                text[start + len(r"\begin{") : body_start - 1],
+                start,
+                body_start,
+                token_start,
+                token_end,
+                0,
+            )
+    return None
+
+
+def match_brace(text: str, start: int) -> Tuple[str, int]:
+    """(inside, end) of the {...} group opening at start; end is just past the closing brace."""
+    if start >= len(text) or text[start] != "{":
+        raise ValueError("Expected '{' while parsing LaTeX block.")
+    depth = 0
+    for match in _BRACE_TOKEN_RE.finditer(text, start):
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start + 1 : match.start()], match.end()
+    raise ValueError("Unterminated '{' while parsing LaTeX block.")
+
+
+def match_bracket(text: str, start: int) -> int:
+    """end of the [...] option group opening at start; brackets inside braces do not count."""
+    if start >= len(text) or text[start] != "[":
+        return start
+    brackets = 0
+    braces = 0
+    for match in _BRACKET_TOKEN_RE.finditer(text, start):
+        token = match.group()
+        if token == "{":
+            braces += 1
+        elif token == "}":
+            braces = max(0, braces - 1)
+        elif braces == 0 and token == "[":
+            brackets += 1
+        elif braces == 0 and token == "]":
+            brackets -= 1
+            if brackets == 0:
+                return match.end()
+    return len(text)
+
+
+def top_level(environments: List[Environment]) -> List[Environment]:
+    """the environments not nested inside another one of the list."""
+    out: List[Environment] = []
+    for env in environments:
+        if not out or env.start >= out[-1].end:
+            out.append(env)
+    return out
+
+
+def outside_environments(matches, environments: List[Environment]):
+    """the regex matches (in order) that do not fall inside any of environments."""
+    spans = top_level(environments)
+    i = 0
+    for match in matches:
+        while i < len(spans) and spans[i].end <= match.start():
+            i += 1
+        if i < len(spans) and spans[i].start <= match.start():
+            continue
+        yield match
+
+
+def plain_title(latex: str) -> str:
+    """
+    the text of a heading title without markup: pandoc writes a bold heading
+    as \\texorpdfstring{\\textbf{Abstract}}{Abstract}, which reads "Abstract".
+    """
+    while True:
+        index = latex.find("\\texorpdfstring")
+        if index == -1:
+            break
+        try:
+            _, first_end = match_brace(latex, latex.find("{", index))
+            second, second_end = match_brace(latex, first_end)
+        except ValueError:
+            break
+        latex = latex[:index] + second + latex[second_end:]
+    return " ".join(_TITLE_MARKUP_RE.sub(" ", latex).split())
+
+
+def scan_headings(text: str) -> List[Heading]:
+    """every \\section heading (not \\section*) outside comments, in one pass, with brace-matched titles."""
+    headings: List[Heading] = []
+    pos = 0
+    while True:
+        match = _SECTION_TOKEN_RE.search(text, pos)
+        if match is None:
+            return headings
+        if _escaped(text, match.start()):
+            pos = match.start() + 1
+            continue
+        if match.group() == "%":
+            pos = text.find("\n", match.end())
+            if pos == -1:
+                return headings
+            continue
+        try:
+            title, title_end = match_brace(text, match.end() - 1)
+        except ValueError:
+            pos = match.end()
+            continue
+        newline = text.find("\n", title_end)
+        line_end = len(text) if newline == -1 else newline + 1
+        headings.append(Heading(plain_title(title), match.start(), title_end, line_end))
+        pos = title_end
+
+
+def find_heading(headings: List[Heading], title: str, *, start: int = 0) -> Optional[Heading]:
+    """the first heading at or after start titled title, ignoring case and a trailing colon or period."""
+    title = title.casefold()
+    for heading in headings:
+        if heading.start >= start and heading.title.rstrip(":.").casefold() == title:
+            return heading
+    return None
@@ -0,0 +1,55 @@
+"""escaping plain text for latex, shared by the native docx reader and the citation code."""
+
+from __future__ import annotations
+
+
+_TEXT_ESCAPES = {
+    "{": r"\{",
+    "}": r"\}",
+    "$": r"\$",
+    "&": r"\&",
+    "#": r"\#",
+    "_": r"\_",
+    "%": r"\%",
+    "^": r"\^{}",
+    "[": "{[}",
+    "]": "{]}",
+    " ": "~",
+    "–": "--",
+    "—": "---",
+    "“": "``",
+    "”": "''",
+    "‘": "`",
+    "’": "'",
+}
+# commands that need a terminator before a letter (a space) or a space ({}).
+_TEXT_COMMANDS = {
+    "\\": r"\textbackslash",
+    "~": r"\textasciitilde",
+    "<": r"\textless",
+    ">": r"\textgreater",
+    "|": r"\textbar",
+    "'": r"\textquotesingle",
+    "…": r"\ldots",
+}
+
+
+def escape_latex_text(text: str) -> str:
+    """text as pandoc's latex writer escapes it outside math and verbatim."""
+    out = []
+    for i, ch in enumerate(text):
+        if ch in _TEXT_ESCAPES:
+            out.append(_TEXT_ESCAPES[ch])
+        elif ch in _TEXT_COMMANDS:
+            nxt = text[i + 1] if i + 1 < len(text) else ""
+            if nxt.isascii() and nxt.isalpha():
+                out.append(_TEXT_COMMANDS[ch] + " ")
+            elif nxt in {"", " "}:
+                out.append(_TEXT_COMMANDS[ch] + "{}")
+            else:
+                out.append(_TEXT_COMMANDS[ch])
+        elif ch == "-" and text[i + 1 : i + 2] == "-":
+            out.append(r"-\/")
+        else:
+            out.append(ch)
+    return "".join(out)
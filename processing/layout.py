@@ -0,0 +1,6 @@
+from __future__ import annotations
+
+
+# msurj.cls: 8.5in paper with .5in margins, two columns 10pt apart.
+TEXT_WIDTH_IN = 7.5
+COLUMN_WIDTH_IN = (TEXT_WIDTH_IN - 10 / 72.27) / 2
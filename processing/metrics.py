@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = tuple(float(1024 * 4 ** i) for i in range(10))  # 1 KiB .. 256 MiB
+
+STAGE_SECONDS = "msurj_stage_seconds"
+ARTIFACT_BYTES = "msurj_artifact_bytes"
+REFERENCE_CACHE_LOOKUPS = "msurj_reference_cache_lookups_total"
+
+_NULL_STAGE = nullcontext()
+
+
+@dataclass
+class Histogram:
+    buckets: Tuple[float, ...]
+    counts: List[int] = field(default_factory=list)
+    total: float = 0.0
+    count: int = 0
+
+    def __post_init__(self) -> None:
+        if not self.counts:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+@dataclass
+class _Family:
+    help: str
+    label: str
+    buckets: Tuple[float, ...]
+    series: Dict[str, Histogram] = field(default_factory=dict)
+
+
+@dataclass
+class _CounterFamily:
+    help: str
+    label: str
+    values: Dict[str, float] = field(default_factory=dict)
+
+
+class MetricsRegistry:
+    """
+    in-process histograms and counters keyed by one label, rendered in prometheus
+    text format. disabled registries drop observations, so stage() costs one
+    attribute check.
+    """
+
+    def __init__(self, *, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._families: Dict[str, _Family] = {
+            STAGE_SECONDS: _Family("Time spent in each conversion stage.", "stage", SECONDS_BUCKETS),
+            ARTIFACT_BYTES: _Family("Size of each conversion input and output.", "artifact", BYTES_BUCKETS),
+        }
+        self._counters: Dict[str, _CounterFamily] = {
+            REFERENCE_CACHE_LOOKUPS: _CounterFamily("Reference cache lookups by result.", "result"),
+        }
+
+    def observe(self, name: str, label_value: str, value: float) -> None:
+        if not self.enabled:
+            return
+        family = self._families[name]
+        with self._lock:
+            histogram = family.series.get(label_value)
+            if histogram is None:
+                histogram = family.series[label_value] = Histogram(family.buckets)
+            histogram.observe(value)
+
+    def increment(self, name: str, label_value: str, amount: float = 1) -> None:
+        if not self.enabled:
+            return
+        family = self._counters[name]
+        with self._lock:
+            family.values[label_value] = family.values.get(label_value, 0) + amount
+
+    def observe_timings(self, timings: Dict[str, float]) -> None:
+        for stage_name, seconds in timings.items():
+            self.observe(STAGE_SECONDS, stage_name, seconds)
+
+    def observe_sizes(self, sizes: Dict[str, int]) -> None:
+        for artifact, nbytes in sizes.items():
+            self.observe(ARTIFACT_BYTES, artifact, nbytes)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, family in self._families.items():
+                lines.append(f"# HELP {name} {family.help}")
+                lines.append(f"# TYPE {name} histogram")
+                for label_value, histogram in sorted(family.series.items()):
+                    label = f'{family.label}="{label_value}"'
+                    cumulative = 0
+                    for bound, count in zip(family.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{{label},le="{bound:g}"}} {cumulative}')
+                    lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+                    lines.append(f"{name}_sum{{{label}}} {histogram.total:g}")
+                    lines.append(f"{name}_count{{{label}}} {histogram.count}")
+            for name, counter in self._counters.items():
+                lines.append(f"# HELP {name} {counter.help}")
+                lines.append(f"# TYPE {name} counter")
+                for label_value, value in sorted(counter.values.items()):
+                    lines.append(f'{name}{{{counter.label}="{label_value}"}} {value:g}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            for family in self._families.values():
+                family.series.clear()
+            for counter in self._counters.values():
+                counter.values.clear()
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Stage:
+    __slots__ = ("name", "timings", "started")
+
+    def __init__(self, name: str, timings: Optional[Dict[str, float]]):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self) -> "_Stage":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        elapsed = time.perf_counter() - self.started
+        if self.timings is not None:
+            self.timings[self.name] = self.timings.get(self.name, 0.0) + elapsed
+        REGISTRY.observe(STAGE_SECONDS, self.name, elapsed)
+
+
+def stage(name: str, timings: Optional[Dict[str, float]] = None):
+    """
+    time a block as stage name, adding it to timings (if given) and to the
+    registry (if enabled). with neither, this is a shared no-op context.
+    """
+    if timings is None and not REGISTRY.enabled:
+        return _NULL_STAGE
+    return _Stage(name, timings)
+
+
+def server_timing(timings: Dict[str, float]) -> str:
+    """a Server-Timing header value; durations are in milliseconds."""
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+
+def measure_stream(chunks: Iterable[bytes], *, stage_name: str, artifact: str) -> Iterator[bytes]:
+    """pass chunks through, recording the time to produce them and their total size."""
+    nbytes = 0
+    with stage(stage_name):
+        for chunk in chunks:
+            nbytes += len(chunk)
+            yield chunk
+    REGISTRY.observe(ARTIFACT_BYTES, artifact, nbytes)
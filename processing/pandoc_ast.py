@@ -0,0 +1,312 @@
+"""
+the body conversion on pandoc's json ast (pandoc --to=json, the "pandoc-ast"
+ir backend) instead of on the latex pandoc writes. the abstract split, the
+reference list, citations, image paths and figure layout are walks over the
+tree; pandoc writes latex once at the end, and only the table layout and the
+list cleanup, which work on pandoc's longtable and \\tightlist, still read text.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import PurePosixPath
+import subprocess
+from typing import Callable, Dict, List, Optional
+
+from processing.citations import CitationIndex, parse_reference_texts
+from processing.figure_index import FigureIndex
+from processing.get_msurj_conversion import ConvertedBody
+from processing.latex_rewrite import (
+    OUTSIDE_FIGURE_WIDTH,
+    RewriteOptions,
+    figure_is_wide,
+    rewrite_sections,
+)
+from processing.metrics import stage
+
+
+# pandoc 3.0 introduced Figure blocks, which the figure layout walks.
+MIN_API_VERSION = (1, 23)
+FIGURE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".pdf"}
+# written between the abstract and the body so one pandoc run writes both.
+ABSTRACT_END = "%msurj:abstract-end"
+
+Node = Dict[str, object]
+
+
+def walk(value, visit: Callable[[Node], Optional[Node]]):
+    """
+    a copy of value with visit applied to every element (a dict with "t"),
+    parents first. visit returns the element's replacement, which is not
+    walked into, or None to keep the element and walk its children.
+    """
+    if isinstance(value, list):
+        return [walk(item, visit) for item in value]
+    if isinstance(value, dict):
+        if "t" in value:
+            replaced = visit(value)
+            if replaced is not None:
+                return replaced
+        return {key: walk(item, visit) for key, item in value.items()}
+    return value
+
+
+def stringify(value) -> str:
+    """the plain text of inlines or blocks, like pandoc's stringify; links read as their url."""
+    parts: List[str] = []
+
+    def visit(node: Node) -> Optional[Node]:
+        kind = node["t"]
+        if kind == "Str":
+            parts.append(node["c"])
+        elif kind in ("Space", "SoftBreak", "LineBreak"):
+            parts.append(" ")
+        elif kind in ("Code", "Math"):
+            parts.append(node["c"][1])
+        elif kind == "Link":
+            parts.append(node["c"][2][0])
+        elif kind == "Quoted":
+            quote = '"' if node["c"][0]["t"] == "DoubleQuote" else "'"
+            parts.extend([quote, stringify(node["c"][1]), quote])
+        elif kind in ("Note", "RawInline", "RawBlock"):
+            pass
+        elif kind in ("Para", "Plain"):
+            parts.extend([stringify(node["c"]), " "])
+        else:
+            return None
+        return node
+
+    walk(value, visit)
+    return " ".join("".join(parts).split())
+
+
+def _raw_inline(latex: str) -> Node:
+    return {"t": "RawInline", "c": ["latex", latex]}
+
+
+def _raw_block(latex: str) -> Node:
+    return {"t": "RawBlock", "c": ["latex", latex]}
+
+
+def _is_section(block: Node) -> bool:
+    """a level 1 heading pandoc writes as \\section{...} (not \\section*)."""
+    return block["t"] == "Header" and block["c"][0] == 1 and "unnumbered" not in block["c"][1][1]
+
+
+def find_section(blocks: List[Node], title: str, *, start: int = 0) -> Optional[int]:
+    """index of the first section heading at or after start titled title, matched like latex_scan.find_heading."""
+    title = title.casefold()
+    for i in range(start, len(blocks)):
+        if _is_section(blocks[i]) and stringify(blocks[i]["c"][2]).rstrip(":.").casefold() == title:
+            return i
+    return None
+
+
+def _list_items(blocks: List[Node]) -> List[List[Node]]:
+    """the items of the lists in blocks, looking inside block quotes and divs."""
+    items = []
+    for block in blocks:
+        if block["t"] == "OrderedList":
+            items.extend(block["c"][1])
+        elif block["t"] == "BulletList":
+            items.extend(block["c"])
+        elif block["t"] == "BlockQuote":
+            items.extend(_list_items(block["c"]))
+        elif block["t"] == "Div":
+            items.extend(_list_items(block["c"][1]))
+    return items
+
+
+def reference_texts(blocks: List[Node]) -> List[str]:
+    """one plain-text reference per list item, or per paragraph when the list is not numbered in word."""
+    items = _list_items(blocks)
+    if not items:
+        items = [[block] for block in blocks if block["t"] in ("Para", "Plain")]
+    return [text for text in (stringify(item) for item in items) if text]
+
+
+def superscripts(blocks: List[Node]) -> List[str]:
+    """the plain text of every superscript in blocks."""
+    found: List[str] = []
+
+    def visit(node: Node) -> Optional[Node]:
+        if node["t"] == "Superscript":
+            found.append(stringify(node["c"]))
+        return None
+
+    walk(blocks, visit)
+    return found
+
+
+def _image_latex(image: Node, width: Optional[str]) -> str:
+    """
+    the \\includegraphics pandoc would write for image, pointed at Figures/<name>;
+    width replaces the size pandoc would give it.
+    """
+    (_, _, attributes), _, (target, _) = image["c"]
+    name = PurePosixPath(target).name
+    if PurePosixPath(name).suffix in FIGURE_EXTENSIONS:
+        target = f"Figures/{name}"
+    if width is not None:
+        options = f"width={width}"
+    else:
+        options = ",".join(f"{key}={value}" for key, value in attributes if key in ("width", "height"))
+    return f"\\includegraphics[{options}]{{{target}}}" if options else f"\\includegraphics{{{target}}}"
+
+
+class _Rewriter:
+    """one walk over a part of the document: citations, image paths and figure layout."""
+
+    def __init__(
+        self,
+        *,
+        citations: Optional[CitationIndex],
+        figure_index: Optional[FigureIndex],
+        width: Optional[str],
+    ):
+        self.citations = citations
+        self.figure_index = figure_index
+        self.width = width
+
+    def __call__(self, node: Node) -> Optional[Node]:
+        kind = node["t"]
+        if kind == "Superscript" and self.citations is not None:
+            cite = self.citations.cite(stringify(node["c"]))
+            return _raw_inline(cite) if cite is not None else None
+        if kind == "Image":
+            return _raw_inline(_image_latex(node, self.width))
+        if kind == "Figure":
+            return self._figure(node)
+        return None
+
+    def _figure(self, figure: Node) -> Node:
+        (identifier, _, _), (_, caption), content = figure["c"]
+        # the sizes pandoc gives the images decide, as in latex_rewrite.standardize_figure.
+        images = []
+
+        def collect(node: Node) -> Optional[Node]:
+            if node["t"] == "Image":
+                images.append(_image_latex(node, None))
+            return None
+
+        walk(content, collect)
+        wide = figure_is_wide("\n".join(images), figure_index=self.figure_index)
+        environment = "figure*" if wide else "figure"
+        width = r"\textwidth" if wide else r"\columnwidth"
+
+        inner = _Rewriter(citations=self.citations, figure_index=self.figure_index, width=width)
+        caption_inlines = []
+        for block in walk(caption, inner):
+            if block["t"] in ("Para", "Plain"):
+                caption_inlines += ([{"t": "Space"}] if caption_inlines else []) + block["c"]
+        label = f"\\label{{{identifier}}}" if identifier else ""
+        blocks = [
+            _raw_block(f"\\begin{{{environment}}}\n\\captionsetup{{width={width}}}\n\\centering"),
+            *walk(content, inner),
+            {"t": "Plain", "c": [_raw_inline("\\caption{"), *caption_inlines, _raw_inline(f"}}{label}")]},
+            _raw_block(f"\\end{{{environment}}}"),
+        ]
+        return {"t": "Div", "c": [["", [], []], blocks]}
+
+
+def rewrite_blocks(
+    blocks: List[Node],
+    *,
+    citations: Optional[CitationIndex] = None,
+    figure_index: Optional[FigureIndex] = None,
+) -> List[Node]:
+    """
+    blocks with numeric superscripts turned into \\cite, images pointed at
+    Figures/ and figures laid out for one or both columns, as raw latex nodes.
+    """
+    return walk(blocks, _Rewriter(citations=citations, figure_index=figure_index, width=OUTSIDE_FIGURE_WIDTH))
+
+
+def write_latex(api_version, *parts: List[Node]) -> List[str]:
+    """each list of blocks in parts as latex, written by one pandoc run."""
+    blocks: List[Node] = []
+    for i, part in enumerate(parts):
+        if i:
+            blocks.append(_raw_block(ABSTRACT_END))
+        blocks.extend(part)
+    document = {"pandoc-api-version": api_version, "meta": {}, "blocks": blocks}
+    try:
+        result = subprocess.run(
+            ["pandoc", "--from=json", "--to=latex", "--wrap=none"],
+            input=json.dumps(document),
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+    except FileNotFoundError as exc:
+        raise RuntimeError("pandoc not found on PATH.") from exc
+    except subprocess.CalledProcessError as exc:
+        raise RuntimeError(
+            f"pandoc failed with exit code {exc.returncode}: {exc.stderr.strip()}"
+        ) from exc
+    return [part.strip() for part in result.stdout.split(ABSTRACT_END)]
+
+
+def convert_ast(
+    text,
+    *,
+    enable_citations=True,
+    anystyle_cmd="anystyle",
+    anystyle_pool=None,
+    reference_cache=None,
+    timings=None,
+    figure_index=None,
+    chunk_cache=None,
+) -> ConvertedBody:
+    """
+    convert_body for pandoc's json ast of a manuscript; same arguments and the
+    same ConvertedBody. pandoc must be on PATH to write the latex.
+    """
+    document = json.loads(text)
+    api_version = document["pandoc-api-version"]
+    if tuple(api_version[:2]) < MIN_API_VERSION:
+        raise RuntimeError("the pandoc-ast backend needs pandoc 3.0 or later.")
+    blocks = document["blocks"]
+
+    abstract = find_section(blocks, "Abstract")
+    if abstract is None:
+        raise ValueError("No Abstract section found in file.")
+    body_start = next((i for i in range(abstract + 1, len(blocks)) if _is_section(blocks[i])), len(blocks))
+    abstract_blocks = blocks[abstract + 1 : body_start]
+    body_blocks = blocks[body_start:]
+
+    bibtex_content = None
+    diagnostics = None
+    citations = None
+    if enable_citations:
+        with stage("references", timings):
+            references = find_section(blocks, "References", start=body_start)
+            if references is None:
+                raise ValueError("No References section found (expected \\section{References}).")
+            refs_plain = reference_texts(blocks[references + 1 :])
+            if not refs_plain:
+                raise ValueError("References section found but it is empty.")
+            bibtex_content, key_map = parse_reference_texts(
+                refs_plain,
+                anystyle_cmd=anystyle_cmd,
+                anystyle_pool=anystyle_pool,
+                reference_cache=reference_cache,
+            )
+        citations = CitationIndex(key_map)
+        body_blocks = blocks[body_start:references]
+        diagnostics = citations.diagnose_superscripts(superscripts(abstract_blocks + body_blocks))
+
+    with stage("rewrite", timings):
+        abstract_text, body_text = write_latex(
+            api_version,
+            rewrite_blocks(abstract_blocks, citations=citations, figure_index=figure_index),
+            rewrite_blocks(body_blocks, citations=citations, figure_index=figure_index),
+        )
+        body_text = rewrite_sections(body_text, RewriteOptions(cleanup=True, tables=True), cache=chunk_cache)
+
+    return ConvertedBody(
+        abstract_text=abstract_text,
+        body_text=body_text,
+        bibtex=bibtex_content,
+        citations=diagnostics,
+    )
@@ -1,30 +1,48 @@
+import difflib
 from pathlib import Path
+import re
+import shutil
 import subprocess
+import zipfile
 
+from processing.docx_reader import UnsupportedDocxError, read_docx_to_tex
+from processing.pandoc_server import PandocServerError, get_pandoc_pool
 
-def create_tex_ir(input_docx, *, ir_tex_dir=None):
-    project_root = Path.cwd()
-    if ir_tex_dir is None:
-        ir_tex_dir = project_root / "data" / "ir_tex"
-    else:
-        ir_tex_dir = Path(ir_tex_dir)
-    paper_num = input_docx.stem
 
-    output_dir = ir_tex_dir / paper_num
-    output_dir.mkdir(parents=True, exist_ok=True)
+IR_BACKENDS = ("pandoc", "pandoc-server", "native", "auto", "pandoc-ast")
+
+# images in pandoc's latex when media is not extracted: media/<name>, the
+# member word/media/<name> of the docx.
+_SERVER_MEDIA_RE = re.compile(r"(\\includegraphics(?:\[[^\]]*\])?\{)media/([^}]+)\}")
+
 
-    output_tex = output_dir / f"{paper_num}.tex"
+def ir_file_name(paper_num: str, backend: str) -> str:
+    """the ir create_tex_ir writes: pandoc's json ast for "pandoc-ast", latex otherwise."""
+    return f"{paper_num}.json" if backend == "pandoc-ast" else f"{paper_num}.tex"
 
-    subprocess.run([
+
+def _run_pandoc(input_docx, output_tex, output_dir, *, max_memory_mb=None, to="latex"):
+    cmd = [
         "pandoc",
         str(input_docx),
         "--from=docx",
-        "--to=latex",
+        f"--to={to}",
         "--output", str(output_tex),
         "--standalone",
         f"--extract-media={output_dir}",
         "--wrap=none"
-    ])
+    ]
+    if max_memory_mb:
+        # pandoc keeps the whole document in its heap; the ghc runtime caps it.
+        cmd += ["+RTS", f"-M{max_memory_mb}m", "-RTS"]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, text=True)
+    except FileNotFoundError as exc:
+        raise RuntimeError("pandoc not found on PATH.") from exc
+    except subprocess.CalledProcessError as exc:
+        raise RuntimeError(
+            f"pandoc failed with exit code {exc.returncode}: {exc.stderr.strip()}"
+        ) from exc
 
     media_dir = output_dir / "media"
     figures_dir = output_dir / "Figures"
@@ -35,5 +53,138 @@ def create_tex_ir(input_docx, *, ir_tex_dir=None):
     else:
         figures_dir.mkdir(parents=True, exist_ok=True)
 
+
+def _run_pandoc_server(input_docx, output_tex, output_dir, *, max_memory_mb=None) -> bool:
+    """
+    convert on a warm pandoc server, writing what _run_pandoc would;
+    false when no server is available and the cli should be used.
+    """
+    pool = get_pandoc_pool(max_memory_mb=max_memory_mb)
+    if pool is None or not pool.available:
+        return False
+    try:
+        latex = pool.convert_docx(Path(input_docx).read_bytes())
+    except PandocServerError:
+        return False
+
+    # the server has no file system access, so the images come from the docx.
+    names = {}
+
+    def relink(match):
+        name = Path(match.group(2)).name
+        names[name] = f"word/media/{match.group(2)}"
+        return f"{match.group(1)}{output_dir}/media/{match.group(2)}}}"
+
+    latex = _SERVER_MEDIA_RE.sub(relink, latex)
+    figures_dir = output_dir / "Figures"
+    if figures_dir.exists():
+        shutil.rmtree(figures_dir)
+    figures_dir.mkdir(parents=True)
+    with zipfile.ZipFile(input_docx) as docx:
+        members = set(docx.namelist())
+        for name, member in names.items():
+            if member not in members:
+                continue
+            with docx.open(member) as src, open(figures_dir / name, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+    Path(output_tex).write_text(latex)
+    return True
+
+
+def create_tex_ir(input_docx, *, ir_tex_dir=None, backend="pandoc", max_memory_mb=None):
+    """
+    backend: "pandoc" runs the pandoc cli; "pandoc-server" sends the docx to a
+    pool of warm pandoc servers (see processing.pandoc_server), falling back
+    to the cli when they cannot be used; "native" reads the docx in-process
+    with processing.docx_reader; "auto" tries the native reader and falls back
+    to pandoc when the manuscript uses something it does not handle;
+    "pandoc-ast" writes pandoc's json ast instead of latex, for
+    processing.pandoc_ast.convert_ast.
+    max_memory_mb: heap limit for pandoc (per server for "pandoc-server",
+    whose pool is kept per limit). the native reader streams
+    document.xml and the media, so it needs no limit.
+    """
+    if backend not in IR_BACKENDS:
+        raise ValueError(f"Unknown IR backend {backend!r}; expected one of {IR_BACKENDS}.")
+
+    project_root = Path.cwd()
+    if ir_tex_dir is None:
+        ir_tex_dir = project_root / "data" / "ir_tex"
+    else:
+        ir_tex_dir = Path(ir_tex_dir)
+    paper_num = input_docx.stem
+
+    output_dir = ir_tex_dir / paper_num
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    output_tex = output_dir / ir_file_name(paper_num, backend)
+
+    if backend == "pandoc":
+        _run_pandoc(input_docx, output_tex, output_dir, max_memory_mb=max_memory_mb)
+    elif backend == "pandoc-ast":
+        _run_pandoc(input_docx, output_tex, output_dir, max_memory_mb=max_memory_mb, to="json")
+    elif backend == "pandoc-server":
+        if not _run_pandoc_server(input_docx, output_tex, output_dir, max_memory_mb=max_memory_mb):
+            _run_pandoc(input_docx, output_tex, output_dir, max_memory_mb=max_memory_mb)
+    else:
+        try:
+            read_docx_to_tex(
+                input_docx,
+                output_tex,
+                output_dir / "Figures",
+                media_prefix=f"{output_dir}/media",
+            )
+        except UnsupportedDocxError:
+            if backend == "native":
+                raise
+            shutil.rmtree(output_dir / "Figures", ignore_errors=True)
+            _run_pandoc(input_docx, output_tex, output_dir, max_memory_mb=max_memory_mb)
+
     print(f"Files created in:\n{output_dir.resolve()}")
     return output_dir
+
+
+def _document_body(tex_path, output_dir):
+    text = Path(tex_path).read_text()
+    body = text[text.find(r"\begin{document}"):]
+    return body.replace(f"{output_dir}/media/", "media/")
+
+
+def compare_ir_backends(input_docx, *, work_dir):
+    """
+    unified diff between the native reader's and pandoc's latex for input_docx,
+    from \\begin{document} on; an empty list means the two backends agree.
+    """
+    input_docx = Path(input_docx)
+    work_dir = Path(work_dir)
+    bodies = {}
+    for backend in ("pandoc", "native"):
+        output_dir = create_tex_ir(input_docx, ir_tex_dir=work_dir / backend, backend=backend)
+        bodies[backend] = _document_body(output_dir / f"{input_docx.stem}.tex", output_dir)
+    return list(difflib.unified_diff(
+        bodies["pandoc"].splitlines(),
+        bodies["native"].splitlines(),
+        fromfile=f"pandoc/{input_docx.name}",
+        tofile=f"native/{input_docx.name}",
+        lineterm="",
+    ))
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+
+    mismatched = 0
+    for docx in sys.argv[1:]:
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                diff = compare_ir_backends(docx, work_dir=tmp)
+            except UnsupportedDocxError as exc:
+                print(f"{docx}: native reader skipped ({exc})")
+                continue
+        if diff:
+            mismatched += 1
+            print("\n".join(diff))
+        else:
+            print(f"{docx}: native reader matches pandoc")
+    sys.exit(1 if mismatched else 0)
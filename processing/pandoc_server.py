@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import atexit
+import base64
+import json
+import os
+import queue
+import socket
+import subprocess
+import threading
+import time
+from typing import Dict, Optional
+import urllib.error
+import urllib.request
+
+
+class PandocServerError(RuntimeError):
+    pass
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class PandocServer:
+    """
+    one `pandoc server` process, spoken to over http on localhost.
+    it is restarted after max_requests conversions so its heap cannot grow unbounded.
+    """
+
+    def __init__(
+        self,
+        *,
+        pandoc_cmd: str = "pandoc",
+        timeout: float = 120.0,
+        startup_timeout: float = 30.0,
+        max_requests: int = 200,
+        max_memory_mb: Optional[int] = None,
+    ):
+        self.pandoc_cmd = pandoc_cmd
+        self.timeout = timeout
+        self.startup_timeout = startup_timeout
+        self.max_requests = max_requests
+        self.max_memory_mb = max_memory_mb
+        self.requests = 0
+        self._proc: Optional[subprocess.Popen] = None
+        self._url = ""
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self) -> None:
+        self.close()
+        port = _free_port()
+        # pandoc's own --timeout aborts a conversion that runs away inside the server.
+        cmd = [self.pandoc_cmd, "server", "--port", str(port), "--timeout", str(int(self.timeout))]
+        if self.max_memory_mb:
+            cmd += ["+RTS", f"-M{self.max_memory_mb}m", "-RTS"]
+        try:
+            self._proc = subprocess.Popen(
+                cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+        except OSError as exc:
+            raise PandocServerError(f"could not start pandoc server: {exc}") from exc
+        self._url = f"http://127.0.0.1:{port}"
+        self.requests = 0
+
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            if not self.alive:
+                self.close()
+                raise PandocServerError("pandoc server exited on startup; pandoc 3 or later is needed.")
+            try:
+                with urllib.request.urlopen(f"{self._url}/version", timeout=1.0):
+                    return
+            except OSError:
+                if time.monotonic() > deadline:
+                    self.close()
+                    raise PandocServerError("pandoc server did not start in time.")
+                time.sleep(0.05)
+
+    def convert_docx(self, docx: bytes) -> str:
+        """the standalone latex pandoc writes for docx; images are referenced as media/<name>."""
+        if not self.alive:
+            raise PandocServerError("pandoc server is not running.")
+        payload = {
+            "from": "docx",
+            "to": "latex",
+            "text": base64.b64encode(docx).decode("ascii"),  # binary input formats go base64
+            "standalone": True,
+            "wrap": "none",
+        }
+        request = urllib.request.Request(
+            f"{self._url}/",
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Accept": "application/json"},
+        )
+        self.requests += 1
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout + 5) as response:
+                result = json.loads(response.read())
+        except urllib.error.HTTPError as exc:
+            # the conversion failed, not the server: report pandoc's message.
+            message = exc.read().decode("utf-8", "replace").strip()
+            raise PandocServerError(f"pandoc failed: {message}") from exc
+        except (OSError, ValueError) as exc:
+            self.close()
+            raise PandocServerError(f"pandoc server request failed: {exc}") from exc
+        finally:
+            if self.requests >= self.max_requests:
+                self.close()
+
+        output = result.get("output", "")
+        if result.get("base64"):
+            output = base64.b64decode(output).decode("utf-8")
+        return output
+
+    def close(self) -> None:
+        proc, self._proc = self._proc, None
+        if proc is None:
+            return
+        if proc.poll() is None:
+            proc.terminate()
+            try:
+                proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        proc.wait()
+
+
+class PandocServerPool:
+    """
+    a fixed set of warm pandoc servers, checked out one conversion at a time.
+    servers that died or were recycled are restarted when next checked out; if
+    none can be started the pool backs off and callers use the cli.
+    """
+
+    def __init__(
+        self,
+        size: int = 1,
+        *,
+        pandoc_cmd: str = "pandoc",
+        timeout: float = 120.0,
+        startup_timeout: float = 30.0,
+        max_requests: int = 200,
+        max_memory_mb: Optional[int] = None,
+        retry_after: float = 300.0,
+    ):
+        self.size = size
+        self.retry_after = retry_after
+        self._idle: "queue.Queue[PandocServer]" = queue.Queue()
+        for _ in range(size):
+            self._idle.put(PandocServer(
+                pandoc_cmd=pandoc_cmd,
+                timeout=timeout,
+                startup_timeout=startup_timeout,
+                max_requests=max_requests,
+                max_memory_mb=max_memory_mb,
+            ))
+        self._unavailable_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return self.size > 0 and time.monotonic() >= self._unavailable_until
+
+    def convert_docx(self, docx: bytes) -> str:
+        if not self.available:
+            raise PandocServerError("pandoc server pool is unavailable.")
+
+        server = self._idle.get()
+        try:
+            if not server.alive:
+                server.start()
+            return server.convert_docx(docx)
+        except PandocServerError:
+            if not server.alive and server.requests == 0:
+                # could not be started: stop trying for a while.
+                self._unavailable_until = time.monotonic() + self.retry_after
+            raise
+        finally:
+            self._idle.put(server)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_POOLS: Dict[tuple, PandocServerPool] = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def get_pandoc_pool(pandoc_cmd: str = "pandoc", *, max_memory_mb: Optional[int] = None) -> Optional[PandocServerPool]:
+    """
+    process-wide pool of pandoc servers, one per heap limit.
+    MSURJ_PANDOC_SERVERS sets the pool size; 0 turns the servers off.
+    """
+    size = int(os.environ.get("MSURJ_PANDOC_SERVERS", "1"))
+    if size <= 0:
+        return None
+
+    key = (pandoc_cmd, max_memory_mb)
+    with _POOLS_LOCK:
+        pool = _POOLS.get(key)
+        if pool is None:
+            pool = PandocServerPool(size, pandoc_cmd=pandoc_cmd, max_memory_mb=max_memory_mb)
+            _POOLS[key] = pool
+        return pool
+
+
+@atexit.register
+def _close_pools() -> None:
+    with _POOLS_LOCK:
+        for pool in _POOLS.values():
+            pool.close()
+        _POOLS.clear()
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from processing.anystyle_pool import get_anystyle_pool
+from processing.cache import sha256_file
+from processing.figure_index import FigureIndex
+from processing.figure_optimize import FigureCache, figure_widths, optimize_figures
+from processing.get_msurj_conversion import convert_body, render_msurj
+from processing.metrics import stage
+from processing.pandoc_ast import convert_ast
+from processing.pandoc_intermediate import create_tex_ir, ir_file_name
+from processing.pipeline_cache import PipelineCache
+from processing.preview import Preview, PreviewCache, build_preview
+from processing.reference_cache import get_reference_cache
+from processing.template_bundle import get_template_bundle
+from processing.zip_stream import EntrySource, iter_tree_entries, stream_zip
+
+
+@dataclass
+class PipelineResult:
+    paper_num: str
+    final_tex: str
+    bibtex: Optional[str]
+    figures_dir: Path
+    # seconds per stage (see processing.metrics.stage) and bytes per artifact,
+    # measured in the worker and reported by whoever receives the result.
+    timings: Dict[str, float] = field(default_factory=dict)
+    sizes: Dict[str, int] = field(default_factory=dict)
+    # "hit" and "miss" counts of this job's reference cache lookups; the cache's
+    # own counters are per worker process, so only the result carries them out.
+    reference_cache: Dict[str, int] = field(default_factory=dict)
+    # problems worth an editor's look that did not stop the conversion.
+    warnings: List[str] = field(default_factory=list)
+    # a local compile of final_tex, when run_pipeline was asked for one.
+    preview: Optional[Preview] = None
+
+
+def iter_output_entries(result: PipelineResult, template_dir) -> Iterator[Tuple[str, EntrySource]]:
+    """the entries of the overleaf folder create_output_directory would write, as zip entries."""
+    paper_num = result.paper_num
+    yield f"{paper_num}/{paper_num}.tex", result.final_tex
+    yield from get_template_bundle(template_dir).iter_entries(paper_num)
+    yield f"{paper_num}/Figures/", None
+    yield from iter_tree_entries(result.figures_dir, f"{paper_num}/Figures")
+    if result.bibtex:
+        yield f"{paper_num}/bib.bib", result.bibtex
+    if result.preview is not None:
+        if result.preview.pdf is not None:
+            yield f"{paper_num}/preview.pdf", result.preview.pdf
+        yield f"{paper_num}/preview-errors.txt", result.preview.report()
+
+
+def write_output_zip(result: PipelineResult, template_dir, zip_path) -> Path:
+    zip_path = Path(zip_path)
+    with open(zip_path, "wb") as fh:
+        for chunk in stream_zip(iter_output_entries(result, template_dir)):
+            fh.write(chunk)
+    return zip_path
+
+
+def run_pipeline(
+    docx_path,
+    metadata,
+    *,
+    work_dir,
+    anystyle_cmd="anystyle",
+    cache: Optional[PipelineCache] = None,
+    ir_backend="pandoc",
+    figure_dpi: Optional[int] = None,
+    memory_budget_mb: Optional[int] = None,
+    preview_template_dir=None,
+) -> PipelineResult:
+    """
+    run pandoc and the msurj conversion for one manuscript.
+    pandoc output is written below work_dir so parallel runs never share paths;
+    the converted tex and bib stay in memory for iter_output_entries.
+    with a cache, pandoc is skipped for a docx seen before and the body
+    conversion is skipped for an ir seen before.
+    ir_backend: "pandoc", "pandoc-server", "native", "auto" or "pandoc-ast", see
+    create_tex_ir; "pandoc-ast" converts pandoc's json ast with processing.pandoc_ast.
+    figure_dpi: resample png/jpeg figures to this dpi at their printed width
+    (needs pillow); figures are written below work_dir, never into the cache.
+    memory_budget_mb: caps pandoc's heap and the figures decoded at once, so a
+    thesis with hundreds of photos runs in bounded memory.
+    preview_template_dir: also compile the paper against this template with
+    xelatex (see processing.preview); tex errors become warnings.
+    """
+    docx_path = Path(docx_path)
+    work_dir = Path(work_dir)
+    ir_tex_dir = work_dir / "ir_tex"
+    paper_num = docx_path.stem
+    timings = {}
+    sizes = {"docx": docx_path.stat().st_size}
+
+    with stage("ir", timings):
+        cached_ir = None
+        if cache is not None:
+            ir_key = cache.ir_key(sha256_file(docx_path), backend=ir_backend)
+            cached_ir = cache.get_ir(ir_key, ir_tex_dir / paper_num)
+
+        if cached_ir is None:
+            ir_output_dir = create_tex_ir(
+                docx_path,
+                ir_tex_dir=ir_tex_dir,
+                backend=ir_backend,
+                max_memory_mb=memory_budget_mb,
+            )
+            pandoc_tex_path = ir_output_dir / ir_file_name(paper_num, ir_backend)
+            figures_dir = ir_output_dir / "Figures"
+            if cache is not None:
+                cache.put_ir(ir_key, pandoc_tex_path, figures_dir)
+        else:
+            pandoc_tex_path, figures_dir = cached_ir
+
+        ir_text = pandoc_tex_path.read_text()
+        figure_index = FigureIndex.build(figures_dir)
+    sizes["ir_tex"] = len(ir_text.encode("utf-8"))
+
+    with stage("convert", timings):
+        converted = None
+        if cache is not None:
+            body_key = cache.body_key(
+                ir_text, enable_citations=True, figures=figure_index.fingerprint()
+            )
+            converted = cache.get_body(body_key)
+
+        reference_lookups = {}
+        if converted is None:
+            reference_cache = get_reference_cache()
+            before = reference_cache.stats() if reference_cache is not None else None
+            convert = convert_ast if ir_backend == "pandoc-ast" else convert_body
+            converted = convert(
+                ir_text,
+                enable_citations=True,
+                anystyle_cmd=anystyle_cmd,
+                anystyle_pool=get_anystyle_pool(anystyle_cmd),
+                reference_cache=reference_cache,
+                timings=timings,
+                figure_index=figure_index,
+                chunk_cache=cache,
+            )
+            if reference_cache is not None:
+                after = reference_cache.stats()
+                reference_lookups = {
+                    "hit": after["hits"] - before["hits"],
+                    "miss": after["misses"] - before["misses"],
+                }
+            if cache is not None:
+                cache.put_body(body_key, converted)
+    if converted.bibtex:
+        sizes["bib"] = len(converted.bibtex.encode("utf-8"))
+
+    if figure_dpi:
+        with stage("figures", timings):
+            figures_dir = optimize_figures(
+                figures_dir,
+                work_dir / "Figures",
+                widths=figure_widths(f"{converted.abstract_text}\n{converted.body_text}"),
+                dpi=figure_dpi,
+                cache=FigureCache(cache.root / "figures") if cache is not None else None,
+                max_memory_mb=memory_budget_mb,
+            )
+
+    with stage("render", timings):
+        final_tex = render_msurj(converted, metadata)
+
+    warnings = converted.citations.messages() if converted.citations is not None else []
+    preview = None
+    if preview_template_dir is not None:
+        with stage("preview", timings):
+            preview = build_preview(
+                final_tex,
+                converted.bibtex,
+                figures_dir,
+                template_dir=preview_template_dir,
+                output_dir=work_dir / "preview",
+                cache=PreviewCache(cache.root / "preview") if cache is not None else None,
+            )
+        if preview.pdf is not None:
+            sizes["preview_pdf"] = preview.pdf.stat().st_size
+        warnings += [f"latex {m}" for m in preview.errors]
+
+    return PipelineResult(
+        paper_num=paper_num,
+        final_tex=final_tex,
+        bibtex=converted.bibtex,
+        figures_dir=figures_dir,
+        timings=timings,
+        sizes=sizes,
+        reference_cache=reference_lookups,
+        warnings=warnings,
+        preview=preview,
+    )
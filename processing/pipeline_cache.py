@@ -0,0 +1,168 @@
+from __future__ import annotations
+
+from dataclasses import asdict
+import json
+import os
+from pathlib import Path
+import shutil
+import tempfile
+from typing import Optional, Tuple
+
+from processing.cache import default_cache_root, sha256_hex, write_atomic
+from processing.citations import CitationDiagnostics
+from processing.get_msurj_conversion import CONVERTER_VERSION, ConvertedBody
+
+
+def _link_or_copy(src, dst) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class PipelineCache:
+    """
+    two cache layers for the conversion pipeline:
+      ir/<ir key>/           intermediate latex (ir.tex; pandoc's json ast for the
+                             pandoc-ast backend) and its extracted Figures/,
+                             keyed by docx hash and ir backend
+      body/<key>.json        ConvertedBody for an ir hash + converter version + options
+      chunk/<key>.tex        one rewritten section of a body, so a revised manuscript
+                             only rewrites the sections that changed
+    a hit on both leaves only the header render and the zip for a metadata change.
+    """
+
+    def __init__(
+        self,
+        root=None,
+        *,
+        max_ir_entries: int = 200,
+        max_body_entries: int = 1000,
+        max_chunk_entries: int = 20000,
+    ):
+        self.root = Path(root) if root is not None else default_cache_root() / "pipeline"
+        self.max_ir_entries = max_ir_entries
+        self.max_body_entries = max_body_entries
+        self.max_chunk_entries = max_chunk_entries
+        self._chunks_evicted = False
+
+    @property
+    def ir_root(self) -> Path:
+        return self.root / "ir"
+
+    @property
+    def body_root(self) -> Path:
+        return self.root / "body"
+
+    @property
+    def chunk_root(self) -> Path:
+        return self.root / "chunk"
+
+    @staticmethod
+    def ir_key(docx_hash: str, *, backend: str) -> str:
+        return f"{docx_hash}-{backend}"
+
+    def get_ir(self, ir_key: str, dest_dir) -> Optional[Tuple[Path, Path]]:
+        """
+        hardlink (or copy) the cached ir.tex and Figures/ into dest_dir, so the
+        job keeps its files if the entry is evicted while it still runs.
+        """
+        entry = self.ir_root / ir_key
+        if not (entry / "ir.tex").exists():
+            return None
+        dest_dir = Path(dest_dir)
+        try:
+            os.utime(entry)
+            shutil.copytree(entry, dest_dir, copy_function=_link_or_copy, dirs_exist_ok=True)
+        except OSError:
+            # evicted by another worker while being linked: a miss.
+            shutil.rmtree(dest_dir, ignore_errors=True)
+            return None
+        return dest_dir / "ir.tex", dest_dir / "Figures"
+
+    def put_ir(self, ir_key: str, tex_path, figures_dir) -> Tuple[Path, Path]:
+        entry = self.ir_root / ir_key
+        self.ir_root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.ir_root))
+        try:
+            shutil.copy2(tex_path, staging / "ir.tex")
+            figures_dir = Path(figures_dir)
+            if figures_dir.exists():
+                shutil.copytree(figures_dir, staging / "Figures")
+            else:
+                (staging / "Figures").mkdir()
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                # another worker stored the same docx first; keep theirs.
+                shutil.rmtree(staging, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        self._evict(self.ir_root, self.max_ir_entries)
+        return entry / "ir.tex", entry / "Figures"
+
+    @staticmethod
+    def body_key(ir_text: str, *, enable_citations: bool, figures: str = "") -> str:
+        """figures: FigureIndex fingerprint, since figure layout depends on image sizes."""
+        return sha256_hex(
+            f"{CONVERTER_VERSION}\0{int(enable_citations)}\0{sha256_hex(ir_text)}\0{figures}"
+        )
+
+    def get_body(self, key: str) -> Optional[ConvertedBody]:
+        path = self.body_root / f"{key}.json"
+        try:
+            data = json.loads(path.read_text())
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if data.get("citations") is not None:
+            data["citations"] = CitationDiagnostics(**data["citations"])
+        return ConvertedBody(**data)
+
+    def put_body(self, key: str, converted: ConvertedBody) -> None:
+        write_atomic(self.body_root / f"{key}.json", json.dumps(asdict(converted)))
+        self._evict(self.body_root, self.max_body_entries)
+
+    @staticmethod
+    def chunk_key(options_fingerprint: str, chunk: str) -> str:
+        return sha256_hex(f"{CONVERTER_VERSION}\0{options_fingerprint}\0{chunk}")
+
+    def get_chunk(self, key: str) -> Optional[str]:
+        path = self.chunk_root / f"{key}.tex"
+        try:
+            text = path.read_text()
+            os.utime(path)
+        except OSError:
+            return None
+        return text
+
+    def put_chunk(self, key: str, text: str) -> None:
+        write_atomic(self.chunk_root / f"{key}.tex", text)
+        # chunks are written a section at a time; trim the layer once per cache object
+        # (one conversion in the web app) rather than rescanning it on every write.
+        if not self._chunks_evicted:
+            self._chunks_evicted = True
+            self._evict(self.chunk_root, self.max_chunk_entries)
+
+    @staticmethod
+    def _evict(root: Path, max_entries: int) -> None:
+        entries = []
+        for path in root.iterdir():
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        if len(entries) <= max_entries:
+            return
+        entries.sort()
+        for _, path in entries[: len(entries) - max_entries]:
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    path.unlink()
+                except OSError:
+                    pass
@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+import re
+from typing import Dict, List, Optional
+import xml.etree.ElementTree as ET
+import zipfile
+
+from processing.citations import CitationDiagnostics, CitationIndex
+from processing.docx_reader import A_NS, R_NS, W_NS, DocxReader
+
+
+# reference paragraphs numbered by hand rather than as a word list: "1.", "[1]", "(1)".
+_MANUAL_NUMBER_RE = re.compile(r"\s*(?:\[\d+\]|\(\d+\)|\d+[.)])\s")
+_P = f"{{{W_NS}}}p"
+_R = f"{{{W_NS}}}r"
+_T = f"{{{W_NS}}}t"
+_BLIP = f"{{{A_NS}}}blip"
+_EMBED = f"{{{R_NS}}}embed"
+
+
+@dataclass(frozen=True)
+class Problem:
+    code: str
+    message: str
+    # fatal problems would fail the conversion; the rest are worth a look.
+    fatal: bool = True
+
+
+@dataclass
+class PreflightReport:
+    problems: List[Problem] = field(default_factory=list)
+    references: int = 0
+    images: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return not any(p.fatal for p in self.problems)
+
+    @property
+    def errors(self) -> List[Problem]:
+        return [p for p in self.problems if p.fatal]
+
+    @property
+    def warnings(self) -> List[Problem]:
+        return [p for p in self.problems if not p.fatal]
+
+    def to_dict(self) -> dict:
+        return {
+            "ok": self.ok,
+            "problems": [asdict(p) for p in self.problems],
+            "references": self.references,
+            "images": self.images,
+        }
+
+
+class _Scan:
+    """what preflight needs from one pass over word/document.xml."""
+
+    def __init__(self, reader: DocxReader):
+        self.reader = reader
+        self.abstract = False
+        self.references = False
+        self.abstract_style = False
+        self.numbered_refs = 0
+        self.manual_refs = 0
+        self.plain_refs = 0
+        self.cited: Dict[int, None] = {}
+        self.images = 0
+        self.linked_images: List[int] = []
+        self.missing_images: List[str] = []
+        self._citations = CitationIndex({})
+
+    def paragraph(self, p: ET.Element) -> None:
+        style, heading_level, num_id, _ = self.reader.paragraph_style(p)
+        text = "".join(t.text or "" for t in p.iter(_T))
+        for blip in p.iter(_BLIP):
+            self._image(blip.get(_EMBED))
+
+        if heading_level == 1:
+            title = " ".join(text.split()).rstrip(":.").casefold()
+            if title == "abstract":
+                self.abstract = True
+            elif title == "references":
+                self.references = True
+            return
+        if style == "abstract":
+            self.abstract_style = True
+
+        if self.references:
+            if not text.strip():
+                return
+            if num_id:
+                self.numbered_refs += 1
+            elif _MANUAL_NUMBER_RE.match(text):
+                self.manual_refs += 1
+            else:
+                self.plain_refs += 1
+            return
+
+        # adjacent superscript runs read as one \textsuperscript, as pandoc merges them.
+        superscript = ""
+        for run in p.iter(_R):
+            if "superscript" in self.reader.run_formats(run):
+                superscript += "".join(t.text or "" for t in run.iter(_T))
+                continue
+            self._cite(superscript)
+            superscript = ""
+        self._cite(superscript)
+
+    def _cite(self, content: str) -> None:
+        if content:
+            self.cited.update(dict.fromkeys(self._citations.numbers(content)))
+
+    def _image(self, rel_id: Optional[str]) -> None:
+        self.images += 1
+        member = self.reader.image_member(rel_id)
+        if member is None:
+            self.linked_images.append(self.images)
+        elif not self.reader.has_member(member):
+            self.missing_images.append(f"image {self.images} ({member})")
+
+
+def preflight_docx(docx_path, *, ir_backend: str = "pandoc") -> PreflightReport:
+    """
+    check a manuscript for what the conversion needs (Abstract and References
+    headings, a reference list, citations within it, embedded images) by
+    streaming word/document.xml, without running pandoc or anystyle.
+    linked images only fail the native reader; pandoc leaves them out.
+    """
+    report = PreflightReport()
+    try:
+        reader = DocxReader(docx_path)
+    except (zipfile.BadZipFile, ET.ParseError, KeyError, OSError):
+        report.problems.append(Problem("not_docx", "the file is not a readable Word (.docx) document."))
+        return report
+
+    with reader:
+        if not reader.has_member("word/document.xml"):
+            report.problems.append(Problem("not_docx", "the file is not a readable Word (.docx) document."))
+            return report
+        scan = _Scan(reader)
+        try:
+            with reader.open_document() as fh:
+                for _, el in ET.iterparse(fh):
+                    if el.tag == _P:
+                        scan.paragraph(el)
+                        el.clear()
+        except (ET.ParseError, zipfile.BadZipFile):
+            report.problems.append(Problem("not_docx", "word/document.xml is damaged."))
+            return report
+
+    references = scan.numbered_refs or scan.manual_refs or scan.plain_refs
+    report.references = references
+    report.images = scan.images
+    problems = report.problems
+
+    if not scan.abstract:
+        hint = " the abstract uses Word's Abstract style; give it a Heading 1 named Abstract." if scan.abstract_style else ""
+        problems.append(Problem("no_abstract", f"no Abstract heading (Heading 1) was found.{hint}"))
+    if not scan.references:
+        problems.append(Problem("no_references", "no References heading (Heading 1) was found."))
+    elif not references:
+        problems.append(Problem("empty_references", "the References section is empty."))
+    elif not scan.numbered_refs and not scan.manual_refs:
+        problems.append(Problem(
+            "unnumbered_references",
+            "the references are not a numbered list, so citations are matched to them in order.",
+            fatal=False,
+        ))
+
+    if references:
+        unmatched = sorted(n for n in scan.cited if n > references)
+        if unmatched:
+            message = CitationDiagnostics(unmatched=unmatched, unused=[]).messages()[0]
+            problems.append(Problem(
+                "citation_out_of_range",
+                f"{message[:-1]} (the list has {references} references).",
+                fatal=False,
+            ))
+    for image in scan.linked_images:
+        problems.append(Problem(
+            "linked_image",
+            f"image {image} is linked, not embedded, so it will not be in the Figures folder.",
+            fatal=ir_backend == "native",
+        ))
+    for image in scan.missing_images:
+        problems.append(Problem("missing_image", f"{image} is missing from the file and cannot be put in the Figures folder."))
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    failed = 0
+    for docx in sys.argv[1:]:
+        report = preflight_docx(docx)
+        failed += not report.ok
+        status = "ok" if report.ok else "FAILED"
+        print(f"{docx}: {status} ({report.references} references, {report.images} images)")
+        for problem in report.problems:
+            print(f"  {'error' if problem.fatal else 'warning'}: {problem.message}")
+    sys.exit(1 if failed else 0)
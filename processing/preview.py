@@ -0,0 +1,492 @@
+from __future__ import annotations
+
+import atexit
+from dataclasses import asdict, dataclass, field
+import json
+import os
+from pathlib import Path
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from processing.cache import default_cache_root, sha256_file, sha256_hex, write_atomic
+
+
+TEX_ENGINE = "xelatex"
+BIBER = "biber"
+# bump whenever the preview build changes so cached previews are not reused.
+PREVIEW_VERSION = "1"
+FORMAT_NAME = "msurj-preview"
+JOBNAME = "preview"
+COMPILE_TIMEOUT = 180.0
+# fontspec fonts are native xetex fonts, which a format cannot hold: the class
+# is dumped up to this line and the rest is replayed before every paper.
+FONTSPEC_LINE = r"\RequirePackage{fontspec}"
+# the packages render_msurj loads after the class.
+PAPER_PREAMBLE = "\\documentclass{msurj}\n\\usepackage{multirow}\n"
+
+_LINE_RE = re.compile(r"l\.(\d+)")
+_WARNING_RE = re.compile(r"(?:LaTeX|(?:Package|Class) (\S+)) Warning: (.*)")
+_INPUT_LINE_RE = re.compile(r"on input line (\d+)\.?")
+# a preview runs a fixed number of passes, so requests for another one are noise.
+_IGNORED_WARNINGS = ("Please (re)run", "Please rerun", "Label(s) may have changed", "There were undefined")
+
+
+@dataclass(frozen=True)
+class LatexMessage:
+    level: str  # "error" or "warning"
+    message: str
+    line: Optional[int] = None  # in <paper>.tex
+
+    def __str__(self) -> str:
+        return f"line {self.line}: {self.message}" if self.line else self.message
+
+
+@dataclass
+class Preview:
+    pdf: Optional[Path]
+    messages: List[LatexMessage] = field(default_factory=list)
+
+    @property
+    def errors(self) -> List[LatexMessage]:
+        return [m for m in self.messages if m.level == "error"]
+
+    @property
+    def ok(self) -> bool:
+        return self.pdf is not None and not self.errors
+
+    def report(self) -> str:
+        if not self.messages:
+            return "compiled with no errors or warnings.\n"
+        return "".join(f"{m.level}: {m}\n" for m in self.messages)
+
+    def write_to(self, output_dir) -> None:
+        output_dir = Path(output_dir)
+        if self.pdf is not None:
+            shutil.copy2(self.pdf, output_dir / "preview.pdf")
+        (output_dir / "preview-errors.txt").write_text(self.report())
+
+
+def parse_latex_log(log: str, *, body_name: str = "body.tex", line_offset: int = 0) -> List[LatexMessage]:
+    """
+    errors and warnings of a tex log, in order. line numbers from the paper's
+    body are shifted by line_offset, the lines of <paper>.tex before it.
+    """
+    lines = log.splitlines()
+    body_opened = False
+    messages: List[LatexMessage] = []
+
+    def paper_line(number: str) -> Optional[int]:
+        return int(number) + line_offset if body_opened else None
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if not body_opened and body_name in line:
+            body_opened = True
+        if line.startswith("! "):
+            number = None
+            for follow in lines[i + 1 : i + 12]:
+                match = _LINE_RE.match(follow)
+                if match:
+                    number = paper_line(match.group(1))
+                    break
+            messages.append(LatexMessage("error", line[2:].strip(), number))
+            i += 1
+            continue
+
+        match = _WARNING_RE.match(line)
+        if match is None:
+            i += 1
+            continue
+        package, text = match.groups()
+        i += 1
+        # package warnings continue on lines marked (package); latex ones until a blank line.
+        while i < len(lines) and lines[i].strip():
+            follow = lines[i]
+            if package and not follow.startswith(f"({package})"):
+                break
+            text += " " + follow.split(")", 1)[1].strip() if package else " " + follow.strip()
+            i += 1
+        if text.startswith(_IGNORED_WARNINGS):
+            continue
+        found = _INPUT_LINE_RE.search(text)
+        number = paper_line(found.group(1)) if found else None
+        text = _INPUT_LINE_RE.sub("", text).strip()
+        messages.append(LatexMessage("warning", f"{package}: {text}" if package else text, number))
+    return messages
+
+
+def split_class(cls_text: str) -> Tuple[str, str]:
+    """the class up to fontspec, which a format can hold, and the font setup after it, which it cannot."""
+    index = cls_text.find(FONTSPEC_LINE)
+    if index == -1:
+        return cls_text, ""
+    return cls_text[:index], cls_text[index:]
+
+
+def _driver(*, use_format: bool, warm: bool) -> str:
+    """the file tex is run on; body.tex holds the paper from \\begin{document} on."""
+    if not use_format:
+        return PAPER_PREAMBLE + "\\input{body}\n"
+    lines = [
+        PAPER_PREAMBLE + "\\endofdump",  # skipped: the format already holds it
+        "\\makeatletter\\input{msurj-preview-fonts}\\makeatother",
+    ]
+    if warm:
+        # wait here, fonts loaded, until the name of the body arrives on stdin.
+        lines.append("{\\endlinechar=-1 \\global\\read-1 to \\msurjpreviewbody}")
+        lines.append("\\input{\\msurjpreviewbody}")
+    else:
+        lines.append("\\input{body}")
+    return "\n".join(lines) + "\n"
+
+
+class _TexRun:
+    """a scratch dir set up for one paper, and the tex process typesetting it."""
+
+    def __init__(self, root: Path, template_dir: Path, format_dir: Optional[Path], env: dict):
+        root.mkdir(parents=True, exist_ok=True)
+        self.dir = Path(tempfile.mkdtemp(prefix="tex-", dir=root))
+        self.format_dir = format_dir
+        self.env = env
+        self.proc: Optional[subprocess.Popen] = None
+        (self.dir / "Fonts").symlink_to(template_dir / "Fonts", target_is_directory=True)
+        if format_dir is not None:
+            (self.dir / "msurj-preview-fonts.tex").symlink_to(format_dir / "msurj-preview-fonts.tex")
+
+    def command(self, driver: str, interaction: str) -> List[str]:
+        # tex reads everything after the file name as input, so options come first.
+        cmd = [TEX_ENGINE, f"-jobname={JOBNAME}", f"-interaction={interaction}", "-no-file-line-error"]
+        if self.format_dir is not None:
+            cmd.append(f"-fmt={FORMAT_NAME}")
+        return cmd + [driver]
+
+    def start_warm(self) -> None:
+        """start tex now so the format and fonts are loaded before a paper arrives."""
+        (self.dir / "warm.tex").write_text(_driver(use_format=True, warm=True))
+        self.proc = subprocess.Popen(
+            # scrollmode: errors do not stop, but tex still reads the terminal.
+            self.command("warm.tex", "scrollmode"),
+            cwd=self.dir,
+            env=self.env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    @property
+    def warm(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def stage(self, body: str, bibtex: Optional[str], figures_dir: Optional[Path]) -> None:
+        (self.dir / "body.tex").write_text(body)
+        if bibtex:
+            (self.dir / "bib.bib").write_text(bibtex)
+        if figures_dir is not None and Path(figures_dir).exists():
+            (self.dir / "Figures").symlink_to(Path(figures_dir).resolve(), target_is_directory=True)
+
+    def typeset(self, *, timeout: float) -> bool:
+        """one pass over body.tex, on the warm process if there is one; false on timeout."""
+        if self.warm:
+            proc, self.proc = self.proc, None
+            try:
+                proc.stdin.write(b"body.tex\n")
+                proc.stdin.close()
+                proc.wait(timeout=timeout)
+                return True
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+                return False
+            except OSError:
+                proc.kill()
+                proc.wait()  # died while waiting; typeset cold below
+        driver = "cold.tex"
+        (self.dir / driver).write_text(_driver(use_format=self.format_dir is not None, warm=False))
+        return self._run(self.command(driver, "nonstopmode"), timeout=timeout)
+
+    def biber(self, *, timeout: float) -> bool:
+        return self._run([BIBER, "--quiet", JOBNAME], timeout=timeout)
+
+    def _run(self, cmd: List[str], *, timeout: float) -> bool:
+        try:
+            subprocess.run(
+                cmd,
+                cwd=self.dir,
+                env=self.env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=timeout,
+            )
+        except subprocess.TimeoutExpired:
+            return False
+        return True
+
+    def close(self) -> None:
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class PreviewCompiler:
+    """
+    compiles converted papers against one template dir. the class preamble is
+    dumped once into a format, and one tex process is kept started on it with
+    the fonts loaded, so a preview only pays for typesetting the paper.
+    """
+
+    def __init__(self, template_dir, *, root=None, timeout: float = COMPILE_TIMEOUT):
+        self.template_dir = Path(template_dir).resolve()
+        self.root = Path(root) if root is not None else default_cache_root() / "tex"
+        self.timeout = timeout
+        self._format_dir: Optional[Path] = None
+        self._format_failed = False
+        self._next: Optional[_TexRun] = None
+        self._lock = threading.Lock()
+
+    @property
+    def available(self) -> bool:
+        return shutil.which(TEX_ENGINE) is not None
+
+    def _env(self, format_dir: Optional[Path]) -> dict:
+        env = dict(os.environ)
+        # trailing separators keep the tex distribution's own search paths.
+        env["TEXINPUTS"] = f"{self.template_dir}{os.pathsep}"
+        if format_dir is not None:
+            env["TEXFORMATS"] = f"{format_dir}{os.pathsep}"
+        env["max_print_line"] = "100000"  # one log line per message
+        return env
+
+    def format_dir(self) -> Optional[Path]:
+        """the dumped format for the current msurj.cls, built on first use; None if tex cannot dump it."""
+        if self._format_failed:
+            return None
+        cls_text = (self.template_dir / "msurj.cls").read_text()
+        fmt_dir = self.root / f"format-{sha256_hex(PREVIEW_VERSION + cls_text)[:16]}"
+        if (fmt_dir / f"{FORMAT_NAME}.fmt").exists():
+            self._format_dir = fmt_dir
+            return fmt_dir
+
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=".tmp-format-", dir=self.root))
+        head, fonts = split_class(cls_text)
+        (staging / "msurj.cls").write_text(head)
+        (staging / "msurj-preview-fonts.tex").write_text(fonts)
+        (staging / f"{FORMAT_NAME}.tex").write_text(PAPER_PREAMBLE + "\\begin{document}\n\\end{document}\n")
+        try:
+            subprocess.run(
+                [
+                    TEX_ENGINE, "-ini", "-interaction=nonstopmode", "-halt-on-error",
+                    f"-jobname={FORMAT_NAME}", f"&{TEX_ENGINE}", "mylatexformat.ltx", f"{FORMAT_NAME}.tex",
+                ],
+                cwd=staging,
+                env=self._env(None),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=self.timeout,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        if not (staging / f"{FORMAT_NAME}.fmt").exists():
+            # e.g. mylatexformat is not installed: papers compile from the class instead.
+            shutil.rmtree(staging, ignore_errors=True)
+            self._format_failed = True
+            return None
+        try:
+            staging.rename(fmt_dir)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)  # another process dumped it first
+        self._format_dir = fmt_dir
+        return fmt_dir
+
+    def _new_run(self, format_dir: Optional[Path]) -> _TexRun:
+        return _TexRun(
+            Path(tempfile.gettempdir()) / "msurj-tex", self.template_dir, format_dir, self._env(format_dir)
+        )
+
+    def warm_up(self) -> None:
+        """dump the format and start the next tex process ahead of the first preview."""
+        with self._lock:
+            self._ensure_next()
+
+    def _ensure_next(self) -> Optional[_TexRun]:
+        format_dir = self.format_dir()
+        if format_dir is None:
+            return None
+        if self._next is None or not self._next.warm or self._next.format_dir != format_dir:
+            if self._next is not None:
+                self._next.close()
+            self._next = self._new_run(format_dir)
+            self._next.start_warm()
+        return self._next
+
+    def compile(self, final_tex: str, bibtex: Optional[str], figures_dir, output_dir) -> Preview:
+        """typeset final_tex into output_dir/preview.pdf, with biber and a second pass when there is a bib."""
+        if not self.available:
+            return Preview(None, [LatexMessage("error", f"{TEX_ENGINE} not found on PATH; no preview was compiled.")])
+        start = final_tex.find("\\begin{document}")
+        if start == -1:
+            return Preview(None, [LatexMessage("error", "no \\begin{document} in the converted paper.")])
+        line_offset = final_tex.count("\n", 0, start)
+
+        with self._lock:
+            run = self._ensure_next() or self._new_run(None)
+            self._next = None
+        try:
+            run.stage(final_tex[start:], bibtex, Path(figures_dir) if figures_dir else None)
+            deadline = time.monotonic() + self.timeout
+            finished = run.typeset(timeout=self.timeout)
+            if finished and bibtex and (run.dir / f"{JOBNAME}.bcf").exists():
+                finished = run.biber(timeout=max(1.0, deadline - time.monotonic())) and run.typeset(
+                    timeout=max(1.0, deadline - time.monotonic())
+                )
+
+            output_dir = Path(output_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            log_path = run.dir / f"{JOBNAME}.log"
+            log = log_path.read_text(errors="replace") if log_path.exists() else ""
+            messages = parse_latex_log(log, line_offset=line_offset)
+            if not finished:
+                messages.append(LatexMessage("error", f"compiling took longer than {self.timeout:.0f}s."))
+            pdf = None
+            if (run.dir / f"{JOBNAME}.pdf").exists():
+                pdf = output_dir / "preview.pdf"
+                shutil.move(str(run.dir / f"{JOBNAME}.pdf"), pdf)
+            return Preview(pdf, messages)
+        finally:
+            run.close()
+            with self._lock:
+                try:
+                    self._ensure_next()  # warm the next one while this preview is sent
+                except OSError:
+                    pass
+
+    def close(self) -> None:
+        with self._lock:
+            if self._next is not None:
+                self._next.close()
+                self._next = None
+
+
+class PreviewCache:
+    """compiled previews under <root>/<key>/, keyed by the tex, bib, figures and class."""
+
+    def __init__(self, root=None, *, max_entries: int = 200):
+        self.root = Path(root) if root is not None else default_cache_root() / "preview"
+        self.max_entries = max_entries
+
+    @staticmethod
+    def key(final_tex: str, bibtex: Optional[str], figures_dir, template_dir) -> str:
+        figures = []
+        figures_dir = Path(figures_dir) if figures_dir else None
+        if figures_dir is not None and figures_dir.exists():
+            for path in sorted(figures_dir.rglob("*")):
+                if path.is_file():
+                    figures.append((path.relative_to(figures_dir).as_posix(), sha256_file(path)))
+        return sha256_hex(json.dumps([
+            PREVIEW_VERSION,
+            sha256_hex(final_tex),
+            sha256_hex(bibtex or ""),
+            figures,
+            sha256_file(Path(template_dir) / "msurj.cls"),
+        ]))
+
+    def get(self, key: str, output_dir) -> Optional[Preview]:
+        """the cached preview with its pdf copied to output_dir/preview.pdf, out of evict's reach."""
+        entry = self.root / key
+        output_dir = Path(output_dir)
+        pdf = None
+        try:
+            messages = json.loads((entry / "messages.json").read_text())
+            os.utime(entry)
+            if (entry / "preview.pdf").exists():
+                output_dir.mkdir(parents=True, exist_ok=True)
+                pdf = output_dir / "preview.pdf"
+                shutil.copy2(entry / "preview.pdf", pdf)
+        except (OSError, ValueError):
+            return None  # missing, or evicted while being read
+        return Preview(pdf, [LatexMessage(**m) for m in messages])
+
+    def put(self, key: str, preview: Preview) -> None:
+        entry = self.root / key
+        self.root.mkdir(parents=True, exist_ok=True)
+        staging = Path(tempfile.mkdtemp(prefix=".tmp-", dir=self.root))
+        if preview.pdf is not None:
+            shutil.copy2(preview.pdf, staging / "preview.pdf")
+        write_atomic(staging / "messages.json", json.dumps([asdict(m) for m in preview.messages]))
+        try:
+            staging.rename(entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)  # a concurrent put won
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for path in self.root.iterdir():
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                entries.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+_COMPILERS: Dict[Path, PreviewCompiler] = {}
+_COMPILERS_LOCK = threading.Lock()
+
+
+def get_preview_compiler(template_dir) -> PreviewCompiler:
+    """process-wide compiler per template dir, so its warm tex process outlives one paper."""
+    template_dir = Path(template_dir).resolve()
+    with _COMPILERS_LOCK:
+        compiler = _COMPILERS.get(template_dir)
+        if compiler is None:
+            compiler = PreviewCompiler(template_dir)
+            _COMPILERS[template_dir] = compiler
+        return compiler
+
+
+@atexit.register
+def _close_compilers() -> None:
+    with _COMPILERS_LOCK:
+        for compiler in _COMPILERS.values():
+            compiler.close()
+        _COMPILERS.clear()
+
+
+def build_preview(
+    final_tex: str,
+    bibtex: Optional[str],
+    figures_dir,
+    *,
+    template_dir,
+    output_dir,
+    cache: Optional[PreviewCache] = None,
+) -> Preview:
+    """compile final_tex for a quick look before overleaf, reusing a cached preview of the same inputs."""
+    key = None
+    if cache is not None:
+        key = cache.key(final_tex, bibtex, figures_dir, template_dir)
+        cached = cache.get(key, output_dir)
+        if cached is not None:
+            return cached
+    compiler = get_preview_compiler(template_dir)
+    preview = compiler.compile(final_tex, bibtex, figures_dir, output_dir)
+    # missing tools and timeouts are not a property of the paper, so they are not cached.
+    if key is not None and compiler.available and not any(
+        m.message.startswith("compiling took longer") for m in preview.errors
+    ):
+        cache.put(key, preview)
+    return preview
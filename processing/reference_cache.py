@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import re
+import threading
+import unicodedata
+from typing import Dict, List, Optional, Sequence
+
+from processing.cache import default_cache_root, sha256_hex, write_atomic
+
+
+def normalize_reference(text: str) -> str:
+    text = unicodedata.normalize("NFC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def reference_digest(text: str) -> str:
+    return sha256_hex(normalize_reference(text))
+
+
+class ReferenceCache:
+    """
+    on-disk map from a normalized reference string to its parsed BibTeX entry.
+    entries live at <root>/<2 hex>/<digest>.bib; reads bump the mtime so
+    eviction drops the least recently used files first.
+    """
+
+    def __init__(
+        self,
+        root=None,
+        *,
+        max_entries: int = 20000,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.root = Path(root) if root is not None else default_cache_root() / "references"
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / f"{digest}.bib"
+
+    def get(self, reference: str) -> Optional[str]:
+        path = self._path(reference_digest(reference))
+        try:
+            entry = path.read_text()
+            os.utime(path)
+        except OSError:
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def get_many(self, references: Sequence[str]) -> List[Optional[str]]:
+        return [self.get(ref) for ref in references]
+
+    def put(self, reference: str, entry: str) -> None:
+        write_atomic(self._path(reference_digest(reference)), entry)
+
+    def put_many(self, references: Sequence[str], entries: Sequence[str]) -> None:
+        for reference, entry in zip(references, entries):
+            self.put(reference, entry)
+        self.evict()
+
+    def evict(self) -> int:
+        files = []
+        total = 0
+        for path in self.root.glob("*/*.bib"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        removed = 0
+        if len(files) > self.max_entries or total > self.max_bytes:
+            files.sort()
+            count = len(files)
+            for _, size, path in files:
+                if count <= self.max_entries and total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                count -= 1
+                total -= size
+                removed += 1
+
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_DEFAULT_CACHE: Optional[ReferenceCache] = None
+
+
+def get_reference_cache() -> Optional[ReferenceCache]:
+    """
+    process-wide cache under the default cache root.
+    MSURJ_REFERENCE_CACHE_ENTRIES bounds the entry count; 0 turns caching off.
+    """
+    global _DEFAULT_CACHE
+    max_entries = int(os.environ.get("MSURJ_REFERENCE_CACHE_ENTRIES", "20000"))
+    if max_entries <= 0:
+        return None
+    if _DEFAULT_CACHE is None:
+        _DEFAULT_CACHE = ReferenceCache(max_entries=max_entries)
+    return _DEFAULT_CACHE
@@ -1,76 +1,74 @@
 from __future__ import annotations
 
 import re
-from typing import Tuple
+from typing import List, Optional, Tuple
+
+from processing.latex_scan import (
+    Environment,
+    match_brace,
+    match_bracket,
+    match_environment,
+    outside_environments,
+    scan_environments,
+)
+from processing.table_layout import layout_table
 
 LONGTABLE_BEGIN = r"\begin{longtable}"
 LONGTABLE_END = r"\end{longtable}"
 
 
+CAPTION_RE = re.compile(r"\\caption(?![a-zA-Z@])")
+REPEAT_MARKER_RE = re.compile(r"\\end(firsthead|head|foot|lastfoot)\b")
+TABULARNEWLINE_RE = re.compile(r"\s*\\tabularnewline\s*")
+
+
 def _skip_ws(text: str, idx: int) -> int:
     while idx < len(text) and text[idx].isspace():
         idx += 1
     return idx
 
 
-def _consume_bracket(text: str, idx: int) -> int:
-    if text[idx] != "[":
-        return idx
-    idx += 1
-    while idx < len(text) and text[idx] != "]":
-        idx += 1
-    return idx + 1 if idx < len(text) else idx
-
-
-def _consume_brace(text: str, idx: int) -> Tuple[str, int]:
-    if text[idx] != "{":
-        raise ValueError("Expected '{' while parsing LaTeX block.")
-    depth = 0
-    start = idx
-    for i in range(idx, len(text)):
-        if text[i] == "{":
-            depth += 1
-        elif text[i] == "}":
-            depth -= 1
-            if depth == 0:
-                return text[start + 1 : i], i + 1
-    raise ValueError("Unterminated '{' while parsing LaTeX block.")
-
-
-def _extract_caption(content: str) -> Tuple[str | None, str]:
-    idx = content.find(r"\caption")
-    if idx == -1:
-        return None, content
-
-    brace_start = content.find("{", idx)
-    if brace_start == -1:
-        return None, content
+def _caption_cut(
+    text: str, start: int, stop: int, nested: List[Environment]
+) -> Tuple[str | None, Optional[Tuple[int, int]]]:
+    """the table's own caption and the span to drop for it, with its \\tabularnewline."""
+    match = next(outside_environments(CAPTION_RE.finditer(text, start, stop), nested), None)
+    if match is None:
+        return None, None
 
+    brace_start = text.find("{", match.start(), stop)
+    if brace_start == -1:
+        return None, None
     try:
-        caption, end_idx = _consume_brace(content, brace_start)
+        caption, end_idx = match_brace(text, brace_start)
     except ValueError:
-        return None, content
-
-    remainder = content[end_idx:]
-    remainder = re.sub(r"^\s*\\tabularnewline\s*", "", remainder)
-
-    cleaned = content[:idx] + remainder
-    return caption.strip(), cleaned
-
-
-def _strip_longtable_repeats(content: str) -> str:
-    if r"\endfirsthead" in content:
-        pre, rest = content.split(r"\endfirsthead", 1)
-        if r"\endlastfoot" in rest:
-            _, post = rest.split(r"\endlastfoot", 1)
-        elif r"\endhead" in rest:
-            _, post = rest.split(r"\endhead", 1)
-        else:
-            post = rest
-        content = pre + post
-
-    content = re.sub(r"\\end(firsthead|head|foot|lastfoot)\b", "", content)
-    return content.strip()
+        return None, None
+    if end_idx > stop:
+        return None, None
+
+    newline = TABULARNEWLINE_RE.match(text, end_idx, stop)
+    return caption.strip(), (match.start(), newline.end() if newline else end_idx)
+
+
+def _repeat_cuts(text: str, start: int, stop: int, nested: List[Environment]) -> List[Tuple[int, int]]:
+    """
+    spans of the repeated header between \\endfirsthead and \\endhead (or
+    \\endlastfoot) and of every remaining \\end...head/foot marker.
+    """
+    markers = list(outside_environments(REPEAT_MARKER_RE.finditer(text, start, stop), nested))
+
+    cuts = []
+    firsthead = next((m for m in markers if m.group(1) == "firsthead"), None)
+    if firsthead is not None:
+        later = [m for m in markers if m.start() > firsthead.start()]
+        close = next((m for m in later if m.group(1) == "lastfoot"), None)
+        if close is None:
+            close = next((m for m in later if m.group(1) == "head"), None)
+        repeat_end = close.end() if close is not None else firsthead.end()
+        cuts.append((firsthead.start(), repeat_end))
+        markers = [m for m in markers if not firsthead.start() <= m.start() < repeat_end]
+    cuts.extend((m.start(), m.end()) for m in markers)
+    return cuts
 
 
 def _estimate_columns(colspec: str) -> int:
@@ -90,7 +88,7 @@ def _estimate_columns(colspec: str) -> int:
             i += 1
             if i < len(colspec) and colspec[i] == "{":
                 try:
-                    _, i = _consume_brace(colspec, i)
+                    _, i = match_brace(colspec, i)
                 except ValueError:
                     continue
                 count += 1
@@ -104,9 +102,32 @@ def _estimate_columns(colspec: str) -> int:
     return count
 
 
-def _convert_longtable_block(colspec: str, content: str, *, wide: bool) -> str:
-    caption, content = _extract_caption(content)
-    content = _strip_longtable_repeats(content)
+def _convert_longtable_block(
+    colspec: str, text: str, start: int, stop: int, nested: List[Environment]
+) -> str:
+    """
+    the table+tabularx for the longtable body text[start:stop]. nested are
+    the environments inside it, so markers and captions in them are left alone.
+    """
+    caption, caption_cut = _caption_cut(text, start, stop, nested)
+    cuts = _repeat_cuts(text, start, stop, nested)
+    if caption_cut is not None:
+        cuts.append(caption_cut)
+    cuts.sort()
+
+    pieces = []
+    idx = start
+    for cut_start, cut_end in cuts:
+        pieces.append(text[idx:max(idx, cut_start)])
+        idx = max(idx, cut_end)
+    pieces.append(text[idx:stop])
+    content = "".join(pieces).strip()
+
+    layout = layout_table(colspec, content)
+    if layout is None:
+        wide = _estimate_columns(colspec) >= 5
+    else:
+        colspec, wide = layout.colspec, layout.wide
 
     table_env = "table*" if wide else "table"
     width = r"\textwidth" if wide else r"\columnwidth"
@@ -121,56 +142,76 @@ def _convert_longtable_block(colspec: str, content: str, *, wide: bool) -> str:
     return "\n".join(lines)
 
 
-def convert_longtables_to_tabularx(tex_string: str) -> str:
-    """convert pandoc longtable blocks to table+tabularx while keeping cell content."""
-    out = []
-    idx = 0
+def match_longtable(
+    tex_string: str, start: int, *, env: Optional[Environment] = None
+) -> Tuple[str | None, int, int]:
+    """
+    parse the longtable whose \\begin{longtable} sits at start.
+    returns (colspec, content_start, end): end is just past the matching
+    \\end{longtable}, or -1 when the table is never closed; colspec is None
+    when the header cannot be parsed. env, if the caller already scanned
+    the table, saves finding its \\end again.
+    """
+    j = start + len(LONGTABLE_BEGIN)
+    j = _skip_ws(tex_string, j)
+
+    if j < len(tex_string) and tex_string[j] == "[":
+        j = match_bracket(tex_string, j)
+        j = _skip_ws(tex_string, j)
 
-    while True:
-        start = tex_string.find(LONGTABLE_BEGIN, idx)
-        if start == -1:
-            out.append(tex_string[idx:])
-            break
+    colspec = None
+    if j < len(tex_string) and tex_string[j] == "{":
+        try:
+            colspec, j = match_brace(tex_string, j)
+        except ValueError:
+            colspec = None
 
-        out.append(tex_string[idx:start])
+    if env is None:
+        env = match_environment(tex_string, start)
+    if env is None:
+        return colspec, j, -1
+    if j > env.body_end:
+        return None, env.body_start, env.end
+    return colspec, j, env.end
 
-        j = start + len(LONGTABLE_BEGIN)
-        j = _skip_ws(tex_string, j)
 
-        if j < len(tex_string) and tex_string[j] == "[":
-            j = _consume_bracket(tex_string, j)
-            j = _skip_ws(tex_string, j)
-
-        if j >= len(tex_string) or tex_string[j] != "{":
-            end = tex_string.find(LONGTABLE_END, j)
-            if end == -1:
-                out.append(tex_string[start:])
-                break
-            out.append(tex_string[start : end + len(LONGTABLE_END)])
-            idx = end + len(LONGTABLE_END)
-            continue
+def convert_longtable(colspec: str, content: str) -> str:
+    nested = scan_environments(content) if r"\begin{" in content else []
+    return _convert_longtable_block(colspec, content, 0, len(content), nested)
 
-        try:
-            colspec, j = _consume_brace(tex_string, j)
-        except ValueError:
-            end = tex_string.find(LONGTABLE_END, j)
-            if end == -1:
-                out.append(tex_string[start:])
-                break
-            out.append(tex_string[start : end + len(LONGTABLE_END)])
-            idx = end + len(LONGTABLE_END)
-            continue
 
-        end = tex_string.find(LONGTABLE_END, j)
-        if end == -1:
-            out.append(tex_string[start:])
-            break
+def convert_longtables_to_tabularx(tex_string: str) -> str:
+    """
+    convert pandoc longtable blocks to table+tabularx while keeping cell content.
+    the document is scanned for environments once; tables nested inside a
+    converted one are kept as they are.
+    """
+    if LONGTABLE_BEGIN not in tex_string:
+        return tex_string
 
-        content = tex_string[j:end]
-        wide = _estimate_columns(colspec) >= 5
-        out.append(_convert_longtable_block(colspec, content, wide=wide))
-        idx = end + len(LONGTABLE_END)
+    out = []
+    idx = 0
 
+    environments = scan_environments(tex_string)
+    for i, env in enumerate(environments):
+        if env.name != "longtable" or env.start < idx:
+            continue
+        out.append(tex_string[idx:env.start])
+        colspec, content_start, end = match_longtable(tex_string, env.start, env=env)
+        if colspec is None:
+            out.append(tex_string[env.start:end])
+        else:
+            nested = []
+            for inner in environments[i + 1:]:
+                if inner.start >= env.end:
+                    break
+                nested.append(inner)
+            out.append(_convert_longtable_block(
+                colspec, tex_string, content_start, env.body_end, nested
+            ))
+        idx = end
+
+    out.append(tex_string[idx:])
     return "".join(out)
 
 
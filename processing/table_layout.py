@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from functools import lru_cache
+import re
+from typing import List, Optional, Tuple
+
+from processing.latex_scan import match_brace, outside_environments, scan_environments
+from processing.layout import COLUMN_WIDTH_IN, TEXT_WIDTH_IN
+
+
+# tables are set \small in the 9pt class: 8pt type, about 4pt per average glyph.
+CHAR_WIDTH_IN = 4.0 / 72.27
+PADDING_IN = 2 * 6.0 / 72.27  # \tabcolsep on both sides of each column
+# narrower than this and wrapped text turns into a column of single words.
+MIN_X_WIDTH_IN = 0.8
+# a single long word (a url, a gene name) may break its line rather than widen the table.
+MAX_WORD_IN = 1.5
+
+ALIGN_PREFIX = {
+    "l": r">{\raggedright\arraybackslash}",
+    "c": r">{\centering\arraybackslash}",
+    "r": r">{\raggedleft\arraybackslash}",
+}
+
+_CELL_TOKEN_RE = re.compile(r"\\\\(?:\[[^\]]*\])?|\\tabularnewline(?![a-zA-Z])|\\[&{}%]|[&{}]|%[^\n]*")
+_RULES_RE = re.compile(
+    r"^(?:\s*(?:\\(?:toprule|midrule|bottomrule|hline)(?![a-zA-Z])(?:\\noalign\{\})?"
+    r"|\\(?:cline|cmidrule(?:\([^)]*\))?)\{[^}]*\}))+"
+)
+_MULTICOLUMN_RE = re.compile(r"\s*\\multicolumn\{(\d+)\}")
+_ESCAPED_CHAR_RE = re.compile(r"\\([%&$#_{}])")
+_MARKUP_RE = re.compile(
+    r"\\(?:begin|end)\{[^}]*\}(?:\[[^\]]*\])?(?:\{[^{}]*\})?|\\[a-zA-Z@]+\*?|\\.|[{}$]"
+)
+
+
+@dataclass(frozen=True)
+class TableLayout:
+    colspec: str
+    wide: bool
+
+
+def column_alignments(colspec: str) -> List[str]:
+    """l, c or r for each column of a tabular preamble; [] if it cannot be parsed."""
+    aligns: List[str] = []
+    pending = None
+    i = 0
+    try:
+        while i < len(colspec):
+            ch = colspec[i]
+            if ch in "<>@!" and colspec.startswith("{", i + 1):
+                inside, i = match_brace(colspec, i + 1)
+                if ch == ">":
+                    pending = "c" if r"\centering" in inside else "r" if r"\raggedleft" in inside else "l"
+                continue
+            if ch in "lcr":
+                aligns.append(ch)
+                i += 1
+            elif ch in "pmb" and colspec.startswith("{", i + 1):
+                _, i = match_brace(colspec, i + 1)
+                aligns.append(pending or "l")
+            elif ch == "X":
+                aligns.append(pending or "l")
+                i += 1
+            elif ch == "S":
+                aligns.append("c")
+                i += 1
+            else:
+                i += 1
+                continue
+            pending = None
+    except ValueError:
+        return []
+    return aligns
+
+
+def split_rows(content: str) -> List[List[str]]:
+    """
+    the cells of each row of a tabular body. & and \\\\ inside braces or
+    nested environments (minipage cells, inner tables) do not split; rules
+    are dropped along with rows left empty by them.
+    """
+    tokens = _CELL_TOKEN_RE.finditer(content)
+    if r"\begin{" in content:
+        tokens = outside_environments(tokens, scan_environments(content))
+    rows: List[List[str]] = []
+    cells: List[str] = []
+    cell_start = 0
+    depth = 0
+    for match in tokens:
+        token = match.group()
+        if token == "{":
+            depth += 1
+        elif token == "}":
+            depth = max(0, depth - 1)
+        elif depth or token[0] == "%" or (token[0] == "\\" and token[1] in "&{}%"):
+            continue
+        elif token == "&":
+            cells.append(content[cell_start:match.start()])
+            cell_start = match.end()
+        else:
+            cells.append(content[cell_start:match.start()])
+            rows.append(cells)
+            cells = []
+            cell_start = match.end()
+    cells.append(content[cell_start:])
+    rows.append(cells)
+
+    out = []
+    for row in rows:
+        row[0] = _RULES_RE.sub("", row[0])  # rules only ever open a row
+        row = [cell.strip() for cell in row]
+        if any(row):
+            out.append(row)
+    return out
+
+
+def _measure(cell: str) -> Tuple[int, int]:
+    """(characters, longest word) of the text a cell prints."""
+    if "\\" in cell or "{" in cell or "$" in cell:
+        cell = _MARKUP_RE.sub(" ", _ESCAPED_CHAR_RE.sub(lambda m: m.group(1), cell))
+    words = cell.split()
+    if not words:
+        return 0, 0
+    return len(" ".join(words)), max(map(len, words))
+
+
+def _column_extents(rows: List[List[str]], columns: int) -> Tuple[List[int], List[int]]:
+    """per column, the longest cell and the longest word, in characters."""
+    matrix = []
+    for row in rows:
+        measured = [(0, 0)] * columns
+        j = 0
+        for cell in row:
+            span = _MULTICOLUMN_RE.match(cell)
+            if span is not None:
+                j += int(span.group(1))  # spanning cells do not size any one column
+                continue
+            if j >= columns:
+                break
+            measured[j] = _measure(cell)
+            j += 1
+        matrix.append(measured)
+    # one pass down each column of the cell matrix.
+    natural = [max(length for length, _ in column) for column in zip(*matrix)]
+    words = [max(word for _, word in column) for column in zip(*matrix)]
+    return natural, words
+
+
+def _allocate(natural: List[float], available: float) -> List[Optional[float]]:
+    """
+    widths for columns that fit their longest cell in an even share of the
+    space (kept at that size); None for the ones left to share the rest.
+    """
+    fixed: List[Optional[float]] = [None] * len(natural)
+    while True:
+        flexible = [j for j, width in enumerate(fixed) if width is None]
+        if not flexible:
+            return fixed
+        share = (available - sum(w for w in fixed if w is not None)) / len(flexible)
+        fits = [j for j in flexible if natural[j] <= share]
+        if not fits:
+            return fixed
+        for j in fits:
+            fixed[j] = natural[j]
+
+
+def _share(space: float, natural: List[float], minimum: List[float]) -> List[float]:
+    """split space in proportion to natural, giving no column less than its minimum."""
+    widths: List[Optional[float]] = [None] * len(natural)
+    while True:
+        rest = [j for j, width in enumerate(widths) if width is None]
+        if not rest:
+            return widths
+        room = space - sum(w for w in widths if w is not None)
+        total = sum(natural[j] for j in rest)
+        short = [j for j in rest if natural[j] / total * room < minimum[j]]
+        if not short:
+            for j in rest:
+                widths[j] = natural[j] / total * room
+            return widths
+        for j in short:
+            widths[j] = minimum[j]
+
+
+def _render(aligns, natural, minimum, fixed, available, *, outer: str) -> str:
+    flexible = [j for j, width in enumerate(fixed) if width is None]
+    if not flexible:
+        # everything fits: stretch all columns to the line, widest cells widest.
+        flexible = list(range(len(aligns)))
+        fixed = [None] * len(aligns)
+    left = available - sum(w for w in fixed if w is not None)
+    shares = _share(
+        left,
+        [max(natural[j], CHAR_WIDTH_IN) for j in flexible],
+        [minimum[j] for j in flexible],
+    )
+    # tabularx needs the \hsize factors of the X columns to add up to their count.
+    weights = dict(zip(flexible, (width * len(flexible) / sum(shares) for width in shares)))
+
+    columns = []
+    for j, align in enumerate(aligns):
+        prefix = ALIGN_PREFIX[align]
+        if fixed[j] is not None:
+            columns.append(f"{prefix}p{{{fixed[j] / available:.3f}\\linewidth}}")
+            continue
+        if abs(weights[j] - 1.0) >= 0.01:
+            prefix = prefix[:-1] + rf"\hsize={weights[j]:.2f}\hsize}}"
+        columns.append(f"{prefix}X")
+    return outer + "".join(columns) + outer
+
+
+@lru_cache(maxsize=512)
+def layout_table(colspec: str, content: str) -> Optional[TableLayout]:
+    """
+    a tabularx preamble sized from the cells of content and whether the table
+    needs both columns; None when the table cannot be measured. cached per
+    table, since the same table is laid out again on every reconversion.
+    """
+    aligns = column_alignments(colspec)
+    rows = split_rows(content)
+    if not aligns or not rows:
+        return None
+
+    natural_chars, word_chars = _column_extents(rows, len(aligns))
+    natural = [chars * CHAR_WIDTH_IN for chars in natural_chars]
+    minimum = [min(chars * CHAR_WIDTH_IN, MAX_WORD_IN) for chars in word_chars]
+
+    def fits(width_in: float) -> Tuple[bool, List[Optional[float]], float]:
+        available = width_in - PADDING_IN * len(aligns)
+        fixed = _allocate(natural, available)
+        flexible = [j for j, width in enumerate(fixed) if width is None]
+        left = available - sum(w for w in fixed if w is not None)
+        ok = sum(minimum) <= available and (
+            not flexible or left / len(flexible) >= MIN_X_WIDTH_IN
+        )
+        return ok, fixed, available
+
+    wide = False
+    ok, fixed, available = fits(COLUMN_WIDTH_IN)
+    if not ok:
+        wide = True
+        _, fixed, available = fits(TEXT_WIDTH_IN)
+
+    outer = "@{}" if colspec.lstrip().startswith("@{}") else ""
+    return TableLayout(_render(aligns, natural, minimum, fixed, available, outer=outer), wide)
@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+import threading
+import zlib
+from typing import Dict, Iterator, List, Tuple
+
+from processing.zip_stream import DEFLATED, STORED, PrecompressedMember
+
+
+def _fingerprint(template_dir: Path) -> Tuple[Tuple[str, int, int], ...]:
+    entries = []
+    for path in sorted(template_dir.rglob("*")):
+        st = path.stat()
+        entries.append((path.relative_to(template_dir).as_posix(), st.st_size, st.st_mtime_ns))
+    return tuple(entries)
+
+
+@dataclass
+class TemplateBundle:
+    """
+    msurj.cls and the fonts, compressed once and spliced into every
+    output zip by copying the raw deflate bytes.
+    """
+
+    template_dir: Path
+    members: List[PrecompressedMember]
+    fingerprint: Tuple[Tuple[str, int, int], ...]
+
+    @classmethod
+    def build(cls, template_dir, *, compresslevel: int = 9) -> "TemplateBundle":
+        template_dir = Path(template_dir)
+        fingerprint = _fingerprint(template_dir)
+        members = []
+        for path in sorted(template_dir.rglob("*")):
+            relpath = path.relative_to(template_dir).as_posix()
+            mtime = path.stat().st_mtime
+            if path.is_dir():
+                members.append(PrecompressedMember(relpath, STORED, 0, 0, mtime, None))
+                continue
+            raw = path.read_bytes()
+            compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+            deflated = compressor.compress(raw) + compressor.flush()
+            method, data = (DEFLATED, deflated) if len(deflated) < len(raw) else (STORED, raw)
+            members.append(PrecompressedMember(relpath, method, zlib.crc32(raw), len(raw), mtime, data))
+        return cls(template_dir=template_dir, members=members, fingerprint=fingerprint)
+
+    def iter_entries(self, arcroot: str) -> Iterator[Tuple[str, PrecompressedMember]]:
+        for member in self.members:
+            suffix = "/" if member.is_dir else ""
+            yield f"{arcroot}/{member.relpath}{suffix}", member
+
+
+_BUNDLES: Dict[Path, TemplateBundle] = {}
+_BUNDLES_LOCK = threading.Lock()
+
+
+def get_template_bundle(template_dir) -> TemplateBundle:
+    """cached bundle for template_dir, rebuilt only if a template file changed."""
+    template_dir = Path(template_dir).resolve()
+    fingerprint = _fingerprint(template_dir)
+    with _BUNDLES_LOCK:
+        bundle = _BUNDLES.get(template_dir)
+        if bundle is None or bundle.fingerprint != fingerprint:
+            bundle = TemplateBundle.build(template_dir)
+            _BUNDLES[template_dir] = bundle
+        return bundle
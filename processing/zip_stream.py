@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+import struct
+import time
+import zlib
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
+
+
+LOCAL_HEADER_SIG = 0x04034B50
+DATA_DESCRIPTOR_SIG = 0x08074B50
+CENTRAL_HEADER_SIG = 0x02014B50
+END_OF_CENTRAL_DIR_SIG = 0x06054B50
+
+STORED = 0
+DEFLATED = 8
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+ZIP32_LIMIT = 0xFFFFFFFF
+CHUNK_SIZE = 256 * 1024
+
+
+@dataclass(frozen=True)
+class PrecompressedMember:
+    """a zip member whose payload was compressed ahead of time; None data marks a directory."""
+
+    relpath: str
+    method: int
+    crc: int
+    size: int
+    mtime: float
+    data: Optional[bytes]
+
+    @property
+    def is_dir(self) -> bool:
+        return self.data is None
+
+
+EntrySource = Union[bytes, str, Path, PrecompressedMember, None]
+
+
+def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+    t = time.localtime(timestamp)
+    year = max(t.tm_year, 1980)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+@dataclass
+class _CentralRecord:
+    name: bytes
+    flags: int
+    method: int
+    dos_time: int
+    dos_date: int
+    crc: int
+    compressed_size: int
+    size: int
+    external_attr: int
+    offset: int
+
+
+@dataclass
+class ZipStream:
+    """
+    zip writer that yields bytes as each entry is produced.
+    it never seeks, so the output can go straight into an http response.
+    """
+
+    compresslevel: int = 6
+    _offset: int = field(default=0, init=False)
+    _records: List[_CentralRecord] = field(default_factory=list, init=False)
+
+    def _emit(self, data: bytes) -> bytes:
+        self._offset += len(data)
+        return data
+
+    @staticmethod
+    def _encode_name(arcname: str) -> Tuple[bytes, int]:
+        try:
+            return arcname.encode("ascii"), 0
+        except UnicodeEncodeError:
+            return arcname.encode("utf-8"), FLAG_UTF8
+
+    def _local_header(self, name, flags, method, dos_time, dos_date, crc, csize, size) -> bytes:
+        return struct.pack(
+            "<IHHHHHIIIHH",
+            LOCAL_HEADER_SIG, 20, flags, method, dos_time, dos_date,
+            crc, csize, size, len(name), 0,
+        ) + name
+
+    def _check_limits(self, *sizes: int) -> None:
+        if any(s > ZIP32_LIMIT for s in sizes) or self._offset > ZIP32_LIMIT:
+            raise ValueError("archive too large for a zip32 stream.")
+
+    def add_dir(self, arcname: str, *, mtime: float | None = None) -> Iterator[bytes]:
+        name, flags = self._encode_name(arcname.rstrip("/") + "/")
+        dos_time, dos_date = _dos_datetime(mtime if mtime is not None else time.time())
+        self._records.append(_CentralRecord(
+            name, flags, STORED, dos_time, dos_date, 0, 0, 0,
+            (0o40755 << 16) | 0x10, self._offset,
+        ))
+        yield self._emit(self._local_header(name, flags, STORED, dos_time, dos_date, 0, 0, 0))
+
+    def add_bytes(
+        self,
+        arcname: str,
+        data: bytes | str,
+        *,
+        compress: bool = True,
+        mtime: float | None = None,
+    ) -> Iterator[bytes]:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        name, flags = self._encode_name(arcname)
+        dos_time, dos_date = _dos_datetime(mtime if mtime is not None else time.time())
+        crc = zlib.crc32(data)
+        method = STORED
+        payload = data
+        if compress:
+            compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+            deflated = compressor.compress(data) + compressor.flush()
+            if len(deflated) < len(data):
+                method, payload = DEFLATED, deflated
+        self._check_limits(len(data), len(payload))
+
+        self._records.append(_CentralRecord(
+            name, flags, method, dos_time, dos_date, crc, len(payload), len(data),
+            0o100644 << 16, self._offset,
+        ))
+        yield self._emit(self._local_header(
+            name, flags, method, dos_time, dos_date, crc, len(payload), len(data)
+        ))
+        yield self._emit(payload)
+
+    def add_precompressed(self, arcname: str, member: PrecompressedMember) -> Iterator[bytes]:
+        """splice in a member compressed ahead of time by copying its raw bytes."""
+        if member.is_dir:
+            yield from self.add_dir(arcname, mtime=member.mtime)
+            return
+        name, flags = self._encode_name(arcname)
+        dos_time, dos_date = _dos_datetime(member.mtime)
+        self._check_limits(member.size, len(member.data))
+        self._records.append(_CentralRecord(
+            name, flags, member.method, dos_time, dos_date, member.crc,
+            len(member.data), member.size, 0o100644 << 16, self._offset,
+        ))
+        yield self._emit(self._local_header(
+            name, flags, member.method, dos_time, dos_date,
+            member.crc, len(member.data), member.size,
+        ))
+        yield self._emit(member.data)
+
+    def add_file(self, arcname: str, path, *, compress: bool = True) -> Iterator[bytes]:
+        """stream a file from disk in chunks; sizes follow in a data descriptor."""
+        path = Path(path)
+        name, flags = self._encode_name(arcname)
+        flags |= FLAG_DATA_DESCRIPTOR
+        dos_time, dos_date = _dos_datetime(path.stat().st_mtime)
+        method = DEFLATED if compress else STORED
+        offset = self._offset
+
+        yield self._emit(self._local_header(name, flags, method, dos_time, dos_date, 0, 0, 0))
+
+        crc = 0
+        size = 0
+        csize = 0
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15) if compress else None
+        with open(path, "rb") as fh:
+            for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                out = compressor.compress(chunk) if compressor else chunk
+                if out:
+                    csize += len(out)
+                    yield self._emit(out)
+        if compressor:
+            out = compressor.flush()
+            csize += len(out)
+            yield self._emit(out)
+        self._check_limits(size, csize)
+
+        yield self._emit(struct.pack("<IIII", DATA_DESCRIPTOR_SIG, crc, csize, size))
+        self._records.append(_CentralRecord(
+            name, flags, method, dos_time, dos_date, crc, csize, size,
+            0o100644 << 16, offset,
+        ))
+
+    def finish(self) -> Iterator[bytes]:
+        if len(self._records) > 0xFFFF:
+            raise ValueError("too many entries for a zip32 stream.")
+        cd_offset = self._offset
+        for rec in self._records:
+            yield self._emit(struct.pack(
+                "<IHHHHHHIIIHHHHHII",
+                CENTRAL_HEADER_SIG, (3 << 8) | 20, 20, rec.flags, rec.method,
+                rec.dos_time, rec.dos_date, rec.crc, rec.compressed_size, rec.size,
+                len(rec.name), 0, 0, 0, 0, rec.external_attr, rec.offset,
+            ) + rec.name)
+        cd_size = self._offset - cd_offset
+        self._check_limits(cd_size)
+        yield self._emit(struct.pack(
+            "<IHHHHIIH",
+            END_OF_CENTRAL_DIR_SIG, 0, 0, len(self._records), len(self._records),
+            cd_size, cd_offset, 0,
+        ))
+
+
+def stream_zip(
+    entries: Iterable[Tuple[str, EntrySource]], *, compresslevel: int = 6
+) -> Iterator[bytes]:
+    """
+    entries: (arcname, source) pairs; source is bytes/str held in memory,
+    a Path streamed from disk, a PrecompressedMember copied as-is, or None
+    for a directory entry.
+    """
+    zs = ZipStream(compresslevel=compresslevel)
+    for arcname, source in entries:
+        if source is None:
+            yield from zs.add_dir(arcname)
+        elif isinstance(source, PrecompressedMember):
+            yield from zs.add_precompressed(arcname, source)
+        elif isinstance(source, Path):
+            yield from zs.add_file(arcname, source)
+        else:
+            yield from zs.add_bytes(arcname, source)
+    yield from zs.finish()
+
+
+def iter_tree_entries(root, arcroot: str) -> Iterator[Tuple[str, EntrySource]]:
+    """directory entries and file paths below root, named under arcroot."""
+    root = Path(root)
+    if not root.exists():
+        return
+    for path in sorted(root.rglob("*")):
+        arcname = f"{arcroot}/{path.relative_to(root).as_posix()}"
+        yield (arcname, None) if path.is_dir() else (arcname, path)
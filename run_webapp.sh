@@ -28,7 +28,7 @@ fi
 
 cd "$ROOT_DIR"
 
-python -m webapp.app &
+gunicorn --config "$ROOT_DIR/webapp/gunicorn.conf.py" webapp.app:app &
 APP_PID=$!
 
 if [ "${OPEN_BROWSER:-1}" = "1" ]; then
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import sys
+
+import pytest
+
+from benchmarks.stubs import install_stub_tools
+from processing.anystyle_pool import AnyStylePool, AnyStyleWorker, AnyStyleWorkerError
+from processing.citations import AnyStyleNoOutputError, build_bibtex_with_anystyle
+
+
+# stands in for `ruby anystyle_worker.rb`, speaking the same json lines. a
+# reference names what goes wrong: "crash", "hang", "garbage", "fail" or "empty".
+# with FAKE_WORKER_HANG_PING set, only the first ping (at startup) is answered.
+FAKE_WORKER = """\
+import json
+import os
+import sys
+import time
+
+pings = 0
+for line in sys.stdin:
+    request = json.loads(line)
+    if request["op"] == "ping":
+        pings += 1
+        if pings > 1 and os.environ.get("FAKE_WORKER_HANG_PING"):
+            time.sleep(60)
+        response = {"ok": True}
+    elif request["op"] == "parse":
+        refs = request["references"]
+        if "crash" in refs:
+            os._exit(1)
+        if "hang" in refs:
+            time.sleep(60)
+        if "garbage" in refs:
+            print("not json", flush=True)
+            continue
+        if "fail" in refs:
+            print(json.dumps({"ok": False, "error": "RuntimeError: bad reference"}), flush=True)
+            continue
+        bibtex = "" if "empty" in refs else "\\n\\n".join(
+            "@article{w%d,\\n  title = {%s}\\n}" % (i, ref) for i, ref in enumerate(refs)
+        )
+        response = {"ok": True, "bibtex": bibtex}
+    else:
+        response = {"ok": False, "error": "unknown op: %s" % request["op"]}
+    print(json.dumps(response), flush=True)
+"""
+
+
+@pytest.fixture
+def fake_ruby(tmp_path):
+    path = tmp_path / "ruby"
+    path.write_text(f"#!{sys.executable}\n{FAKE_WORKER}")
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_worker_speaks_json_lines(fake_ruby):
+    worker = AnyStyleWorker(ruby_cmd=fake_ruby, startup_timeout=10)
+    try:
+        worker.start()
+        assert worker.ping()
+        assert worker.parse(["A. One.", "B. Two."]) == (
+            "@article{w0,\n  title = {A. One.}\n}\n\n@article{w1,\n  title = {B. Two.}\n}"
+        )
+        assert worker.parse(["empty"]) == ""
+        assert worker.request({"op": "reload"}, timeout=5) == {"ok": False, "error": "unknown op: reload"}
+        # an error the worker reports is raised, and the worker stays up.
+        with pytest.raises(AnyStyleWorkerError, match="failed: RuntimeError: bad reference"):
+            worker.parse(["fail"])
+        assert worker.alive and worker.ping()
+    finally:
+        worker.close()
+
+
+@pytest.mark.parametrize(
+    "reference, message",
+    [("garbage", "invalid response"), ("crash", "exited unexpectedly"), ("hang", "timed out")],
+)
+def test_worker_is_closed_after_a_broken_answer(fake_ruby, reference, message):
+    worker = AnyStyleWorker(ruby_cmd=fake_ruby, startup_timeout=10)
+    try:
+        worker.start()
+        with pytest.raises(AnyStyleWorkerError, match=message):
+            worker.parse([reference], timeout=1)
+        assert not worker.alive
+        with pytest.raises(AnyStyleWorkerError, match="not running"):
+            worker.ping()
+    finally:
+        worker.close()
+
+
+def test_pool_restarts_a_dead_worker(fake_ruby):
+    pool = AnyStylePool(1, ruby_cmd=fake_ruby, startup_timeout=10)
+    try:
+        assert pool.parse(["A."]).startswith("@article{w0")
+        worker = pool._idle.queue[0]
+        worker._proc.kill()
+        worker._proc.wait()
+        assert pool.parse(["B."]).startswith("@article{w0")
+        assert worker.alive
+    finally:
+        pool.close()
+
+
+def test_pool_pings_an_idle_worker_and_replaces_a_hung_one(fake_ruby, monkeypatch):
+    monkeypatch.setenv("FAKE_WORKER_HANG_PING", "1")
+    pool = AnyStylePool(1, ruby_cmd=fake_ruby, startup_timeout=10, ping_after=0, ping_timeout=0.5)
+    try:
+        pool.parse(["A."])
+        first = pool._idle.queue[0]._proc.pid
+        assert pool.parse(["B."]).startswith("@article{w0")
+        assert pool._idle.queue[0]._proc.pid != first
+    finally:
+        pool.close()
+
+
+def test_pool_backs_off_when_workers_keep_dying(fake_ruby):
+    pool = AnyStylePool(1, ruby_cmd=fake_ruby, startup_timeout=10, retry_after=60)
+    try:
+        with pytest.raises(AnyStyleWorkerError):
+            pool.parse(["crash"])
+        assert not pool.available
+    finally:
+        pool.close()
+
+
+def test_cli_is_used_only_when_the_pool_fails(fake_ruby, tmp_path):
+    install_stub_tools(tmp_path / "bin")
+    cli = str(tmp_path / "bin" / "anystyle")
+    pool = AnyStylePool(1, ruby_cmd=fake_ruby, startup_timeout=10)
+    try:
+        # the warm parser found nothing: that is the answer, the cli is not run.
+        with pytest.raises(AnyStyleNoOutputError):
+            build_bibtex_with_anystyle(["empty"], anystyle_cmd=str(tmp_path / "missing"), pool=pool)
+        # a worker that dies is a pool error: the cli parses instead.
+        bibtex = build_bibtex_with_anystyle(["garbage"], anystyle_cmd=cli, pool=pool)
+        assert bibtex.startswith("@article{stub0")
+    finally:
+        pool.close()
@@ -0,0 +1,25 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+import pytest
+
+from processing.batch import CRASHED, PaperResult, _convert_isolating_crashes
+
+
+def _convert(docx_path: Path) -> PaperResult:
+    if docx_path.stem == "crash":
+        os._exit(1)
+    return PaperResult(paper_num=docx_path.stem, output=docx_path)
+
+
+@pytest.mark.parametrize("jobs", [1, 3])
+def test_a_crashing_paper_fails_alone(jobs):
+    papers = [Path(f"{name}.docx") for name in ("a", "b", "crash", "c", "d", "e")]
+    results = []
+    _convert_isolating_crashes(papers, _convert, jobs=jobs, report=results.append)
+    by_paper = {r.paper_num: r for r in results}
+    assert len(results) == len(by_paper) == len(papers)
+    assert by_paper["crash"].error == CRASHED
+    assert all(r.ok for name, r in by_paper.items() if name != "crash")
@@ -0,0 +1,54 @@
+from __future__ import annotations
+
+import zipfile
+
+from benchmarks.synthetic import SyntheticSpec, write_synthetic_docx
+from processing.get_msurj_conversion import convert_body
+from processing.latex_rewrite import split_sections
+from processing.pandoc_intermediate import create_tex_ir
+from processing.pipeline_cache import PipelineCache
+
+
+class CountingCache(PipelineCache):
+    def __init__(self, root):
+        super().__init__(root)
+        self.misses = 0
+
+    def put_chunk(self, key, text):
+        self.misses += 1
+        super().put_chunk(key, text)
+
+
+def _revise(docx, path, old: str, new: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(docx) as src, zipfile.ZipFile(path, "w") as dst:
+        for info in src.infolist():
+            data = src.read(info)
+            if info.filename == "word/document.xml":
+                data = data.replace(old.encode(), new.encode(), 1)
+            dst.writestr(info, data)
+    return path
+
+
+def _ir_text(docx, job_dir) -> str:
+    output_dir = create_tex_ir(docx, ir_tex_dir=job_dir, backend="native")
+    return (output_dir / f"{docx.stem}.tex").read_text()
+
+
+def test_sections_with_figures_hit_across_job_dirs(tmp_path):
+    spec = SyntheticSpec(pages=6, figures=4, tables=1, references=5)
+    first = write_synthetic_docx(spec, tmp_path / "a" / "paper.docx")
+    revised = _revise(first, tmp_path / "b" / "paper.docx", "Introduction 1", "Introduction, revised")
+    cache = CountingCache(tmp_path / "cache")
+
+    first_ir = _ir_text(first, tmp_path / "job-a")
+    assert str(tmp_path / "job-a") in first_ir  # figures point into the job dir
+    convert_body(first_ir, enable_citations=False, chunk_cache=cache)
+    cache.misses = 0
+
+    revised_ir = _ir_text(revised, tmp_path / "job-b")
+    body = convert_body(revised_ir, enable_citations=False, chunk_cache=cache)
+    assert len(split_sections(body.body_text)) > 3
+    assert cache.misses == 1  # only the section whose heading changed
+    assert str(tmp_path / "job-b") not in body.body_text
+    assert body == convert_body(revised_ir, enable_citations=False)
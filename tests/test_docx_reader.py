@@ -0,0 +1,270 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import random
+import shutil
+import subprocess
+
+import pytest
+
+from benchmarks.synthetic import SyntheticSpec, synthetic_png, write_docx, write_synthetic_docx
+from processing import pandoc_intermediate
+from processing.docx_reader import EMU_PER_INCH, UnsupportedDocxError, read_docx_to_tex
+from processing.pandoc_intermediate import compare_ir_backends, create_tex_ir
+
+
+IMAGE_REL = (
+    '<Relationship Id="rIdImage1" Target="media/image1.png" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"/>'
+)
+LINKED_IMAGE_REL = (
+    '<Relationship Id="rIdImage1" Target="file:///C:/figure.png" TargetMode="External" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"/>'
+)
+
+
+def run(text: str, *, props: str = "") -> str:
+    rpr = f"<w:rPr>{props}</w:rPr>" if props else ""
+    return f'<w:r>{rpr}<w:t xml:space="preserve">{text}</w:t></w:r>'
+
+
+def sup(text: str) -> str:
+    return run(text, props='<w:vertAlign w:val="superscript"/>')
+
+
+def p(*runs: str, style: str = "", numbered: bool = False) -> str:
+    ppr = f'<w:pStyle w:val="{style}"/>' if style else ""
+    if numbered:
+        ppr += '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="1"/></w:numPr>'
+    return f"<w:p>{f'<w:pPr>{ppr}</w:pPr>' if ppr else ''}{''.join(runs)}</w:p>"
+
+
+def drawing(rel_id: str = "rIdImage1", *, width_in: float = 3.0) -> str:
+    cx = int(width_in * EMU_PER_INCH)
+    return (
+        f'<w:p><w:r><w:drawing><wp:inline><wp:extent cx="{cx}" cy="{cx * 3 // 4}"/>'
+        '<wp:docPr id="1" name="Picture 1"/>'
+        '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f'<pic:pic><pic:blipFill><a:blip r:embed="{rel_id}"/></pic:blipFill></pic:pic>'
+        "</a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>"
+    )
+
+
+def table(*rows, header: bool = True, cell_props: str = "") -> str:
+    grid = "".join('<w:gridCol w:w="2000"/>' for _ in rows[0])
+    body = ""
+    for i, row in enumerate(rows):
+        trpr = "<w:trPr><w:tblHeader/></w:trPr>" if header and i == 0 else ""
+        tcpr = f"<w:tcPr>{cell_props}</w:tcPr>" if cell_props and i == 1 else ""
+        body += f"<w:tr>{trpr}" + "".join(f"<w:tc>{tcpr}{p(run(cell))}</w:tc>" for cell in row) + "</w:tr>"
+    return f"<w:tbl><w:tblPr/><w:tblGrid>{grid}</w:tblGrid>{body}</w:tbl>"
+
+
+def document_body(tex: str) -> str:
+    start = tex.index(r"\begin{document}") + len(r"\begin{document}")
+    return tex[start : tex.index(r"\end{document}")].strip()
+
+
+def read_body(tmp_path, body: str, **docx) -> str:
+    """the latex between \\begin{document} and \\end{document} the native reader writes."""
+    path = write_docx(tmp_path / "paper.docx", body, **docx)
+    return document_body(
+        read_docx_to_tex(path, tmp_path / "paper.tex", tmp_path / "Figures", media_prefix="media").read_text()
+    )
+
+
+def test_headings(tmp_path):
+    body = read_body(tmp_path, "".join([
+        p(run("Abstract"), style="Heading1"),
+        p(run("Methods"), style="Heading2"),
+        p(run("Results"), style="Heading1"),
+        p(run("Results"), style="Heading1"),
+        p(run("Bold heading", props="<w:b/>"), style="Heading1"),
+    ]))
+    assert body.splitlines()[::2] == [
+        r"\section{Abstract}\label{abstract}",
+        r"\subsection{Methods}\label{methods}",
+        r"\section{Results}\label{results}",
+        r"\section{Results}\label{results-1}",
+        r"\section{\texorpdfstring{\textbf{Bold heading}}{Bold heading}}\label{bold-heading}",
+    ]
+
+
+def test_adjacent_superscript_runs_are_one_citation(tmp_path):
+    body = read_body(tmp_path, p(run("As shown before."), sup("1"), sup(",3"), run(" Then "), sup("2")))
+    assert body == r"As shown before.\textsuperscript{1,3} Then \textsuperscript{2}"
+
+
+def test_special_characters_are_escaped(tmp_path):
+    body = read_body(tmp_path, p(run("50% of A &amp; B_1 cost $3 #2")))
+    assert body == r"50\% of A \& B\_1 cost \$3 \#2"
+
+
+def test_numbered_list_continues_after_a_paragraph(tmp_path):
+    body = read_body(tmp_path, "".join([
+        p(run("First."), numbered=True),
+        p(run("Second."), numbered=True),
+        p(run("Between.")),
+        p(run("Third."), numbered=True),
+    ]))
+    assert body.count(r"\begin{enumerate}") == 2
+    assert r"\def\labelenumi{\arabic{enumi}.}" in body
+    assert "\\item\n  First.\n\\item\n  Second." in body
+    assert r"\setcounter{enumi}{2}" in body
+    assert body.index("Between.") < body.index("Third.")
+
+
+def test_table(tmp_path):
+    body = read_body(tmp_path, table(["Group", "Mean"], ["Control", "1.5"]))
+    # like pandoc, a table without a caption does not step the table counter.
+    assert body.startswith("{\\def\\LTcaptype{none}")
+    assert body.count(r"\begin{longtable}") == body.count(r"\end{longtable}") == 1
+    assert r"\toprule" in body and r"\endhead" in body
+    assert r"Control & 1.5 \\" in body
+
+
+def test_image_is_extracted_at_its_printed_size(tmp_path):
+    png = synthetic_png(random.Random(0), 40, 30)
+    body = read_body(
+        tmp_path,
+        drawing(width_in=3.0) + p(run("Figure 1. A caption."), style="Caption"),
+        rels=[IMAGE_REL],
+        media=[("image1.png", png)],
+    )
+    assert r"\includegraphics[width=3in,height=2.25in]{media/image1.png}" in body
+    assert r"\caption{Figure 1. A caption.}" in body
+    assert (tmp_path / "Figures" / "image1.png").read_bytes() == png
+
+
+MATH = '<m:oMath xmlns:m="http://schemas.openxmlformats.org/officeDocument/2006/math"><m:r><m:t>x</m:t></m:r></m:oMath>'
+
+
+@pytest.mark.parametrize(
+    "body, rels",
+    [
+        pytest.param(f"<w:p>{MATH}</w:p>", [], id="equation"),
+        pytest.param(p('<w:r><w:footnoteReference w:id="1"/></w:r>'), [], id="footnote"),
+        pytest.param(table(["a", "b"], ["c", "d"], cell_props='<w:vMerge w:val="restart"/>'), [], id="merged-cells"),
+        pytest.param(drawing(), [LINKED_IMAGE_REL], id="linked-image"),
+        pytest.param(
+            '<w:p><w:r><mc:AlternateContent xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006">'
+            "<mc:Fallback/></mc:AlternateContent></w:r></w:p>",
+            [],
+            id="text-box",
+        ),
+    ],
+)
+def test_unsupported_features_are_refused(tmp_path, body, rels):
+    with pytest.raises(UnsupportedDocxError):
+        read_body(tmp_path, p(run("Text.")) + body, rels=rels)
+
+
+def test_auto_backend_falls_back_to_pandoc(tmp_path, monkeypatch):
+    calls = []
+
+    def fake_pandoc(input_docx, output_tex, output_dir, *, max_memory_mb=None):
+        calls.append(input_docx)
+        output_tex.write_text("pandoc")
+
+    monkeypatch.setattr(pandoc_intermediate, "_run_pandoc", fake_pandoc)
+    plain = write_docx(tmp_path / "plain.docx", p(run("Text.")))
+    create_tex_ir(plain, ir_tex_dir=tmp_path / "ir", backend="auto")
+    assert calls == []
+
+    equation = write_docx(tmp_path / "equation.docx", f"<w:p>{MATH}</w:p>")
+    output_dir = create_tex_ir(equation, ir_tex_dir=tmp_path / "ir", backend="auto")
+    assert calls == [equation]
+    assert (output_dir / "equation.tex").read_text() == "pandoc"
+
+    with pytest.raises(UnsupportedDocxError):
+        create_tex_ir(equation, ir_tex_dir=tmp_path / "native", backend="native")
+
+
+def test_synthetic_manuscript(tmp_path):
+    spec = SyntheticSpec(pages=4, figures=3, tables=2, references=12)
+    docx = write_synthetic_docx(spec, tmp_path / "paper.docx")
+    tex = read_docx_to_tex(docx, tmp_path / "paper.tex", tmp_path / "Figures", media_prefix="media").read_text()
+    assert tex.count(r"\section{Abstract}") == 1
+    assert tex.count(r"\section{References}") == 1
+    assert tex.count(r"\includegraphics") == spec.figures
+    assert tex.count(r"\begin{longtable}") == spec.tables
+    references = tex[tex.index(r"\section{References}"):]
+    assert references.count(r"\item") == spec.references
+    assert r"\textsuperscript{" in tex
+    assert sorted(f.name for f in (tmp_path / "Figures").iterdir()) == ["image1.png", "image2.png", "image3.png"]
+
+
+def _real_pandoc() -> bool:
+    """pandoc is on PATH and is not the native reader's stand-in from benchmarks.stubs."""
+    if shutil.which("pandoc") is None:
+        return False
+    version = subprocess.run(["pandoc", "--version"], capture_output=True, text=True)
+    return version.returncode == 0 and version.stdout.startswith("pandoc ")
+
+
+def features_docx(path) -> Path:
+    """one manuscript with every construct the native reader supports."""
+    return write_docx(
+        path,
+        "".join([
+            p(run("Abstract"), style="Heading1"),
+            p(run("As shown before."), sup("1"), sup(",3"), run(" Then "), sup("2")),
+            p(run("50% of A &amp; B_1 cost $3 #2 ~ ^ \\ {x}")),
+            p(run("Methods"), style="Heading2"),
+            p(run("Not a heading"), style="Heading3"),  # not in styles.xml
+            p(run("Results"), style="Heading1"),
+            p(run("Plain, "), run("italic", props="<w:i/>"), run(" and "), run("bold", props="<w:b/>")),
+            p(run("First."), numbered=True),
+            p(run("Second."), numbered=True),
+            p(run("Between.")),
+            p(run("Third."), numbered=True),
+            table(["Group", "Mean"], ["Control", "1.5"]),
+            drawing(width_in=3.0),
+            p(run("Figure 1. A caption."), style="Caption"),
+            p(run("Results"), style="Heading1"),
+            p(run("Bold heading", props="<w:b/>"), style="Heading1"),
+            p(run("References"), style="Heading1"),
+            p(run("Smith J. A title. J Synth Res. 2001;1:3-12."), numbered=True),
+        ]),
+        rels=[IMAGE_REL],
+        media=[("image1.png", synthetic_png(random.Random(0), 40, 30))],
+    )
+
+
+def _synthetic_docx(seed: int):
+    spec = SyntheticSpec(pages=3, figures=2, tables=2, references=10, seed=seed)
+    return lambda path: write_synthetic_docx(spec, path)
+
+
+# tests/golden/docx/<name>.tex is the body pandoc 3.9 wrote for each document,
+# with images under media/. run the tests with MSURJ_UPDATE_GOLDEN=1 and a
+# real pandoc on PATH to write them again.
+GOLDEN_DIR = Path(__file__).parent / "golden" / "docx"
+GOLDEN_DOCUMENTS = {
+    "features": features_docx,
+    **{f"synthetic-{seed}": _synthetic_docx(seed) for seed in range(3)},
+}
+
+
+@pytest.mark.parametrize("name", GOLDEN_DOCUMENTS)
+def test_native_reader_matches_pandoc_golden(tmp_path, name):
+    docx = GOLDEN_DOCUMENTS[name](tmp_path / f"{name}.docx")
+    golden = GOLDEN_DIR / f"{name}.tex"
+    if os.environ.get("MSURJ_UPDATE_GOLDEN"):
+        if not _real_pandoc():
+            pytest.fail("MSURJ_UPDATE_GOLDEN needs pandoc on PATH.")
+        output_dir = create_tex_ir(docx, ir_tex_dir=tmp_path / "pandoc", backend="pandoc")
+        tex = (output_dir / f"{name}.tex").read_text().replace(f"{output_dir}/media/", "media/")
+        golden.write_text(document_body(tex) + "\n")
+
+    tex = read_docx_to_tex(docx, tmp_path / f"{name}.tex", tmp_path / "Figures", media_prefix="media").read_text()
+    assert document_body(tex) + "\n" == golden.read_text()
+
+
+@pytest.mark.skipif(not _real_pandoc(), reason="pandoc is not installed")
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_native_reader_matches_pandoc(tmp_path, seed):
+    spec = SyntheticSpec(pages=3, figures=2, tables=2, references=10, seed=seed)
+    docx = write_synthetic_docx(spec, tmp_path / f"paper{seed}.docx")
+    assert compare_ir_backends(docx, work_dir=tmp_path / "ir") == []
@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import operator
+import os
+
+from webapp.jobs import DONE, FAILED, JobQueue
+
+
+def _run(queue: JobQueue, fn, *args):
+    job = queue.create("paper.docx")
+    queue.start(job, fn, *args)
+    assert queue.wait(timeout=60)
+    return job
+
+
+def test_a_crashed_worker_fails_its_job_and_the_queue_recovers(tmp_path):
+    queue = JobQueue(max_workers=1, root=tmp_path)
+    try:
+        crashed = _run(queue, os._exit, 1)
+        assert crashed.status == FAILED
+        assert "crashed" in crashed.error
+
+        job = _run(queue, operator.add, 1, 2)
+        assert job.status == DONE and job.result == 3
+    finally:
+        queue.shutdown(wait=False)
+
+
+def test_start_retries_on_a_pool_broken_behind_its_back(tmp_path):
+    queue = JobQueue(max_workers=1, root=tmp_path)
+    try:
+        # break the pool without a job of the queue noticing it.
+        queue._get_executor().submit(os._exit, 1).exception(timeout=60)
+
+        job = _run(queue, operator.add, 2, 3)
+        assert job.status == DONE and job.result == 5
+    finally:
+        queue.shutdown(wait=False)
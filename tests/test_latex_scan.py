@@ -0,0 +1,67 @@
+from __future__ import annotations
+
+import pytest
+
+from benchmarks.stubs import install_stub_tools
+from processing.citations import locate_references_section
+from processing.get_msurj_conversion import convert_body
+from processing.latex_scan import find_heading, plain_title, scan_headings
+
+
+def test_scan_headings():
+    text = (
+        "\\section{Abstract}\\label{abstract}\n\nText.\n\n"
+        "% \\section{Commented out}\n"
+        "\\section{\\texorpdfstring{\\textbf{Results}}{Results}}\\label{results}\n\n"
+        "Costs 5\\% \\section{Methods: {A} and B}\n"
+    )
+    headings = scan_headings(text)
+    assert [h.title for h in headings] == ["Abstract", "Results", "Methods: A and B"]
+    abstract = headings[0]
+    assert text[abstract.start : abstract.title_end] == "\\section{Abstract}"
+    assert text[abstract.line_end :].startswith("\nText.")
+
+
+def test_starred_sections_are_not_headings():
+    assert scan_headings("\\section*{Abstract}\n\nText.\n") == []
+
+
+def test_find_heading():
+    headings = scan_headings("\\section{Abstract:}\n\\section{References}\n\\section{REFERENCES.}\n")
+    assert find_heading(headings, "abstract") is headings[0]
+    assert find_heading(headings, "References") is headings[1]
+    assert find_heading(headings, "References", start=headings[1].start + 1) is headings[2]
+    assert find_heading(headings, "Methods") is None
+
+
+def test_plain_title():
+    assert plain_title("\\texorpdfstring{\\emph{Abstract}}{Abstract}") == "Abstract"
+    assert plain_title("\\textbf{Materials} and {Methods}") == "Materials and Methods"
+
+
+def test_starred_section_stays_in_the_abstract():
+    body = convert_body(
+        "\\section{Abstract}\n\nAbstract text.\n\n\\section*{Highlights}\n\nHighlight.\n\n"
+        "\\section{Introduction}\\label{introduction}\n\nBody.\n",
+        enable_citations=False,
+    )
+    assert body.abstract_text == "Abstract text.\n\n\\section*{Highlights}\n\nHighlight."
+    assert body.body_text.startswith("\\section{Introduction}")
+
+
+def test_references_after_the_abstract():
+    text = "\\section{Abstract}\n\nSee the References.\n\n\\section{Intro}\n\n\\section{References}\n\n1. A.\n"
+    start, end = locate_references_section(text, start=text.index("\\section{Intro}"))
+    assert text[start:end] == "\\section{References}\n"
+    with pytest.raises(ValueError):
+        locate_references_section("\\section*{References}\n\n1. A.\n")
+
+
+def test_pandocs_end_document_is_not_a_reference(tmp_path):
+    install_stub_tools(tmp_path / "bin")
+    body = convert_body(
+        "\\documentclass{article}\n\\begin{document}\n\\section{Abstract}\n\nText.\n\n"
+        "\\section{References}\n\n\\begin{enumerate}\n\\item\n  Smith J. Title.\n\\end{enumerate}\n\n\\end{document}\n",
+        anystyle_cmd=str(tmp_path / "bin" / "anystyle"),
+    )
+    assert body.bibtex == "@article{ref1,\n  title = {Smith J. Title.}\n}"
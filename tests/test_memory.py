@@ -0,0 +1,19 @@
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from benchmarks.bench_memory import LIMIT_MB, measure_peak_rss
+from benchmarks.synthetic import SyntheticSpec
+
+
+@pytest.mark.slow
+@pytest.mark.skipif(not hasattr(os, "wait4"), reason="needs os.wait4 to read the child's peak rss")
+@pytest.mark.parametrize("figure_format", ["png", "jpeg"])
+def test_large_thesis_stays_under_the_memory_limit(figure_format):
+    spec = SyntheticSpec(
+        pages=200, figures=100, tables=20, references=300, figure_px=2400, figure_format=figure_format
+    )
+    peak_mb, _ = measure_peak_rss(spec)
+    assert peak_mb < LIMIT_MB
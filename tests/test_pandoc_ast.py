@@ -0,0 +1,183 @@
+from __future__ import annotations
+
+import json
+import shutil
+
+import pytest
+
+from benchmarks.stubs import install_stub_tools
+from benchmarks.synthetic import SyntheticSpec, write_synthetic_docx
+from processing import pandoc_ast
+from processing.citations import CitationIndex
+from processing.figure_index import FigureIndex, ImageInfo
+from processing.get_msurj_conversion import convert_body
+from processing.pandoc_ast import convert_ast, find_section, reference_texts, rewrite_blocks, stringify
+from processing.pandoc_intermediate import create_tex_ir
+
+
+ATTR = ["", [], []]
+API_VERSION = [1, 23, 1]
+
+
+def words(text: str) -> list:
+    inlines = []
+    for word in text.split(" "):
+        if inlines:
+            inlines.append({"t": "Space"})
+        inlines.append({"t": "Str", "c": word})
+    return inlines
+
+
+def para(*inlines) -> dict:
+    return {"t": "Para", "c": [i for part in inlines for i in (part if isinstance(part, list) else [part])]}
+
+
+def header(text: str, *, level: int = 1, classes=()) -> dict:
+    return {"t": "Header", "c": [level, [text.lower(), list(classes), []], words(text)]}
+
+
+def sup(text: str) -> dict:
+    return {"t": "Superscript", "c": words(text)}
+
+
+def image(target: str, **size) -> dict:
+    return {"t": "Image", "c": [["", [], list(size.items())], [], [target, ""]]}
+
+
+def figure(img: dict, caption: str) -> dict:
+    return {"t": "Figure", "c": [["fig1", [], []], [None, [{"t": "Plain", "c": words(caption)}]], [{"t": "Plain", "c": [img]}]]}
+
+
+def numbered(*items: str) -> dict:
+    return {"t": "OrderedList", "c": [[1, {"t": "Decimal"}, {"t": "Period"}], [[para(words(i))] for i in items]]}
+
+
+def raw(blocks) -> str:
+    """the latex of the raw nodes in blocks, in order."""
+    found = []
+
+    def visit(node):
+        if node["t"] in ("RawInline", "RawBlock"):
+            found.append(node["c"][1])
+        return None
+
+    pandoc_ast.walk(blocks, visit)
+    return "\n".join(found)
+
+
+def test_find_section():
+    blocks = [
+        header("Abstract:"),
+        para(words("Text.")),
+        header("References", classes=["unnumbered"]),
+        header("Methods", level=2),
+        header("REFERENCES."),
+    ]
+    assert find_section(blocks, "abstract") == 0
+    assert find_section(blocks, "References") == 4
+    assert find_section(blocks, "Methods") is None
+
+
+def test_reference_texts():
+    link = {"t": "Link", "c": [ATTR, words("the paper"), ["https://doi.org/10.1/x", ""]]}
+    listed = [{"t": "BlockQuote", "c": [numbered("Smith J. Title. 2020.", "Doe A. Other.")]}]
+    assert reference_texts(listed) == ["Smith J. Title. 2020.", "Doe A. Other."]
+    plain = [para(words("Smith J. Title.")), para(words("See"), {"t": "Space"}, link), para([])]
+    assert reference_texts(plain) == ["Smith J. Title.", "See https://doi.org/10.1/x"]
+
+
+def test_citations_become_cites():
+    citations = CitationIndex({1: "ref1", 2: "ref2", 3: "ref3"})
+    blocks = rewrite_blocks(
+        [para(words("Known"), sup("1–3"), words(" and m"), sup("2"), words(" but"), sup("-1"))],
+        citations=citations,
+    )
+    assert raw(blocks) == "\\textsuperscript{\\cite{ref1,ref2,ref3}}\n\\textsuperscript{\\cite{ref2}}"
+    assert stringify(blocks) == "Known and m but-1"
+
+
+def test_images_point_at_figures():
+    blocks = rewrite_blocks([para(image("/tmp/job/ir/media/image1.png", width="2in"), image("media/chart.emf"))])
+    assert raw(blocks) == (
+        "\\includegraphics[width=\\\\columnwidth]{Figures/image1.png}\n"
+        "\\includegraphics[width=\\\\columnwidth]{media/chart.emf}"
+    )
+
+
+def test_figures_are_laid_out_by_width():
+    narrow, wide = rewrite_blocks([
+        figure(image("media/image1.png", width="3in", height="2.25in"), "Figure 1. Narrow."),
+        figure(image("media/image2.png", width="6in", height="4.5in"), "Figure 2. Wide."),
+    ])
+    assert raw(narrow) == (
+        "\\begin{figure}\n\\captionsetup{width=\\columnwidth}\n\\centering\n"
+        "\\includegraphics[width=\\columnwidth]{Figures/image1.png}\n\\caption{\n}\\label{fig1}\n\\end{figure}"
+    )
+    assert raw(wide).startswith("\\begin{figure*}\n\\captionsetup{width=\\textwidth}")
+    assert "\\includegraphics[width=\\textwidth]{Figures/image2.png}" in raw(wide)
+    assert stringify(wide) == "Figure 2. Wide."
+
+    # without a size in the ast the image's own size decides, as in the latex pipeline.
+    index = FigureIndex({"image3.png": ImageInfo(3000, 1000, (150.0, 150.0))})
+    (unsized,) = rewrite_blocks([figure(image("media/image3.png"), "Figure 3.")], figure_index=index)
+    assert raw(unsized).startswith("\\begin{figure*}")
+
+
+def test_convert_ast_splits_on_the_tree(monkeypatch):
+    written = []
+
+    def fake_write_latex(api_version, *parts):
+        written.append(parts)
+        return [raw(part) + stringify(part) for part in parts]
+
+    monkeypatch.setattr(pandoc_ast, "write_latex", fake_write_latex)
+    monkeypatch.setattr(
+        pandoc_ast,
+        "parse_reference_texts",
+        lambda refs, **kw: ("\n".join(refs), {i + 1: f"ref{i + 1}" for i in range(len(refs))}),
+    )
+    document = {
+        "pandoc-api-version": API_VERSION,
+        "meta": {},
+        "blocks": [
+            header("Title page", level=2),
+            header("Abstract"),
+            para(words("We cite"), sup("2")),
+            header("Highlights", classes=["unnumbered"]),
+            header("Introduction"),
+            para(words("Body"), sup("1,4")),
+            header("References"),
+            numbered("First.", "Second."),
+        ],
+    }
+    body = convert_ast(json.dumps(document))
+    abstract_part, body_part = written[0]
+    assert [b["t"] for b in abstract_part] == ["Para", "Header"]
+    assert [b["t"] for b in body_part] == ["Header", "Para"]
+    assert body.bibtex == "First.\nSecond."
+    assert body.abstract_text == "\\textsuperscript{\\cite{ref2}}We cite Highlights"
+    assert body.citations.unmatched == [4] and body.citations.unused == []
+
+    with pytest.raises(ValueError, match="No Abstract"):
+        convert_ast(json.dumps(dict(document, blocks=document["blocks"][4:])))
+    with pytest.raises(RuntimeError, match="pandoc 3.0"):
+        convert_ast(json.dumps(dict(document, **{"pandoc-api-version": [1, 22, 2]})))
+
+
+@pytest.mark.skipif(shutil.which("pandoc") is None, reason="pandoc is not installed")
+def test_ast_and_latex_pipelines_agree(tmp_path):
+    # only the anystyle stand-in is used; its directory is not put on PATH, so pandoc is the real one.
+    install_stub_tools(tmp_path / "bin")
+    anystyle = str(tmp_path / "bin" / "anystyle")
+    spec = SyntheticSpec(pages=3, figures=2, tables=2, references=10)
+    docx = write_synthetic_docx(spec, tmp_path / "paper.docx")
+
+    ast_dir = create_tex_ir(docx, ir_tex_dir=tmp_path / "ast", backend="pandoc-ast")
+    tex_dir = create_tex_ir(docx, ir_tex_dir=tmp_path / "tex", backend="pandoc")
+    from_ast = convert_ast((ast_dir / "paper.json").read_text(), anystyle_cmd=anystyle)
+    from_tex = convert_body((tex_dir / "paper.tex").read_text(), anystyle_cmd=anystyle)
+
+    assert from_ast.bibtex == from_tex.bibtex
+    assert from_ast.citations == from_tex.citations
+    for command in ("\\cite{", "\\section{", "\\begin{figure", "\\begin{tabularx}", "Figures/"):
+        assert from_ast.body_text.count(command) == from_tex.body_text.count(command), command
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import shutil
+import subprocess
+
+import pytest
+
+from processing.batch import TEMPLATE_DIR
+from processing.get_msurj_conversion import ConvertedBody, render_msurj
+from processing.preview import (
+    FONTSPEC_LINE,
+    LatexMessage,
+    PreviewCompiler,
+    parse_latex_log,
+    split_class,
+)
+
+
+LOG = r"""This is XeTeX, Version 3.141592653-2.6-0.999995 (TeX Live 2023) (preloaded format=msurj-preview)
+entering extended mode
+(./warm.tex
+LaTeX2e <2022-11-01> patch level 1
+(./msurj-preview-fonts.tex
+Package fontspec Warning: Font "MinionPro" does not contain requested
+(fontspec)                Script "CJK".
+
+)
+! Undefined control sequence.
+<argument> \msurjfoo
+
+l.3 \input{msurj-preview-fonts}
+
+(./body.tex
+LaTeX Warning: Reference `fig:missing' on page 2 undefined on input line 14.
+
+! Missing $ inserted.
+<inserted text>
+                $
+l.27 A_
+       1 value
+Package hyperref Warning: Token not allowed in a PDF string (Unicode):
+(hyperref)                removing `\textsuperscript' on input line 5.
+
+Class msurj Warning: Abstract is long on input line 9.
+
+LaTeX Warning: Label(s) may have changed. Rerun to get cross-references right.
+
+Package biblatex Warning: Please (re)run Biber on the file:
+(biblatex)                preview
+(biblatex)                and rerun LaTeX afterwards.
+
+LaTeX Warning: There were undefined references.
+
+) )
+Output written on preview.pdf (2 pages).
+"""
+
+
+def test_parse_latex_log():
+    assert parse_latex_log(LOG, line_offset=20) == [
+        LatexMessage("warning", 'fontspec: Font "MinionPro" does not contain requested Script "CJK".'),
+        # before body.tex is opened, l.<n> is a line of the driver, not of the paper.
+        LatexMessage("error", "Undefined control sequence."),
+        LatexMessage("warning", "Reference `fig:missing' on page 2 undefined", 34),
+        LatexMessage("error", "Missing $ inserted.", 47),
+        LatexMessage("warning", "hyperref: Token not allowed in a PDF string (Unicode): removing `\\textsuperscript'", 25),
+        LatexMessage("warning", "msurj: Abstract is long", 29),
+    ]
+    assert parse_latex_log("") == []
+
+
+def test_split_class():
+    cls = "\\NeedsTeXFormat{LaTeX2e}\n\\RequirePackage{graphicx}\n" + FONTSPEC_LINE + "\n\\setmainfont{MinionPro}\n"
+    head, fonts = split_class(cls)
+    assert head == "\\NeedsTeXFormat{LaTeX2e}\n\\RequirePackage{graphicx}\n"
+    assert fonts == FONTSPEC_LINE + "\n\\setmainfont{MinionPro}\n"
+    assert split_class("\\RequirePackage{graphicx}\n") == ("\\RequirePackage{graphicx}\n", "")
+
+
+def _has_mylatexformat() -> bool:
+    if shutil.which("kpsewhich") is None:
+        return False
+    found = subprocess.run(["kpsewhich", "mylatexformat.ltx"], capture_output=True, text=True)
+    return bool(found.stdout.strip())
+
+
+PAPER = render_msurj(
+    ConvertedBody(
+        abstract_text="A short abstract.",
+        body_text="\\section{Introduction}\\label{introduction}\n\nSome text.\n\n\\undefinedcommand\n",
+    ),
+    dict.fromkeys(("authors", "title", "submitted_date", "article_type", "affiliations", "keywords", "email"), "x"),
+)
+UNDEFINED_LINE = PAPER.splitlines().index("\\undefinedcommand") + 1
+
+
+@pytest.mark.skipif(shutil.which("xelatex") is None, reason="xelatex is not installed")
+@pytest.mark.skipif(not _has_mylatexformat(), reason="mylatexformat is not installed")
+def test_warm_compile_on_the_format(tmp_path):
+    compiler = PreviewCompiler(TEMPLATE_DIR, root=tmp_path / "tex")
+    try:
+        compiler.warm_up()
+        assert compiler.format_dir() is not None
+        assert compiler._next is not None and compiler._next.warm  # waiting in \read-1
+        for n in range(2):  # the second paper goes to the process warmed after the first
+            preview = compiler.compile(PAPER, None, None, tmp_path / f"out{n}")
+            assert preview.pdf is not None and preview.pdf.exists()
+            assert ("Undefined control sequence.", UNDEFINED_LINE) in [(m.message, m.line) for m in preview.errors]
+    finally:
+        compiler.close()
+
+
+@pytest.mark.skipif(shutil.which("xelatex") is None, reason="xelatex is not installed")
+def test_cold_compile_without_a_format(tmp_path, monkeypatch):
+    compiler = PreviewCompiler(TEMPLATE_DIR, root=tmp_path / "tex")
+    monkeypatch.setattr(compiler, "format_dir", lambda: None)
+    try:
+        preview = compiler.compile(PAPER, None, None, tmp_path / "out")
+        assert preview.pdf is not None and preview.pdf.exists()
+        assert ("Undefined control sequence.", UNDEFINED_LINE) in [(m.message, m.line) for m in preview.errors]
+    finally:
+        compiler.close()
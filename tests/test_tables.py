@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+from processing.latex_rewrite import RewriteOptions, rewrite_latex
+from processing.standardize_tables import standardize_tables
+
+
+NESTED = r"""\begin{longtable}[]{@{}ll@{}}
+\caption{Outer.}\tabularnewline
+\toprule
+A & \begin{longtable}{l}
+\caption{Inner.}\tabularnewline
+x \\
+\end{longtable} \\
+\endhead
+B & C \\
+\end{longtable}
+After.
+"""
+
+MINIPAGE = r"""\begin{longtable}[]{@{}ll@{}}
+\toprule
+A & \begin{minipage}[t]{0.4\columnwidth}
+\caption{Not the table's.}
+\end{minipage} \\
+\bottomrule
+\end{longtable}
+"""
+
+COMMENTED = "% \\begin{longtable}{ll}\nCosts 5\\% % \\begin{longtable}{l}\n" + MINIPAGE
+
+
+def _both(text: str) -> str:
+    converted = standardize_tables(text)
+    assert rewrite_latex(text, RewriteOptions(tables=True)) == converted
+    return converted
+
+
+def test_nested_longtable_stays_inside_the_outer_table():
+    converted = _both(NESTED)
+    assert converted.startswith("\\begin{table}[htbp]\n")
+    assert converted.count("\\begin{tabularx}") == 1
+    assert converted.count("\\caption{") == 2 and "\\caption{Outer.}\n\\begin{tabularx}" in converted
+    # the inner table is a cell of the outer one: its \end does not end the outer table.
+    assert "\\end{longtable} \\\\\n\nB & C \\\\\n\\end{tabularx}\n\\end{table}\nAfter.\n" in converted
+    assert "\\endhead" not in converted
+
+
+def test_caption_in_a_minipage_is_not_the_tables():
+    converted = _both(MINIPAGE)
+    assert "\\begin{minipage}[t]{0.4\\columnwidth}\n\\caption{Not the table's.}\n\\end{minipage}" in converted
+    assert converted.count("\\caption{") == 1
+    assert "\\end{minipage} \\\\\n\\bottomrule\n\\end{tabularx}\n\\end{table}" in converted
+
+
+def test_commented_longtables_are_left_alone():
+    converted = _both(COMMENTED)
+    assert converted.startswith("% \\begin{longtable}{ll}\nCosts 5\\% % \\begin{longtable}{l}\n\\begin{table}[htbp]\n")
+    assert converted.count("\\begin{table}") == 1
+
+    # the \end a commented \begin would pair with is kept as well.
+    stray = "% \\begin{longtable}{l}\nx \\\\\n\\end{longtable}\n"
+    assert _both(stray) == stray
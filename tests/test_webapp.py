@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from webapp import app as webapp
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setitem(webapp.STARTUP_CHECKS, "pandoc", True)
+    return webapp.app.test_client()
+
+
+def test_anystyle_command_must_be_allowed(client, monkeypatch):
+    looked_up = []
+    monkeypatch.setattr(webapp, "_check_cli", lambda tool: looked_up.append(tool))
+    response = client.post("/convert", data={
+        "manuscript": (io.BytesIO(b"docx"), "paper.docx"),
+        "anystyle_cmd": "/tmp/anything",
+    })
+    assert b"not allowed" in response.data
+    assert looked_up == []
+
+
+def test_metrics_count_reference_cache_lookups_of_finished_jobs(client, monkeypatch):
+    monkeypatch.setattr(webapp.REGISTRY, "enabled", True)
+    webapp.REGISTRY.reset()
+    result = SimpleNamespace(timings={}, sizes={}, reference_cache={"hit": 7, "miss": 3})
+    for _ in range(2):
+        webapp._record_job_metrics(SimpleNamespace(created_at=0.0, finished_at=1.0, result=result))
+    text = client.get("/metrics").get_data(as_text=True)
+    webapp.REGISTRY.reset()
+    assert "# TYPE msurj_reference_cache_lookups_total counter" in text
+    assert 'msurj_reference_cache_lookups_total{result="hit"} 14' in text
+    assert 'msurj_reference_cache_lookups_total{result="miss"} 6' in text
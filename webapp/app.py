@@ -1,16 +1,29 @@
 from __future__ import annotations
 
-import io
+from functools import lru_cache
+import os
 import shutil
-import tempfile
-import zipfile
 from pathlib import Path
+import tempfile
 
-from flask import Flask, render_template, request, send_file
+from flask import Flask, Request, Response, jsonify, make_response, render_template, request, url_for
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 
-from processing.get_msurj_conversion import convert_to_msurj, create_output_directory
-from processing.pandoc_intermediate import create_tex_ir
+from processing.metrics import (
+    REGISTRY,
+    REFERENCE_CACHE_LOOKUPS,
+    STAGE_SECONDS,
+    measure_stream,
+    server_timing,
+    stage,
+)
+from processing.pipeline import iter_output_entries, run_pipeline
+from processing.pipeline_cache import PipelineCache
+from processing.preflight import preflight_docx
+from processing.template_bundle import get_template_bundle
+from processing.zip_stream import stream_zip
+from webapp.jobs import DONE, JobQueue, QueueClosedError, QueueFullError
 
 
 ALLOWED_EXTENSIONS = {".docx"}
@@ -18,16 +31,106 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 TEMPLATE_DIR = PROJECT_ROOT / "output" / "template_dir"
 
 app = Flask(__name__)
-
-
+app.config.update(
+    JOB_WORKERS=min(4, os.cpu_count() or 1),
+    JOB_MAX_PENDING=16,
+    JOB_TTL_SECONDS=3600,
+    JOB_ROOT=None,
+    PIPELINE_CACHE=True,
+    PIPELINE_CACHE_DIR=None,
+    IR_BACKEND="pandoc",
+    METRICS=False,
+    FIGURE_DPI=None,
+    MEMORY_BUDGET_MB=None,
+    # anystyle commands the upload form may pick; the first is the default.
+    # only these are ever looked up or run.
+    ANYSTYLE_COMMANDS=["anystyle"],
+    # manuscripts with their figures embedded; werkzeug refuses larger bodies with a 413.
+    MAX_CONTENT_LENGTH=50 * 1024 * 1024,
+)
+app.config.from_prefixed_env("MSURJ")
+REGISTRY.enabled = bool(app.config["METRICS"])
+
+
+def _record_job_metrics(job) -> None:
+    """fold the stage times, sizes and cache lookups measured in the worker into this process's metrics."""
+    REGISTRY.observe(STAGE_SECONDS, "job", job.finished_at - job.created_at)
+    if job.result is not None:
+        REGISTRY.observe_timings(job.result.timings)
+        REGISTRY.observe_sizes(job.result.sizes)
+        for result, count in job.result.reference_cache.items():
+            REGISTRY.increment(REFERENCE_CACHE_LOOKUPS, result, count)
+
+
+jobs = JobQueue(
+    max_workers=app.config["JOB_WORKERS"],
+    max_pending=app.config["JOB_MAX_PENDING"],
+    ttl_seconds=app.config["JOB_TTL_SECONDS"],
+    root=app.config["JOB_ROOT"],
+    on_finish=_record_job_metrics if REGISTRY.enabled else None,
+)
+
+
+class SpoolingRequest(Request):
+    """
+    multipart files are written into the job root as the body is parsed,
+    whatever their size, so an upload is never held in memory and the job
+    gets it by a hard link rather than a second copy.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        jobs.root.mkdir(parents=True, exist_ok=True)
+        return tempfile.NamedTemporaryFile("wb+", dir=jobs.root, prefix=".upload-")
+
+
+app.request_class = SpoolingRequest
+
+if TEMPLATE_DIR.exists():
+    # compress the fonts and class file once so downloads only copy their bytes.
+    get_template_bundle(TEMPLATE_DIR)
+
+pipeline_cache = (
+    PipelineCache(app.config["PIPELINE_CACHE_DIR"]) if app.config["PIPELINE_CACHE"] else None
+)
+
+
+@lru_cache(maxsize=None)
 def _check_cli(tool: str) -> str | None:
+    """looked up once per process; restart the app after installing a missing tool."""
     return shutil.which(tool)
 
 
+def _startup_checks() -> dict:
+    checks = {
+        "anystyle": _check_cli(app.config["ANYSTYLE_COMMANDS"][0]) is not None,
+        "template_dir": TEMPLATE_DIR.exists(),
+    }
+    if app.config["IR_BACKEND"] != "native":
+        checks["pandoc"] = _check_cli("pandoc") is not None
+    return checks
+
+
+# tools and templates do not change while the app runs, so they are checked
+# once here (before workers fork, when served by gunicorn) and not per upload.
+STARTUP_CHECKS = _startup_checks()
+
+
 def _allowed_file(filename: str) -> bool:
     return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
 
 
+def _save_upload(upload, path: Path) -> None:
+    spooled = getattr(upload.stream, "name", None)
+    if isinstance(spooled, str):
+        upload.stream.flush()
+        try:
+            os.link(spooled, path)
+            return
+        except OSError:
+            pass
+    upload.save(path)
+
+
 @app.get("/")
 def index():
     return render_template("index.html")
@@ -42,18 +145,24 @@ def convert():
     if not _allowed_file(upload.filename):
         return render_template("index.html", error="please upload a .docx file.")
 
-    pandoc_path = _check_cli("pandoc")
-    if not pandoc_path:
+    ir_backend = app.config["IR_BACKEND"]
+    if not STARTUP_CHECKS.get("pandoc", True):
         return render_template("index.html", error="pandoc not found on PATH.")
 
-    anystyle_cmd = request.form.get("anystyle_cmd") or "anystyle"
+    anystyle_cmd = request.form.get("anystyle_cmd") or app.config["ANYSTYLE_COMMANDS"][0]
+    if anystyle_cmd not in app.config["ANYSTYLE_COMMANDS"]:
+        # the lookup cache below is keyed on it, so arbitrary values never reach it.
+        return render_template(
+            "index.html",
+            error="that anystyle path is not allowed. add it to MSURJ_ANYSTYLE_COMMANDS.",
+        )
     if not _check_cli(anystyle_cmd):
         return render_template(
             "index.html",
             error="anystyle not found. install anystyle-cli or provide a valid path.",
         )
 
-    if not TEMPLATE_DIR.exists():
+    if not STARTUP_CHECKS["template_dir"]:
         return render_template(
             "index.html",
             error="template_dir not found at /output/template_dir.",
@@ -95,49 +204,137 @@ def convert():
     }
 
     filename = secure_filename(upload.filename)
+    timings = {} if REGISTRY.enabled else None
+
+    try:
+        job = jobs.create(filename)
+    except QueueClosedError:
+        return (
+            render_template(
+                "index.html",
+                error="the server is restarting. try again in a minute.",
+            ),
+            503,
+        )
+    except QueueFullError:
+        return (
+            render_template(
+                "index.html",
+                error="the server is busy converting other manuscripts. try again in a minute.",
+            ),
+            503,
+        )
 
-    with tempfile.TemporaryDirectory() as tmp_root:
-        tmp_root = Path(tmp_root)
-        ir_tex_dir = tmp_root / "ir_tex"
-        output_root = tmp_root / "output"
-        upload_path = tmp_root / filename
-
-        upload.save(upload_path)
-
-        ir_output_dir = create_tex_ir(upload_path, ir_tex_dir=ir_tex_dir)
-        paper_num = ir_output_dir.name
-        pandoc_tex_path = ir_output_dir / f"{paper_num}.tex"
-
-        final_tex, bibtex = convert_to_msurj(
-            pandoc_tex_path=pandoc_tex_path,
-            metadata=metadata,
-            enable_citations=True,
-            return_bibtex=True,
+    try:
+        upload_path = job.work_dir / filename
+        with stage("upload", timings):
+            _save_upload(upload, upload_path)
+        with stage("preflight", timings):
+            report = preflight_docx(upload_path, ir_backend=ir_backend)
+        if not report.ok:
+            # refused before a worker runs pandoc or anystyle on it.
+            jobs.discard(job.id)
+            return _preflight_failed(report, timings)
+        jobs.start(
+            job,
+            run_pipeline,
+            upload_path,
+            metadata,
+            work_dir=job.work_dir,
             anystyle_cmd=anystyle_cmd,
+            cache=pipeline_cache,
+            ir_backend=ir_backend,
+            figure_dpi=app.config["FIGURE_DPI"],
+            memory_budget_mb=app.config["MEMORY_BUDGET_MB"],
         )
+    except Exception:
+        jobs.discard(job.id)
+        raise
+
+    if request.accept_mimetypes.best == "application/json":
+        response = make_response(jsonify(_job_payload(job)), 202)
+    else:
+        response = make_response(render_template("index.html", job=_job_payload(job)), 202)
+    if timings:
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+
+def _preflight_failed(report, timings):
+    error = "the manuscript cannot be converted: " + " ".join(p.message for p in report.errors)
+    if request.accept_mimetypes.best == "application/json":
+        response = make_response(jsonify(error=error, preflight=report.to_dict()), 422)
+    else:
+        response = make_response(render_template("index.html", error=error), 422)
+    if timings:
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+
+def _job_payload(job) -> dict:
+    payload = job.to_dict()
+    payload["status_url"] = url_for("job_status", job_id=job.id)
+    payload["download_url"] = (
+        url_for("job_download", job_id=job.id) if job.status == DONE else None
+    )
+    payload["warnings"] = job.result.warnings if job.result is not None else []
+    return payload
+
+
+@app.get("/jobs/<job_id>")
+def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job."}), 404
+    return jsonify(_job_payload(job))
+
+
+@app.get("/jobs/<job_id>/download")
+def job_download(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown or expired job."}), 404
+    if job.status != DONE:
+        return jsonify(_job_payload(job)), 409
+
+    result = job.result
+    chunks = stream_zip(iter_output_entries(result, TEMPLATE_DIR))
+    headers = {"Content-Disposition": f'attachment; filename="{result.paper_num}.zip"'}
+    if REGISTRY.enabled:
+        chunks = measure_stream(chunks, stage_name="zip", artifact="zip")
+        headers["Server-Timing"] = server_timing(result.timings)
+    return Response(chunks, mimetype="application/zip", headers=headers)
+
+
+@app.errorhandler(RequestEntityTooLarge)
+def upload_too_large(exc):
+    limit_mb = app.config["MAX_CONTENT_LENGTH"] / (1024 * 1024)
+    return (
+        render_template(
+            "index.html",
+            error=f"the manuscript is larger than the {limit_mb:g} MB upload limit.",
+        ),
+        413,
+    )
 
-        create_output_directory(
-            pandoc_tex_path,
-            final_tex,
-            bibtex_content=bibtex,
-            output_root=output_root,
-            template_dir=TEMPLATE_DIR,
-            figures_dir=ir_output_dir / "Figures",
-        )
 
-        zip_bytes = io.BytesIO()
-        with zipfile.ZipFile(zip_bytes, "w", zipfile.ZIP_DEFLATED) as zf:
-            for path in (output_root / paper_num).rglob("*"):
-                zf.write(path, path.relative_to(output_root))
-        zip_bytes.seek(0)
-
-    return send_file(
-        zip_bytes,
-        as_attachment=True,
-        download_name=f"{paper_num}.zip",
-        mimetype="application/zip",
+@app.get("/ready")
+def ready():
+    """200 once pandoc, anystyle and the template were found at startup and uploads are accepted."""
+    checks = dict(STARTUP_CHECKS, accepting_jobs=not jobs.closed)
+    return jsonify({"ready": all(checks.values()), "checks": checks}), (
+        200 if all(checks.values()) else 503
     )
 
 
+@app.get("/metrics")
+def metrics():
+    if not REGISTRY.enabled:
+        return jsonify({"error": "metrics are disabled."}), 404
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    # development server; editors sharing a machine should be served with
+    # gunicorn --config webapp/gunicorn.conf.py webapp.app:app
+    app.run(debug=app.config["DEBUG"])
@@ -0,0 +1,61 @@
+"""
+gunicorn settings for serving the app to several editors:
+
+    gunicorn --config webapp/gunicorn.conf.py webapp.app:app
+"""
+import os
+
+
+bind = os.environ.get("MSURJ_BIND", "127.0.0.1:5000")
+
+# jobs are kept in the memory of the process that took the upload, so status
+# polls and downloads must reach the same one: a single worker process whose
+# threads serve requests while conversions run in its job pool (MSURJ_JOB_WORKERS).
+workers = 1
+worker_class = "gthread"
+threads = int(os.environ.get("MSURJ_HTTP_THREADS", "8"))
+
+# import flask, the processing modules and the template bundle once in the
+# master, and check pandoc/anystyle there, before the worker forks.
+preload_app = True
+
+# with gthread this is only the worker heartbeat: the master restarts a worker
+# that has not checked in for this long. requests themselves are not timed out.
+timeout = int(os.environ.get("MSURJ_REQUEST_TIMEOUT", "120"))
+keepalive = 5
+limit_request_line = 8190
+limit_request_fields = 100
+
+# on SIGTERM the worker stops taking uploads (/ready answers 503) but keeps
+# serving while running conversions finish, then for drain_seconds more so
+# editors can download them. the master kills it after graceful_timeout.
+graceful_timeout = int(os.environ.get("MSURJ_SHUTDOWN_TIMEOUT", "300"))
+drain_seconds = int(os.environ.get("MSURJ_DRAIN_SECONDS", "30"))
+
+
+def post_worker_init(worker):
+    import signal
+    import threading
+    import time
+
+    from webapp.app import jobs
+
+    def drain():
+        # leave the worker a little of the grace period to exit on its own.
+        jobs.wait(timeout=max(0, graceful_timeout - drain_seconds - 10))
+        time.sleep(drain_seconds)
+        worker.alive = False
+
+    def handle_term(signum, frame):
+        if not jobs.closed:
+            jobs.close()
+            threading.Thread(target=drain, name="drain", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_term)
+
+
+def worker_exit(server, worker):
+    from webapp.app import jobs
+
+    # no request can reach a result any more: cancel what is left and clean up.
+    jobs.shutdown(wait=False)
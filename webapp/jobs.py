@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+from concurrent.futures import Future, ProcessPoolExecutor, wait as wait_for
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+import multiprocessing
+from pathlib import Path
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(RuntimeError):
+    pass
+
+
+class QueueClosedError(RuntimeError):
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    filename: str
+    work_dir: Path
+    created_at: float
+    future: Optional[Future] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Any = None
+
+    @property
+    def status(self) -> str:
+        if self.finished_at is None:
+            if self.future is not None and self.future.running():
+                return RUNNING
+            return QUEUED
+        if self.error is not None:
+            return FAILED
+        return DONE
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+@dataclass
+class JobQueue:
+    """
+    bounded process pool for conversions.
+    at most max_workers jobs run at once and max_pending more may wait;
+    finished jobs and their work dirs are dropped after ttl_seconds.
+    on_finish, if set, is called with each job once its result or error is in.
+    """
+
+    max_workers: int = 2
+    max_pending: int = 16
+    ttl_seconds: float = 3600.0
+    root: Optional[Path] = None
+    on_finish: Optional[Callable[[Job], None]] = None
+    _jobs: Dict[str, Job] = field(default_factory=dict, init=False)
+    _executor: Optional[ProcessPoolExecutor] = field(default=None, init=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, init=False)
+    _closed: bool = field(default=False, init=False)
+
+    def __post_init__(self) -> None:
+        if self.root is None:
+            self.root = Path(tempfile.gettempdir()) / "msurj-jobs"
+        self.root = Path(self.root)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def _drop_executor(self, executor: ProcessPoolExecutor) -> None:
+        """
+        forget a pool that broke because a worker died (oom, a crash in pandoc
+        or pillow), so the next job gets a fresh one. the broken pool has
+        already failed its jobs and stops its processes itself.
+        """
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def _active_count(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.finished_at is None)
+
+    def create(self, filename: str) -> Job:
+        self.cleanup_expired()
+        with self._lock:
+            if self._closed:
+                raise QueueClosedError("conversion queue is shutting down.")
+            if self._active_count() >= self.max_workers + self.max_pending:
+                raise QueueFullError("conversion queue is full.")
+            self.root.mkdir(parents=True, exist_ok=True)
+            job_id = uuid.uuid4().hex
+            work_dir = Path(tempfile.mkdtemp(prefix=f"{job_id}-", dir=self.root))
+            job = Job(id=job_id, filename=filename, work_dir=work_dir, created_at=time.time())
+            self._jobs[job_id] = job
+        return job
+
+    def start(self, job: Job, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Job:
+        executor = self._get_executor()
+        try:
+            try:
+                future = executor.submit(fn, *args, **kwargs)
+            except BrokenProcessPool:
+                # broken before any of its jobs finished to tell us: retry once on a fresh pool.
+                self._drop_executor(executor)
+                executor = self._get_executor()
+                future = executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self.discard(job.id)
+            raise
+        job.future = future
+        future.add_done_callback(lambda f: self._finish(job, f, executor))
+        return job
+
+    def _finish(self, job: Job, future: Future, executor: ProcessPoolExecutor) -> None:
+        exc = future.exception()
+        if isinstance(exc, BrokenProcessPool):
+            # every job on the pool fails with this; the next ones get a new pool.
+            self._drop_executor(executor)
+            job.error = "the conversion process crashed, possibly out of memory."
+        elif exc is not None:
+            job.error = str(exc) or exc.__class__.__name__
+        else:
+            job.result = future.result()
+        job.finished_at = time.time()
+        if self.on_finish is not None:
+            self.on_finish(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.cleanup_expired()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id: str) -> None:
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            shutil.rmtree(job.work_dir, ignore_errors=True)
+
+    def cleanup_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            expired = [
+                job_id
+                for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+        for job_id in expired:
+            self.discard(job_id)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self) -> None:
+        """stop taking jobs; queued and running ones carry on and stay downloadable."""
+        with self._lock:
+            self._closed = True
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """wait up to timeout seconds for queued and running jobs; True if none are left."""
+        with self._lock:
+            unfinished = [
+                job.future
+                for job in self._jobs.values()
+                if job.future is not None and job.finished_at is None
+            ]
+        if not unfinished:
+            return True
+        return not wait_for(unfinished, timeout=timeout).not_done
+
+    def shutdown(self, *, wait: bool = True, timeout: Optional[float] = None) -> None:
+        """
+        close the queue and drop every job: with wait, queued and running
+        conversions get up to timeout seconds (None: as long as they need)
+        before the rest are cancelled. results are gone afterwards, so close()
+        and wait() while still serving when editors should get them.
+        """
+        self.close()
+        finished = self.wait(timeout) if wait else False
+        if self._executor is not None:
+            self._executor.shutdown(wait=finished, cancel_futures=not finished)
+            self._executor = None
+        with self._lock:
+            job_ids = list(self._jobs)
+        for job_id in job_ids:
+            self.discard(job_id)